@@ -3,12 +3,12 @@
 """
 AWS data retrieval module
 """
-from pyDataverse.api import NativeApi
 import pandas as pd
 import xarray as xr
-import unittest, pkg_resources
+import unittest
 from datetime import datetime
 import warnings, os
+from pathlib import Path
 
 def aws_names():
     '''Return PROMICE and GC-Net AWS names that can be used in get.aws_data() 
@@ -114,6 +114,72 @@ def watson_discharge(t='hour'):
 
     return df
 
+def aws_parquet(path, stations=None, start=None, end=None, variables=None):
+    '''Return AWS observations of several stations over a time range from a
+    Parquet dataset written by pypromice.process.write.writeParquet. Only the
+    files of the requested stations and years are opened, and their row
+    groups outside the time range are skipped using the row group
+    statistics. Requires the pyarrow package.
+
+    Parameters
+    ----------
+    path : str
+        Root folder of the Parquet dataset, with station=<id>/year=<year>
+        partitions
+    stations : list, optional
+        Station or site ids. The default is all stations.
+    start : str or datetime, optional
+        First time to return. The default is the start of the data.
+    end : str or datetime, optional
+        Last time to return. The default is the end of the data.
+    variables : list, optional
+        Variables to return. The default is all variables.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        AWS observations dataframe, indexed by station and time
+    '''
+    import pyarrow as pa
+    import pyarrow.dataset as pds
+    import pyarrow.parquet as pq
+
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+    files = []
+    for station_dir in sorted(Path(path).glob('station=*')):
+        if stations is not None and station_dir.name[8:] not in stations:
+            continue
+        for year_dir in sorted(station_dir.glob('year=*')):
+            year = int(year_dir.name[5:])
+            if (start is not None and year < start.year) or \
+                    (end is not None and year > end.year):
+                continue
+            files += [f.as_posix() for f in sorted(year_dir.glob('*.parquet'))]
+
+    # stations can have different variables
+    partition_schema = pa.schema([('station', pa.dictionary(pa.int32(), pa.string())),
+                                  ('year', pa.int32())])
+    schemas = [pq.read_schema(f) for f in files] or [pa.schema([('time', pa.timestamp('ns'))])]
+    schema = pa.unify_schemas(schemas + [partition_schema])
+    names = sorted({Path(f).parent.parent.name[8:] for f in files})
+    partitioning = pds.partitioning(partition_schema, flavor='hive',
+                                    dictionaries={'station': pa.array(names, pa.string())})
+    dataset = pds.dataset(files, schema=schema, format='parquet',
+                          partitioning=partitioning, partition_base_dir=Path(path).as_posix())
+
+    expression = None
+    if start is not None:
+        expression = pds.field('time') >= start
+    if end is not None:
+        before_end = pds.field('time') <= end
+        expression = before_end if expression is None else expression & before_end
+    columns = [c for c in schema.names if c != 'year']
+    if variables is not None:
+        columns = ['station', 'time'] + [v for v in variables if v in schema.names]
+    df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+    return df.set_index(['station', 'time']).sort_index()
+
 def lookup_table(base_dois,
                  server='https://dataverse.geus.dk'):
     '''Fetch dictionary of data files and download URLs from a DOI entry in the
@@ -126,6 +192,8 @@ def lookup_table(base_dois,
     server : str, optional
         DOI server. The default is "https://dataverse.geus.dk"
     '''
+    from pyDataverse.api import NativeApi
+
     # Prime API
     dataverse_server = server.strip("/")
     api = NativeApi(dataverse_server)
@@ -18,16 +18,6 @@ from typing import BinaryIO, Optional
 import attrs
 import numpy as np
 import pandas as pd
-from eccodes import (
-    codes_set,
-    codes_write,
-    codes_release,
-    codes_bufr_new_from_samples,
-    CodesInternalError,
-    codes_is_defined,
-    codes_bufr_new_from_file,
-    codes_get,
-)
 
 logger = logging.getLogger(__name__)
 
@@ -232,6 +222,13 @@ def write_bufr_message(
     file
         Binary writable file object
     """
+    from eccodes import (
+        CodesInternalError,
+        codes_bufr_new_from_samples,
+        codes_release,
+        codes_set,
+        codes_write,
+    )
 
     # Create new bufr message to write to
     ibufr = codes_bufr_new_from_samples("BUFR4")
@@ -272,6 +269,8 @@ def set_template(ibufr, timestamp, station_type: str):
     config_key : str
         Defines which config dict to use in wmo_config.ibufr_settings, 'mobile' or 'land'
     """
+    from eccodes import codes_is_defined, codes_set
+
     template = BUFR_TEMPLATES[station_type]
 
     for k, v in template.items():
@@ -299,6 +298,8 @@ def set_station(ibufr, station_type: str, wmo_id: str):
     config_key : str
         Defines which config dict to use in wmo_config.ibufr_settings, 'mobile' or 'land'
     """
+    from eccodes import codes_set
+
     if station_type == "mobile":
         station_config = dict(shipOrMobileLandStationIdentifier=wmo_id)
     elif station_type == "land":
@@ -364,6 +365,8 @@ def set_AWS_variables(
     # appear to have the same positions for all parameters that are set here.
     # View the output BUFR to see section keys with 'bufr_dump filename.bufr'.
     if math.isnan(variables.windSpeed) is False:
+        from eccodes import codes_set
+
         # Set time significance (2=temporally averaged)
         codes_set(ibufr, "#1#timeSignificance", 2)
         # Set monitoring time period (-10=10 minutes)
@@ -400,6 +403,8 @@ def set_bufr_value(ibufr, b_name, value):
     value : int/float
         Value to be assigned to variable
     """
+    from eccodes import CodesInternalError, codes_set
+
     if math.isnan(value) is False:
         try:
             codes_set(ibufr, b_name, value)
@@ -421,6 +426,8 @@ def get_bufr_value(msgid: int, key: str) -> float:
 
     Note: windDirection and relativeHumidity are serialized as integer in the BUFR message.
     """
+    from eccodes import codes_get
+
     value = codes_get(msgid, key)
 
     if isinstance(value, int):
@@ -454,6 +461,8 @@ def read_bufr_message(fp: BinaryIO, backwards_compatible: bool = False) -> Optio
     BUFRVariables
         AWS variables or None if there are no messages in stream
     """
+    from eccodes import codes_bufr_new_from_file, codes_get, codes_release, codes_set
+
     ibufr = codes_bufr_new_from_file(fp)
     if ibufr is None:
         return None
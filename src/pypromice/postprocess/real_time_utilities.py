@@ -11,7 +11,6 @@ from typing import Optional, Collection
 
 import numpy as np
 import pandas as pd
-from sklearn.linear_model import LinearRegression
 
 __all__ = ["get_latest_data"]
 
@@ -230,6 +229,8 @@ def linear_fit(df, column, decimals):
         If False, we need to return this status to find_positions and use full station history instead.
     """
     # print('=========== linear_fit ===========')
+    from sklearn.linear_model import LinearRegression
+
     pos_valid = True
     if column in df:
         df_dropna = df[
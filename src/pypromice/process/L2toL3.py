@@ -5,9 +5,11 @@ AWS Level 2 (L2) to Level 3 (L3) data processing
 import pandas as pd
 import numpy as np
 import xarray as xr
-from sklearn.linear_model import LinearRegression
 from pypromice.qc.github_data_issues import adjustData
-from scipy.interpolate import interp1d
+from pypromice.qc.hampel import hampel_filter
+from pypromice.utilities.rolling import rolling_median_time
+from pypromice.utilities.runs import find_runs
+from pypromice.utilities.segments import segment_sum
 from pathlib import Path
 import logging
 
@@ -39,6 +41,57 @@ def toL3(L2,
     ds = L2
     ds.attrs['level'] = 'L3'
 
+    # Turbulent heat flux and specific humidity calculation
+    ds = process_turbulent_heat_fluxes(ds, T_0)
+
+    if len(station_config)==0:
+        logger.warning('\n***\nThe station configuration file is missing or improperly passed to pypromice. Some processing steps might fail.\n***\n')
+
+    # Smoothing and inter/extrapolation of GPS coordinates
+    for var, values in gps_coordinates_postprocessing(ds, station_config).items():
+        ds[var] = ('time', values)
+
+    # processing continuous surface height, ice surface height, snow height
+    try:
+        ds = process_surface_height(ds, data_adjustments_dir, station_config)
+    except Exception as e:
+        logger.error("Error processing surface height at %s"%L2.attrs['station_id'])
+        logging.error(e, exc_info=True)
+
+    # making sure dataset has the attributes contained in the config files
+    if 'project' in station_config.keys():
+        ds.attrs['project'] = station_config['project']
+    else:
+        logger.error('No project info in station_config. Using \"PROMICE\".')
+        ds.attrs['project'] = "PROMICE"
+
+    if 'location_type' in station_config.keys():
+        ds.attrs['location_type'] = station_config['location_type']
+    else:
+        logger.error('No project info in station_config. Using \"ice sheet\".')
+        ds.attrs['location_type'] = "ice sheet"
+
+    return ds
+
+
+def process_turbulent_heat_fluxes(ds, T_0=273.15):
+    '''Calculates the specific humidity and the turbulent heat fluxes of the
+    upper boom and, for two-boom stations, of the lower boom. All calculations
+    only use values from the same timestamp.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        L2 AWS data
+    T_0 : int
+        Freezing point temperature. Default is 273.15.
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with the variables qh_u, dshf_u, dlhf_u (and qh_l, dshf_l,
+        dlhf_l) added where they can be calculated
+    '''
     T_100 = T_0+100                                                            # Get steam point temperature as K
 
     # Turbulent heat flux calculation
@@ -103,34 +156,6 @@ def toL3(L2,
             ds['qh_l'] = (('time'), q_h_l.data)
         else:
             logger.info('t_l, p_l or rh_l_wrt_ice_or_water missing, cannot calulate tubrulent heat fluxes')
-
-    if len(station_config)==0:
-        logger.warning('\n***\nThe station configuration file is missing or improperly passed to pypromice. Some processing steps might fail.\n***\n')
-
-    # Smoothing and inter/extrapolation of GPS coordinates
-    for var in ['gps_lat', 'gps_lon', 'gps_alt']:
-        ds[var.replace('gps_','')] = ('time', gps_coordinate_postprocessing(ds, var, station_config))
-
-    # processing continuous surface height, ice surface height, snow height
-    try:
-        ds = process_surface_height(ds, data_adjustments_dir, station_config)
-    except Exception as e:
-        logger.error("Error processing surface height at %s"%L2.attrs['station_id'])
-        logging.error(e, exc_info=True)
-
-    # making sure dataset has the attributes contained in the config files
-    if 'project' in station_config.keys():
-        ds.attrs['project'] = station_config['project']
-    else:
-        logger.error('No project info in station_config. Using \"PROMICE\".')
-        ds.attrs['project'] = "PROMICE"
-
-    if 'location_type' in station_config.keys():
-        ds.attrs['location_type'] = station_config['location_type']
-    else:
-        logger.error('No project info in station_config. Using \"ice sheet\".')
-        ds.attrs['location_type'] = "ice sheet"
-
     return ds
 
 
@@ -154,37 +179,7 @@ def process_surface_height(ds, data_adjustments_dir, station_config={}):
         'z_surf_1', 'z_surf_2', 'z_ice_surf', 'z_surf_combined', 'snow_height',
         and possibly depth variables derived from temperature measurements.
     """
-    # Initialize surface height variables with NaNs
-    ds['z_surf_1'] = ('time', ds['z_boom_u'].data * np.nan)
-    ds['z_surf_2'] = ('time', ds['z_boom_u'].data * np.nan)
-
-    if ds.attrs['site_type'] == 'ablation':
-        # Calculate surface heights for ablation sites
-        ds['z_surf_1'] = 2.6 - ds['z_boom_u']
-        if ds.z_stake.notnull().any():
-            first_valid_index = ds.time.where((ds.z_stake + ds.z_boom_u).notnull(), drop=True).data[0]
-            ds['z_surf_2'] = ds.z_surf_1.sel(time=first_valid_index) + ds.z_stake.sel(time=first_valid_index) - ds['z_stake']
-
-        # Use corrected point data if available
-        if 'z_pt_cor' in ds.data_vars:
-            ds['z_ice_surf'] = ('time', ds['z_pt_cor'].data)
-
-    else:
-        # Calculate surface heights for other site types
-        first_valid_index = ds.time.where(ds.z_boom_u.notnull(), drop=True).data[0]
-        ds['z_surf_1'] = ds.z_boom_u.sel(time=first_valid_index) - ds['z_boom_u']
-        if 'z_stake' in ds.data_vars and ds.z_stake.notnull().any():
-            first_valid_index = ds.time.where(ds.z_stake.notnull(), drop=True).data[0]
-            ds['z_surf_2'] = ds.z_stake.sel(time=first_valid_index) - ds['z_stake']
-        if 'z_boom_l' in ds.data_vars:
-            # need a combine first because KAN_U switches from having a z_stake
-            # to having a z_boom_l
-            first_valid_index = ds.time.where(ds.z_boom_l.notnull(), drop=True).data[0]
-            ds['z_surf_2'] = ds['z_surf_2'].combine_first(
-                ds.z_boom_l.sel(time=first_valid_index) - ds['z_boom_l'])
-
-    # Adjust data for the created surface height variables
-    ds = adjustData(ds, data_adjustments_dir, var_list=['z_surf_1', 'z_surf_2', 'z_ice_surf'])
+    ds = surface_height_inputs(ds, data_adjustments_dir)
 
     # Convert to dataframe and combine surface height variables
     df_in = ds[[v for v in ['z_surf_1', 'z_surf_2', 'z_ice_surf'] if v in ds.data_vars]].to_dataframe()
@@ -194,60 +189,20 @@ def process_surface_height(ds, data_adjustments_dir, station_config={}):
 
 
     if ds.attrs['site_type'] == 'ablation':
-        # Calculate rolling minimum for ice surface height and snow height
-        ts_interpolated = np.minimum(
-            xr.where(ds.z_ice_surf.notnull(),
-                     ds.z_ice_surf,ds.z_surf_combined),
-            ds.z_surf_combined).to_series().resample('h').interpolate(limit=72)
-
-        if len(ts_interpolated)>24*7:
-            # Apply the rolling window with median calculation
-            z_ice_surf = (ts_interpolated
-                          .rolling('14D', center=True, min_periods=1)
-                          .median())
-            # Overprint the first and last 7 days with interpolated values
-            # because of edge effect of rolling windows
-            z_ice_surf.iloc[:24*7] = (ts_interpolated.iloc[:24*7]
-                                      .rolling('1D', center=True, min_periods=1)
-                                      .median().values)
-            z_ice_surf.iloc[-24*7:] = (ts_interpolated.iloc[-24*7:]
-                                       .rolling('1D', center=True, min_periods=1)
-                                       .median().values)
-        else:
-            z_ice_surf = (ts_interpolated
-                                       .rolling('1D', center=True, min_periods=1)
-                                       .median())
-
-        z_ice_surf = z_ice_surf.loc[ds.time]
-        # here we make sure that the periods where both z_stake and z_pt are
-        # missing are also missing in z_ice_surf
-        msk = ds['z_ice_surf'].notnull() | ds['z_surf_2_adj'].notnull()
-        z_ice_surf = z_ice_surf.where(msk)
+        # smoothed ice surface height, missing where both z_pt and z_stake
+        # are missing
+        z_ice_surf = smooth_ice_surface_height(ds.z_ice_surf.to_series(),
+                                               ds.z_surf_combined.to_series(),
+                                               ds.z_surf_2_adj.to_series())
 
         # taking running minimum to get ice
         z_ice_surf = z_ice_surf.cummin()
 
         # filling gaps only if they are less than a year long and if values on both
         # sides are less than 0.01 m appart
-
-        # Forward and backward fill to identify bounds of gaps
-        df_filled = z_ice_surf.fillna(method='ffill').fillna(method='bfill')
-
-        # Identify gaps and their start and end dates
-        gaps = pd.DataFrame(index=z_ice_surf[z_ice_surf.isna()].index)
-        gaps['prev_value'] = df_filled.shift(1)
-        gaps['next_value'] = df_filled.shift(-1)
-        gaps['gap_start'] = gaps.index.to_series().shift(1)
-        gaps['gap_end'] = gaps.index.to_series().shift(-1)
-        gaps['gap_duration'] = (gaps['gap_end'] - gaps['gap_start']).dt.days
-        gaps['value_diff'] = (gaps['next_value'] - gaps['prev_value']).abs()
-
-        # Determine which gaps to fill
-        mask = (gaps['gap_duration'] < 365) & (gaps['value_diff'] < 0.01)
-        gaps_to_fill = gaps[mask].index
-
-        # Fill gaps in the original Series
-        z_ice_surf.loc[gaps_to_fill] = df_filled.loc[gaps_to_fill]
+        z_ice_surf[:] = fill_short_gaps(z_ice_surf.index.values, z_ice_surf.values,
+                                        max_duration=np.timedelta64(365, 'D'),
+                                        max_diff=0.01)
 
         # bringing the variable into the dataset
         ds['z_ice_surf'] = z_ice_surf
@@ -277,6 +232,149 @@ def process_surface_height(ds, data_adjustments_dir, station_config={}):
 
     return ds
 
+def surface_height_inputs(ds, data_adjustments_dir):
+    """
+    Create the surface height variables z_surf_1, z_surf_2 and z_ice_surf
+    from the sonic rangers, the stake and the pressure transducer, and apply
+    the data adjustments of the station to them.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        The dataset containing the 'site_type' attribute and the variables
+        'z_boom_u', 'z_stake', 'z_pt_cor', etc.
+    data_adjustments_dir : Path
+        Directory of the data adjustment files
+
+    Returns
+    -------
+    xarray.Dataset
+        The dataset with the variables 'z_surf_1', 'z_surf_2' and, at
+        ablation sites with a pressure transducer, 'z_ice_surf'
+    """
+    # Initialize surface height variables with NaNs
+    ds['z_surf_1'] = ('time', ds['z_boom_u'].data * np.nan)
+    ds['z_surf_2'] = ('time', ds['z_boom_u'].data * np.nan)
+
+    if ds.attrs['site_type'] == 'ablation':
+        # Calculate surface heights for ablation sites
+        ds['z_surf_1'] = 2.6 - ds['z_boom_u']
+        if ds.z_stake.notnull().any():
+            first_valid_index = ds.time.where((ds.z_stake + ds.z_boom_u).notnull(), drop=True).data[0]
+            ds['z_surf_2'] = ds.z_surf_1.sel(time=first_valid_index) + ds.z_stake.sel(time=first_valid_index) - ds['z_stake']
+
+        # Use corrected point data if available
+        if 'z_pt_cor' in ds.data_vars:
+            ds['z_ice_surf'] = ('time', ds['z_pt_cor'].data)
+
+    else:
+        # Calculate surface heights for other site types
+        first_valid_index = ds.time.where(ds.z_boom_u.notnull(), drop=True).data[0]
+        ds['z_surf_1'] = ds.z_boom_u.sel(time=first_valid_index) - ds['z_boom_u']
+        if 'z_stake' in ds.data_vars and ds.z_stake.notnull().any():
+            first_valid_index = ds.time.where(ds.z_stake.notnull(), drop=True).data[0]
+            ds['z_surf_2'] = ds.z_stake.sel(time=first_valid_index) - ds['z_stake']
+        if 'z_boom_l' in ds.data_vars:
+            # need a combine first because KAN_U switches from having a z_stake
+            # to having a z_boom_l
+            first_valid_index = ds.time.where(ds.z_boom_l.notnull(), drop=True).data[0]
+            ds['z_surf_2'] = ds['z_surf_2'].combine_first(
+                ds.z_boom_l.sel(time=first_valid_index) - ds['z_boom_l'])
+
+    # Adjust data for the created surface height variables
+    ds = adjustData(ds, data_adjustments_dir, var_list=['z_surf_1', 'z_surf_2', 'z_ice_surf'])
+    return ds
+
+
+def smooth_ice_surface_height(z_ice_surf, z_surf_combined, z_surf_2_adj):
+    """
+    Smoothed ice surface height of an ablation site, before its running
+    minimum is taken. The ice surface height is taken from the adjusted
+    pressure transducer, or from the combined surface height where it is
+    missing, resampled hourly and smoothed with a 14-day rolling median. The
+    first and last 7 days are smoothed with a 1-day rolling median instead.
+
+    Parameters
+    ----------
+    z_ice_surf : pandas.Series
+        Ice surface height adjusted from the pressure transducer
+    z_surf_combined : pandas.Series
+        Combined surface height
+    z_surf_2_adj : pandas.Series
+        Surface height adjusted from the stake
+
+    Returns
+    -------
+    pandas.Series
+        Smoothed ice surface height, missing where both the pressure
+        transducer and the stake are missing
+    """
+    ts_interpolated = np.minimum(
+        z_ice_surf.where(z_ice_surf.notnull(), z_surf_combined),
+        z_surf_combined).resample('h').interpolate(limit=72)
+
+    if len(ts_interpolated)>24*7:
+        # Apply the rolling window with median calculation
+        z_ice_surf_smooth = rolling_median_time(ts_interpolated, '14D', center=True)
+        # Overprint the first and last 7 days with interpolated values
+        # because of edge effect of rolling windows
+        z_ice_surf_smooth.iloc[:24*7] = rolling_median_time(
+            ts_interpolated.iloc[:24*7], '1D', center=True).values
+        z_ice_surf_smooth.iloc[-24*7:] = rolling_median_time(
+            ts_interpolated.iloc[-24*7:], '1D', center=True).values
+    else:
+        z_ice_surf_smooth = rolling_median_time(ts_interpolated, '1D', center=True)
+
+    z_ice_surf_smooth = z_ice_surf_smooth.loc[z_ice_surf.index]
+    # here we make sure that the periods where both z_stake and z_pt are
+    # missing are also missing in z_ice_surf
+    msk = z_ice_surf.notnull() | z_surf_2_adj.notnull()
+    return z_ice_surf_smooth.where(msk)
+
+
+def fill_short_gaps(time, values, max_duration, max_diff):
+    '''Fills the gaps of a series with the last value before the gap, if the
+    gap lasts less than max_duration and if the values on both sides of the
+    gap differ by less than max_diff. Gaps at the start (end) of the series
+    are filled with the first (last) valid value if they last less than
+    max_duration.
+
+    Parameters
+    ----------
+    time : numpy.ndarray
+        array of datetime64
+    values : numpy.ndarray
+        values to be gap-filled
+    max_duration : numpy.timedelta64
+        maximum duration between the valid values bounding a gap
+    max_diff : float
+        maximum absolute difference between the values bounding a gap
+
+    Returns
+    -------
+    numpy.ndarray
+        gap-filled copy of values
+    '''
+    values = np.array(values, dtype=float)
+    n = len(values)
+    starts, ends = find_runs(np.isnan(values))
+    has_before = starts > 0
+    has_after = ends < n - 1
+    before = np.where(has_before, starts - 1, starts)
+    after = np.where(has_after, ends + 1, ends)
+
+    duration = time[after] - time[before]
+    with np.errstate(invalid="ignore"):
+        diff_ok = (np.abs(values[after] - values[before]) < max_diff) \
+            | ~(has_before & has_after)
+    to_fill = (has_before | has_after) & (duration < max_duration) & diff_ok
+
+    fill_value = np.where(has_before, values[before], values[after])
+    for start, end, value in zip(starts[to_fill], ends[to_fill], fill_value[to_fill]):
+        values[start:end+1] = value
+    return values
+
+
 def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
     '''Combines the data from three sensor: the two sonic rangers and the
     pressure transducer, to recreate the surface height, the ice surface height
@@ -313,8 +411,8 @@ def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
 
     if site_type in ['accumulation', 'bedrock']:
         logger.info('-> no z_pt or accumulation site: averaging z_surf_1 and z_surf_2')
-        df["z_surf_1_adj"] = hampel(df["z_surf_1"].interpolate(limit=72)).values
-        df["z_surf_2_adj"] = hampel(df["z_surf_2"].interpolate(limit=72)).values
+        df[["z_surf_1_adj", "z_surf_2_adj"]] = hampel(
+            df[["z_surf_1", "z_surf_2"]].interpolate(limit=72)).values
         # adjusting z_surf_2 to z_surf_1
         df["z_surf_2_adj"]  = df["z_surf_2_adj"]  + (df["z_surf_1_adj"]- df["z_surf_2_adj"]).mean()
         # z_surf_combined is the average of the two z_surf
@@ -333,11 +431,8 @@ def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
         logger.info('-> ablation site')
         # smoothing and filtering pressure transducer data
         df["z_ice_surf_adj"] = hampel(df["z_ice_surf"].interpolate(limit=72)).values
-        df["z_surf_1_adj"] = hampel(df["z_surf_1"].interpolate(limit=72)).values
-        df["z_surf_2_adj"] = hampel(df["z_surf_2"].interpolate(limit=72)).values
-
-        df["z_surf_1_adj"] = hampel(df["z_surf_1"].interpolate(limit=72), k=24, t0=5).values
-        df["z_surf_2_adj"] = hampel(df["z_surf_2"].interpolate(limit=72), k=24, t0=5).values
+        df[["z_surf_1_adj", "z_surf_2_adj"]] = hampel(
+            df[["z_surf_1", "z_surf_2"]].interpolate(limit=72), k=24, t0=5).values
 
         # defining ice ablation period from the decrease of a smoothed version of z_pt
         # meaning when smoothed_z_pt.diff() < threshold_ablation
@@ -359,60 +454,68 @@ def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
 
 
         # finding the beginning and end of each period with True
-        idx = np.argwhere(np.diff(np.r_[False,ind_ablation, False])).reshape(-1, 2)
-        idx[:, 1] -= 1
+        time = df.index.values
+        starts, ends = find_runs(ind_ablation)
 
         # fill small gaps in the ice ablation periods.
-        for i in range(len(idx)-1):
-            ind = idx[i]
-            ind_next = idx[i+1]
-            # if the end of an ablation period is less than 60 days away from
-            # the next ablation, then it is still considered like the same ablation
-            # season
-            if df.index[ind_next[0]]-df.index[ind[1]]<pd.to_timedelta('60 days'):
-                ind_ablation[ind[1]:ind_next[0]]=True
-
-        # finding the beginning and end of each period with True
-        idx = np.argwhere(np.diff(np.r_[False,ind_ablation, False])).reshape(-1, 2)
-        idx[:, 1] -= 1
+        # if the end of an ablation period is less than 60 days away from
+        # the next ablation, then it is still considered like the same ablation
+        # season
+        close_gaps = (time[starts[1:]] - time[ends[:-1]]) < np.timedelta64(60, 'D')
+        for gap_start, gap_end in zip(ends[:-1][close_gaps], starts[1:][close_gaps]):
+            ind_ablation[gap_start:gap_end] = True
 
         # because the smooth_PT sees 7 days ahead, it starts showing a decline
         # 7 days in advance, we therefore need to exclude the first 7 days of
         # each ablation period
-        for start, end in idx:
-            period_start = df.index[start]
-            period_end = period_start + pd.Timedelta(days=7)
-            exclusion_period = (df.index >= period_start) & (df.index < period_end)
-            ind_ablation[exclusion_period] = False
-
-        hs1=df["z_surf_1_adj"].interpolate(limit=24*2).copy()
-        hs2=df["z_surf_2_adj"].interpolate(limit=24*2).copy()
-        z=df["z_ice_surf_adj"].interpolate(limit=24*2).copy()
+        starts, _ = find_runs(ind_ablation)
+        exclusion_ends = np.searchsorted(time, time[starts] + np.timedelta64(7, 'D'))
+        for start, end in zip(starts, exclusion_ends):
+            ind_ablation[start:end] = False
+
+        # the surface heights are adjusted through piecewise-constant offsets
+        # which are only applied to the full series once all the adjustments
+        # have been decided
+        hs1 = _OffsetSeries(df["z_surf_1_adj"].interpolate(limit=24*2).values)
+        hs2 = _OffsetSeries(df["z_surf_2_adj"].interpolate(limit=24*2).values)
+        z = _OffsetSeries(df["z_ice_surf_adj"].interpolate(limit=24*2).values)
+
+        def window(start, end, include_end=False):
+            # positions [a, b) of the timestamps between start and end
+            return (np.searchsorted(time, np.datetime64(start)),
+                    np.searchsorted(time, np.datetime64(end),
+                                    side='right' if include_end else 'left'))
+
+        def around(pos, before, after):
+            # positions of the timestamps within [t - before, t + after)
+            return window(time[pos] - pd.Timedelta(before),
+                          time[pos] + pd.Timedelta(after))
 
         # the surface heights are adjusted so that they start at 0
+        first_week = window(time[0], time[0] + pd.Timedelta('7D'))
 
+        if hs2.any_valid(*first_week):
+            hs2.shift_from(0, -hs2.nanmean(*first_week))
 
-        if any(~np.isnan(hs2.iloc[:24*7])):
-            hs2 = hs2 - hs2.iloc[:24*7].mean()
+        if hs2.any_valid(*first_week) & hs1.any_valid(*first_week):
+            hs2.shift_from(0, hs1.nanmean(*first_week) - hs2.nanmean(*first_week))
 
-        if any(~np.isnan(hs2.iloc[:24*7])) & any(~np.isnan(hs1.iloc[:24*7])):
-            hs2 = hs2 + hs1.iloc[:24*7].mean() - hs2.iloc[:24*7].mean()
-
-        if any(~np.isnan(z.iloc[:24*7])):
+        if z.any_valid(*first_week):
             # expressing ice surface height relative to its mean value in the
             # first week of the record
-            z = z - z.iloc[:24*7].mean()
-        elif z.notnull().any():
+            z.shift_from(0, -z.nanmean(*first_week))
+        elif z.any_valid():
             # if there is no data in the first week but that there are some
             # PT data afterwards
-            if ((z.first_valid_index() - hs1.first_valid_index()) < pd.to_timedelta('251D')) &\
-              ((z.first_valid_index() - hs1.first_valid_index()) > pd.to_timedelta('0H')):
+            z_first = time[z.first_valid()]
+            hs1_first = time[hs1.first_valid()] if hs1.any_valid() else z_first
+            if ((z_first - hs1_first) < pd.to_timedelta('251D')) &\
+              ((z_first - hs1_first) > pd.to_timedelta('0H')):
                 # if the pressure transducer is installed the year after then
                 # we use the mean surface height 1 on its first week as a 0
                 # for the ice height
-                z = z - z.loc[
-                    z.first_valid_index():(z.first_valid_index()+pd.to_timedelta('14D'))
-                    ].mean() + hs1.iloc[:24*7].mean()
+                z.shift_from(0, -z.nanmean(*window(z_first, z_first + pd.Timedelta('14D'), True))
+                             + hs1.nanmean(*first_week))
             else:
                 # if there is more than a year (actually 251 days) between the
                 # initiation of the AWS and the installation of the pressure transducer
@@ -420,29 +523,28 @@ def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
                 # Removing the intercept
                 # means that we consider the ice surface height at 0 when the AWS
                 # is installed, and not when the pressure transducer is installed.
-                Y = z.iloc[:].values.reshape(-1, 1)
-                X = z.iloc[~np.isnan(Y)].index.astype(np.int64).values.reshape(-1, 1)
-                Y = Y[~np.isnan(Y)]
-                linear_regressor = LinearRegression()
-                linear_regressor.fit(X, Y)
-                Y_pred = linear_regressor.predict(z.index.astype(np.int64).values.reshape(-1, 1) )
-                z = z-Y_pred[0]
+                x = (time - time[0]) / np.timedelta64(1, 'D')
+                slope, intercept = _segment_linear_fit(x, z.values(), [0])
+                z.shift_from(0, -intercept[0])
 
         years = df.index.year.unique().values
-        ind_start = years.copy()
-        ind_end =  years.copy()
+        year_bounds = np.searchsorted(
+            time, pd.to_datetime([str(y) + '-01-01' for y in years]
+                                 + [str(years[-1] + 1) + '-01-01']).values)
+        ind_start = np.full(len(years), -999)
+        ind_end = np.full(len(years), -999)
         logger.debug('-> estimating ablation period for each year')
+        z_ice_surf_adj = df["z_ice_surf_adj"].values
         for i, y in enumerate(years):
             # for each year
-            ind_yr = df.index.year.values==y
-            ind_abl_yr = np.logical_and(ind_yr, ind_ablation)
-
-            if df.loc[
-                    np.logical_and(ind_yr, df.index.month.isin([6,7,8])),
-                    "z_ice_surf_adj"].isnull().all():
-
-                ind_abl_yr = np.logical_and(ind_yr, df.index.month.isin([6,7,8]))
-                ind_ablation[ind_yr] = ind_abl_yr[ind_yr]
+            year_start, year_end = year_bounds[i], year_bounds[i+1]
+            jja = window(str(y)+'-06-01', str(y)+'-09-01')
+            ind_abl_yr = ind_ablation[year_start:year_end]
+
+            if np.isnan(z_ice_surf_adj[jja[0]:jja[1]]).all():
+                ind_abl_yr = np.zeros(year_end - year_start, dtype=bool)
+                ind_abl_yr[(jja[0] - year_start):(jja[1] - year_start)] = True
+                ind_ablation[year_start:year_end] = ind_abl_yr
                 logger.debug(str(y)+' no z_ice_surf, just using JJA')
 
             else:
@@ -451,14 +553,12 @@ def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
             if np.any(ind_abl_yr):
                 # if there are some ablation flagged for that year
                 # then find begining and end
-                ind_start[i] = np.argwhere(ind_abl_yr)[0][0]
-                ind_end[i] = np.argwhere(ind_abl_yr)[-1][0]
+                ind_start[i] = year_start + np.argmax(ind_abl_yr)
+                ind_end[i] = year_end - 1 - np.argmax(ind_abl_yr[::-1])
 
             else:
                 logger.debug(str(y) + ' could not estimate ablation season')
-                # otherwise left as nan
-                ind_start[i] = -999
-                ind_end[i] = -999
+                # otherwise left as -999
 
         # adjustement loop
         missing_hs2 = 0 # if hs2 is missing then when it comes back it is adjusted to hs1
@@ -467,37 +567,27 @@ def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
         # to hs1 and hs2 the year after.
 
         for i, y in enumerate(years):
-            # if y == 2014:
-            #     import pdb; pdb.set_trace()
             logger.debug(str(y))
             # defining subsets of hs1, hs2, z
-            hs1_jja =  hs1[str(y)+'-06-01':str(y)+'-09-01']
-            hs2_jja =  hs2[str(y)+'-06-01':str(y)+'-09-01']
-            z_jja =  z[str(y)+'-06-01':str(y)+'-09-01']
-
-            z_ablation = z.iloc[ind_start[i]:ind_end[i]]
-            hs2_ablation = hs2.iloc[ind_start[i]:ind_end[i]]
+            jja = window(str(y)+'-06-01', str(y)+'-09-02')
+            ablation = (ind_start[i], ind_end[i])
+            year = (year_bounds[i], year_bounds[i+1])
+            winter = window(str(y)+'-01-01', str(y)+'-03-02')
+            following_winter = window(str(y)+'-09-01', str(y+1)+'-03-02')
 
-            hs1_year = hs1[str(y)]
-            hs2_year = hs2[str(y)]
-
-            hs2_winter = hs2[str(y)+'-01-01':str(y)+'-03-01'].copy()
-            z_winter = z[str(y)+'-01-01':str(y)+'-03-01'].copy()
-
-            z_year = z[str(y)]
-            if hs1_jja.isnull().all() and hs2_jja.isnull().all() and z_jja.isnull().all():
+            if not (hs1.any_valid(*jja) or hs2.any_valid(*jja) or z.any_valid(*jja)):
                     # if there is no height for a year between June and September
                     # then the adjustment cannot be made automatically
                     # it needs to be specified manually on the adjustment files
                     # on https://github.com/GEUS-Glaciology-and-Climate/PROMICE-AWS-data-issues
                     continue
 
-            if all(np.isnan(z_jja)) and any(~np.isnan(hs2_jja)):
+            if not z.any_valid(*jja) and hs2.any_valid(*jja):
                 # if there is no PT for a given year, but there is some hs2
                 # then z will be adjusted to hs2 next time it is available
                 hs2_ref = 1
 
-            if all(np.isnan(z_winter)) and all(np.isnan(hs2_winter)):
+            if not z.any_valid(*winter) and not hs2.any_valid(*winter):
                 # if there is no PT nor hs2 during the winter, then again
                 # we need to adjust z to match hs2 when ablation starts
                 hs2_ref = 1
@@ -510,193 +600,160 @@ def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
                 if ind_start[i] != -999:
                     # the first year there is both ablation and PT data available
                     # then PT is adjusted to hs2
-                    if any(~np.isnan(z_ablation)) and any(~np.isnan(hs2_ablation)):
-                        tmp1 = z_ablation.copy()
-                        tmp2 = hs2_ablation.copy()
-                        # tmp1[np.isnan(tmp2)] = np.nan
-                        # tmp2[np.isnan(tmp1)] = np.nan
-
+                    if z.any_valid(*ablation) and hs2.any_valid(*ablation):
                         # in some instances, the PT data is available but no ablation
                         # is recorded, then hs2 remains the reference during that time.
-                        # When eventually there is ablation, then we need to find the
-                        # first index in these preceding ablation-free years
-                        # the shift will be applied back from this point
-                        # first_index = z[:z[str(y)].first_valid_index()].isnull().iloc[::-1].idxmax()
-                        # z[first_index:] = z[first_index:] -  np.nanmean(tmp1)  +  np.nanmean(tmp2)
-                        # hs2_ref = 0 # from now on PT is the reference
-
                         # in some other instance, z just need to be adjusted to hs2
-                        # first_index = z[str(y)].first_valid_index()
-                        first_index = z.iloc[ind_start[i]:].first_valid_index() # of ablation
-                        if np.isnan(hs2[first_index]):
-                            first_index_2 = hs2.iloc[ind_start[i]:].first_valid_index()
-                            if (first_index_2 - first_index)>pd.Timedelta('30d'):
+                        first_index = z.first_valid(ind_start[i]) # of ablation
+                        if np.isnan(hs2.value(first_index)):
+                            first_index_2 = hs2.first_valid(ind_start[i])
+                            if (time[first_index_2] - time[first_index]) > pd.Timedelta('30d'):
                                 logger.debug('adjusting z to hs1')
-                                if np.isnan(hs1[first_index]):
-                                    first_index = hs1.iloc[ind_start[i]:].first_valid_index()
-                                z[first_index:] = z[first_index:] -  z[first_index]   +  hs1[first_index]
+                                if np.isnan(hs1.value(first_index)):
+                                    first_index = hs1.first_valid(ind_start[i])
+                                if first_index is not None:
+                                    z.shift_from(first_index, -z.value(first_index) + hs1.value(first_index))
                             else:
                                 logger.debug('adjusting z to hs1')
-                                first_index = hs2.iloc[ind_start[i]:].first_valid_index()
-                                z[first_index:] = z[first_index:] -  z[first_index]   +  hs2[first_index]
+                                first_index = first_index_2
+                                z.shift_from(first_index, -z.value(first_index) + hs2.value(first_index))
                         else:
                             logger.debug('adjusting z to hs1')
-                            z[first_index:] = z[first_index:] -  z[first_index]   +  hs2[first_index]
+                            z.shift_from(first_index, -z.value(first_index) + hs2.value(first_index))
                         hs2_ref = 0 # from now on PT is the reference
 
 
             else:
                 # if z_pt is the reference and there is some ablation
                 # then hs1 and hs2 are adjusted to z_pt
-                if (ind_start[i] != -999) & z_year.notnull().any():
+                if (ind_start[i] != -999) & z.any_valid(*year):
                     # calculating first index with PT, hs1 and hs2
-                    first_index = z_year.first_valid_index()
-                    if hs1_year.notnull().any():
-                        first_index = np.max(np.array(
-                            [first_index,
-                             hs1_year.first_valid_index()]))
-                    if hs2_year.notnull().any():
-                        first_index = np.max(np.array(
-                            [first_index,
-                             hs2_year.first_valid_index()]))
+                    first_index = z.first_valid(*year)
+                    if hs1.any_valid(*year):
+                        first_index = max(first_index, hs1.first_valid(*year))
+                    if hs2.any_valid(*year):
+                        first_index = max(first_index, hs2.first_valid(*year))
 
                     # if PT, hs1 and hs2 are all nan until station is reactivated, then
-                    first_day_of_year = pd.to_datetime(str(y)+'-01-01')
-
-                    if len(z[first_day_of_year:first_index-pd.to_timedelta('1D')])>0:
-                        if z[first_day_of_year:first_index-pd.to_timedelta('1D')].isnull().all() & \
-                            hs1[first_day_of_year:first_index-pd.to_timedelta('1D')].isnull().all() & \
-                                hs2[first_day_of_year:first_index-pd.to_timedelta('1D')].isnull().all():
-                                if (~np.isnan(np.nanmean(z[first_index:first_index+pd.to_timedelta('1D')])) \
-                                    and ~np.isnan(np.nanmean(hs2[first_index:first_index+pd.to_timedelta('1D')]))):
+                    before_first = window(str(y)+'-01-01',
+                                          time[first_index] - pd.Timedelta('1D'), True)
+                    first_day = window(time[first_index],
+                                       time[first_index] + pd.Timedelta('1D'), True)
+
+                    if before_first[1] > before_first[0]:
+                        if not (z.any_valid(*before_first) or hs1.any_valid(*before_first)
+                                or hs2.any_valid(*before_first)):
+                                if (~np.isnan(z.nanmean(*first_day)) \
+                                    and ~np.isnan(hs2.nanmean(*first_day))):
                                     logger.debug(' ======= adjusting hs1 and hs2 to z_pt')
-                                    if ~np.isnan(np.nanmean(hs1[first_index:first_index+pd.to_timedelta('1D')]) ):
-                                        hs1[first_index:] = hs1[first_index:] \
-                                            -  np.nanmean(hs1[first_index:first_index+pd.to_timedelta('1D')])  \
-                                                +  np.nanmean(z[first_index:first_index+pd.to_timedelta('1D')])
-                                    if ~np.isnan(np.nanmean(hs2[first_index:first_index+pd.to_timedelta('1D')]) ):
-                                        hs2[first_index:] = hs2[first_index:] \
-                                            -  np.nanmean(hs2[first_index:first_index+pd.to_timedelta('1D')])  \
-                                                +  np.nanmean(z[first_index:first_index+pd.to_timedelta('1D')])
+                                    if ~np.isnan(hs1.nanmean(*first_day)):
+                                        hs1.shift_from(first_index,
+                                                       -hs1.nanmean(*first_day) + z.nanmean(*first_day))
+                                    hs2.shift_from(first_index,
+                                                   -hs2.nanmean(*first_day) + z.nanmean(*first_day))
 
             # adjustment taking place at the end of the ablation period
             if (ind_end[i] != -999):
-                # if y == 2023:
-                #     import pdb; pdb.set_trace()
                 # if there's ablation and
                 # if there are PT data available at the end of the melt season
-                if z.iloc[(ind_end[i]-24*7):(ind_end[i]+24*7)].notnull().any():
+                if z.any_valid(*around(ind_end[i], '7D', '7D')):
                     logger.debug('adjusting hs2 to z')
                     # then we adjust hs2 to the end-of-ablation z
                     # first trying at the end of melt season
-                    if ~np.isnan(np.nanmean(hs2.iloc[(ind_end[i]-24*7):(ind_end[i]+24*30)])):
+                    end_of_melt = around(ind_end[i], '7D', '30D')
+                    if ~np.isnan(hs2.nanmean(*end_of_melt)):
                         logger.debug('using end of melt season')
-                        hs2.iloc[ind_end[i]:] = hs2.iloc[ind_end[i]:] - \
-                            np.nanmean(hs2.iloc[(ind_end[i]-24*7):(ind_end[i]+24*30)])  + \
-                                np.nanmean(z.iloc[(ind_end[i]-24*7):(ind_end[i]+24*30)])
+                        hs2.shift_from(ind_end[i],
+                                       -hs2.nanmean(*end_of_melt) + z.nanmean(*end_of_melt))
                     # if not possible, then trying the end of the following accumulation season
-                    elif (i+1 < len(ind_start)):
-                        if ind_start[i+1]!=-999 and any(~np.isnan(hs2.iloc[(ind_start[i+1]-24*7):(ind_start[i+1]+24*7)]+ z.iloc[(ind_start[i+1]-24*7):(ind_start[i+1]+24*7)])):
+                    elif (i+1 < len(ind_start)) and ind_start[i+1] != -999:
+                        end_of_accumulation = around(ind_start[i+1], '7D', '7D')
+                        if hs2.any_valid(*end_of_accumulation, other=z):
                             logger.debug('using end of accumulation season')
-                            hs2.iloc[ind_end[i]:] = hs2.iloc[ind_end[i]:] - \
-                                np.nanmean(hs2.iloc[(ind_start[i+1]-24*7):(ind_start[i+1]+24*7)])  + \
-                                    np.nanmean(z.iloc[(ind_start[i+1]-24*7):(ind_start[i+1]+24*7)])
+                            hs2.shift_from(ind_end[i],
+                                           -hs2.nanmean(*end_of_accumulation)
+                                           + z.nanmean(*end_of_accumulation))
             else:
                 logger.debug('no ablation')
-                hs1_following_winter = hs1[str(y)+'-09-01':str(y+1)+'-03-01'].copy()
-                hs2_following_winter = hs2[str(y)+'-09-01':str(y+1)+'-03-01'].copy()
-                if all(np.isnan(hs2_following_winter)):
+                if not hs2.any_valid(*following_winter):
                     logger.debug('no hs2')
                     missing_hs2 = 1
                 elif missing_hs2 == 1:
                     logger.debug('adjusting hs2')
                     # and if there are some hs2 during the accumulation period
-                    if any(~np.isnan(hs1_following_winter)):
+                    if hs1.any_valid(*following_winter):
                         logger.debug('to hs1')
                         # then we adjust hs1 to hs2 during the accumulation area
                         # adjustment is done so that the mean hs1 and mean hs2 match
                         # for the period when both are available
-                        hs2_following_winter[np.isnan(hs1_following_winter)] = np.nan
-                        hs1_following_winter[np.isnan(hs2_following_winter)] = np.nan
-
-                        hs2[str(y)+'-01-01':] = hs2[str(y)+'-01-01':] \
-                            -  np.nanmean(hs2_following_winter)  +  np.nanmean(hs1_following_winter)
+                        hs2.shift_from(year[0],
+                                       -hs2.nanmean(*following_winter, other=hs1)
+                                       + hs1.nanmean(*following_winter, other=hs2))
                         missing_hs2 = 0
 
-
-                hs1_following_winter = hs1[str(y)+'-09-01':str(y+1)+'-03-01'].copy()
-                hs2_following_winter = hs2[str(y)+'-09-01':str(y+1)+'-03-01'].copy()
                 # adjusting hs1 to hs2 (no ablation case)
-                if any(~np.isnan(hs1_following_winter)):
+                if hs1.any_valid(*following_winter):
                     logger.debug('adjusting hs1')
                     # and if there are some hs2 during the accumulation period
-                    if any(~np.isnan(hs2_following_winter)):
+                    if hs2.any_valid(*following_winter):
                         logger.debug('to hs2')
                         # then we adjust hs1 to hs2 during the accumulation area
                         # adjustment is done so that the mean hs1 and mean hs2 match
                         # for the period when both are available
-                        hs1_following_winter[np.isnan(hs2_following_winter)] = np.nan
-                        hs2_following_winter[np.isnan(hs1_following_winter)] = np.nan
-
-                        hs1[str(y)+'-09-01':] = hs1[str(y)+'-09-01':] \
-                            -  np.nanmean(hs1_following_winter)  +  np.nanmean(hs2_following_winter)
-                        hs1_following_winter = hs1[str(y)+'-09-01':str(y+1)+'-03-01'].copy()
+                        hs1.shift_from(following_winter[0],
+                                       -hs1.nanmean(*following_winter, other=hs2)
+                                       + hs2.nanmean(*following_winter, other=hs1))
 
             if ind_end[i] != -999:
                 # if there is some hs1
-                hs1_following_winter = hs1[str(y)+'-09-01':str(y+1)+'-03-01'].copy()
-                hs2_following_winter = hs2[str(y)+'-09-01':str(y+1)+'-03-01'].copy()
-                if any(~np.isnan(hs1_following_winter)):
+                if hs1.any_valid(*following_winter):
                     logger.debug('adjusting hs1')
                     # and if there are some hs2 during the accumulation period
-                    if any(~np.isnan(hs2_following_winter)):
+                    if hs2.any_valid(*following_winter):
                         logger.debug('to hs2, minimizing winter difference')
                         # then we adjust hs1 to hs2 during the accumulation area
                         # adjustment is done so that the mean hs1 and mean hs2 match
                         # for the period when both are available
-                        tmp1 = hs1.iloc[ind_end[i]:min(len(hs1),ind_end[i]+24*30*9)].copy()
-                        tmp2 = hs2.iloc[ind_end[i]:min(len(hs2),ind_end[i]+24*30*9)].copy()
-
-                        tmp1[np.isnan(tmp2)] = np.nan
-                        tmp2[np.isnan(tmp1)] = np.nan
-                        if tmp1.isnull().all():
-                            tmp1 = hs1_following_winter.copy()
-                            tmp2 = hs2_following_winter.copy()
-
-                            tmp1[np.isnan(tmp2)] = np.nan
-                            tmp2[np.isnan(tmp1)] = np.nan
-                        hs1.iloc[ind_end[i]:] = hs1.iloc[ind_end[i]:] -  np.nanmean(tmp1)  +  np.nanmean(tmp2)
+                        overlap = around(ind_end[i], '0D', '270D')
+                        if not hs1.any_valid(*overlap, other=hs2):
+                            overlap = following_winter
+                        hs1.shift_from(ind_end[i],
+                                       -hs1.nanmean(*overlap, other=hs2)
+                                       + hs2.nanmean(*overlap, other=hs1))
 
                     # if no hs2, then use PT data available at the end of the melt season
-                    elif np.any(~np.isnan(z.iloc[(ind_end[i]-24*14):(ind_end[i]+24*7)])):
+                    elif z.any_valid(*around(ind_end[i], '14D', '7D')):
                         logger.debug('to z')
                         # then we adjust hs2 to the end-of-ablation z
                         # first trying at the end of melt season
-                        if ~np.isnan(np.nanmean(hs1.iloc[(ind_end[i]-24*14):(ind_end[i]+24*30)])):
+                        end_of_melt = around(ind_end[i], '14D', '30D')
+                        if ~np.isnan(hs1.nanmean(*end_of_melt)):
                             logger.debug('using end of melt season')
-                            hs1.iloc[ind_end[i]:] = hs1.iloc[ind_end[i]:] - \
-                                np.nanmean(hs1.iloc[(ind_end[i]-24*14):(ind_end[i]+24*30)])  + \
-                                    np.nanmean(z.iloc[(ind_end[i]-24*14):(ind_end[i]+24*30)])
+                            hs1.shift_from(ind_end[i],
+                                           -hs1.nanmean(*end_of_melt) + z.nanmean(*end_of_melt))
                         # if not possible, then trying the end of the following accumulation season
-                        elif ind_start[i+1]!=-999 and any(~np.isnan(hs1.iloc[(ind_start[i+1]-24*14):(ind_start[i+1]+24*7)]+ z.iloc[(ind_start[i+1]-24*14):(ind_start[i+1]+24*7)])):
-                            logger.debug('using end of accumulation season')
-                            hs1.iloc[ind_end[i]:] = hs1.iloc[ind_end[i]:] - \
-                                np.nanmean(hs1.iloc[(ind_start[i+1]-24*14):(ind_start[i+1]+24*7)])  + \
-                                    np.nanmean(z.iloc[(ind_start[i+1]-24*14):(ind_start[i+1]+24*7)])
-                    elif any(~np.isnan(hs2_year)):
+                        elif (i+1 < len(ind_start)) and ind_start[i+1] != -999:
+                            end_of_accumulation = around(ind_start[i+1], '14D', '7D')
+                            if hs1.any_valid(*end_of_accumulation, other=z):
+                                logger.debug('using end of accumulation season')
+                                hs1.shift_from(ind_end[i],
+                                               -hs1.nanmean(*end_of_accumulation)
+                                               + z.nanmean(*end_of_accumulation))
+                    elif hs2.any_valid(*year):
                         logger.debug('to the last value of hs2')
                         # then we adjust hs1 to hs2 during the accumulation area
                         # adjustment is done so that the mean hs1 and mean hs2 match
                         # for the period when both are available
-                        half_span = pd.to_timedelta('7D')
-                        tmp1 = hs1_year.loc[(hs2_year.last_valid_index()-half_span):(hs2_year.last_valid_index()+half_span)].copy()
-                        tmp2 = hs2_year.loc[(hs2_year.last_valid_index()-half_span):(hs2_year.last_valid_index()+half_span)].copy()
+                        last_hs2 = time[hs2.last_valid(*year)]
+                        around_last = window(max(last_hs2 - pd.Timedelta('7D'), time[year[0]]),
+                                             min(last_hs2 + pd.Timedelta('7D'), time[year[1] - 1]),
+                                             True)
+                        hs1.shift_from(ind_end[i],
+                                       -hs1.nanmean(*around_last) + hs2.nanmean(*around_last))
 
-                        hs1.iloc[ind_end[i]:] = hs1.iloc[ind_end[i]:] -  np.nanmean(tmp1)  +  np.nanmean(tmp2)
-
-        df["z_surf_1_adj"] = hs1.interpolate(limit=2*24).values
-        df["z_surf_2_adj"] = hs2.interpolate(limit=2*24).values
-        df["z_ice_surf_adj"] = z.interpolate(limit=2*24).values
+        df["z_surf_1_adj"] = pd.Series(hs1.values(), index=df.index).interpolate(limit=2*24).values
+        df["z_surf_2_adj"] = pd.Series(hs2.values(), index=df.index).interpolate(limit=2*24).values
+        df["z_ice_surf_adj"] = pd.Series(z.values(), index=df.index).interpolate(limit=2*24).values
 
         # making a summary of the surface height
         df["z_surf_combined"] = np.nan
@@ -724,22 +781,93 @@ def combine_surface_height(df, site_type, threshold_ablation = -0.0002):
     logger.info('surface height combination finished')
     return df['z_surf_combined'], df["z_ice_surf_adj"], df["z_surf_1_adj"], df["z_surf_2_adj"]
 
+class _OffsetSeries:
+    '''Surface height series on which a sequence of adjustments of the type
+    "shift all values from a given position onwards" is applied. The shifts
+    are stored as a piecewise-constant offset and only applied to the full
+    series when calling values(), so that each adjustment costs the size of
+    the window it is derived from rather than the length of the series.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Unadjusted values
+    '''
+    def __init__(self, values):
+        self._raw = np.array(values, dtype=float)
+        self._valid = np.flatnonzero(~np.isnan(self._raw))
+        self._starts = []
+        self._deltas = []
+
+    def shift_from(self, pos, delta):
+        '''Adds delta to all the values from position pos onwards'''
+        delta = float(delta)
+        if np.isnan(delta):
+            # a nan offset makes the rest of the series invalid
+            self._raw[pos:] = np.nan
+            self._valid = self._valid[self._valid < pos]
+            return
+        self._starts.append(pos)
+        self._deltas.append(delta)
+
+    def _offsets(self, a, b):
+        offsets = np.zeros(max(b - a, 0))
+        for start, delta in zip(self._starts, self._deltas):
+            if start < b:
+                offsets[max(start - a, 0):] += delta
+        return offsets
+
+    def values(self):
+        '''Adjusted series'''
+        offsets = np.zeros(len(self._raw) + 1)
+        np.add.at(offsets, self._starts, self._deltas)
+        return self._raw + np.cumsum(offsets)[:-1]
+
+    def value(self, pos):
+        return self._raw[pos] + self._offsets(pos, pos + 1)[0]
+
+    def first_valid(self, a=0, b=None):
+        k = np.searchsorted(self._valid, a)
+        if k < len(self._valid) and (b is None or self._valid[k] < b):
+            return self._valid[k]
+        return None
+
+    def last_valid(self, a, b):
+        k = np.searchsorted(self._valid, b) - 1
+        if k >= 0 and self._valid[k] >= a:
+            return self._valid[k]
+        return None
+
+    def _mask(self, a, b, other):
+        msk = ~np.isnan(self._raw[a:b])
+        if other is not None:
+            msk &= ~np.isnan(other._raw[a:b])
+        return msk
+
+    def any_valid(self, a=0, b=None, other=None):
+        '''True if any value in [a, b) is valid (as well as in other, if given)'''
+        if other is None:
+            return self.first_valid(a, b) is not None
+        return bool(self._mask(a, b, other).any())
+
+    def nanmean(self, a, b, other=None):
+        '''Mean of the adjusted values in [a, b), only where other is also
+        valid if other is given'''
+        b = len(self._raw) if b is None else min(b, len(self._raw))
+        msk = self._mask(a, b, other)
+        if not msk.any():
+            return np.nan
+        return np.mean((self._raw[a:b] + self._offsets(a, b))[msk])
+
+
 def hampel(vals_orig, k=7*24, t0=15):
     '''
-    vals: pandas series of values from which to remove outliers
+    vals: pandas series or dataframe of values from which to remove outliers
     k: size of window (including the sample; 7 is equal to 3 on either side of value)
     '''
     #Make copy so original not edited
     vals=vals_orig.copy()
-    #Hampel Filter
-    L= 1.4826
-    rolling_median=vals.rolling(k).median()
-    difference=np.abs(rolling_median-vals)
-    median_abs_deviation=difference.rolling(k).median()
-    threshold= t0 *L * median_abs_deviation
-    outlier_idx=difference>threshold
-    outlier_idx[0:round(k/2)]=False
-    vals.loc[outlier_idx]=np.nan
+    vals.iloc[:] = hampel_filter(vals_orig.values, k=k, t0=t0)
     return(vals)
 
 
@@ -802,81 +930,30 @@ def get_thermistor_depth(df_in, site, station_config):
         df_in["z_surf_combined"] = surface_height.values
         z_surf_interp = df_in["z_surf_combined"].interpolate()
 
-        # first initialization of the depths
-        for i, col in enumerate(depth_cols_name):
-            df_in[col] = (
-                ini_depth[i]
-                + z_surf_interp.values
-                - z_surf_interp[z_surf_interp.first_valid_index()]
-            )
-
-        # reseting depth at maintenance
+        # depth of the thermistors: installation depth plus the change in
+        # surface height since the start of the segment, a new segment
+        # starting at each maintenance of the string
+        depth, ind_adapt = _segment_thermistor_depth(
+            df_in.index.values, z_surf_interp.values,
+            ini_depth[:num_therm], maintenance_string,
+        )
         if len(maintenance_string.date) == 0:
             logger.info("No maintenance at "+site)
 
-        for date in maintenance_string.date:
-            if date > z_surf_interp.last_valid_index():
-                continue
-            new_depth = maintenance_string.loc[
-                                            maintenance_string.date == date
-                                        ].installation_depths.values[0]
-
-            for i, col in enumerate(depth_cols_name[:len(new_depth)]):
-                tmp = df_in[col].copy()
-                tmp.loc[date:] = (
-                    new_depth[i]
-                    + z_surf_interp[date:].values
-                    - z_surf_interp[date:][
-                        z_surf_interp[date:].first_valid_index()
-                    ]
-                )
-                df_in[col] = tmp.values
-
         # % Filtering thermistor data
-        for i in range(len(temp_cols_name)):
-            tmp = df_in[temp_cols_name[i]].copy()
-
-            # variance filter
-            # ind_filter = (
-            #     df_in[temp_cols_name[i]]
-            #     .interpolate(limit=14)
-            #     .rolling(window=7)
-            #     .var()
-            #     > 0.5
-            # )
-            # month = (
-            #     df_in[temp_cols_name[i]].interpolate(limit=14).index.month.values
-            # )
-            # ind_filter.loc[np.isin(month, [5, 6, 7])] = False
-            # if any(ind_filter):
-            #     tmp.loc[ind_filter] = np.nan
-
-            # before and after maintenance adaptation filter
-            if len(maintenance_string.date) > 0:
-                for date in maintenance_string.date:
-                    if isinstance(
-                        maintenance_string.loc[
-                            maintenance_string.date == date
-                        ].installation_depths.values[0],
-                        str,
-                    ):
-                        ind_adapt = np.abs(
-                            tmp.interpolate(limit=14).index.values
-                            - pd.to_datetime(date).to_datetime64()
-                        ) < np.timedelta64(7, "D")
-                        if any(ind_adapt):
-                            tmp.loc[ind_adapt] = np.nan
-
-            # surfaced thermistor
-            ind_pos = df_in[depth_cols_name[i]] < 0.1
-            if any(ind_pos):
-                tmp.loc[ind_pos] = np.nan
-
-            # copying the filtered values to the original table
-            df_in[temp_cols_name[i]] = tmp.values
+        temp = df_in[temp_cols_name].values.astype(float)
+
+        # before and after maintenance adaptation filter
+        temp[ind_adapt, :] = np.nan
+
+        # surfaced thermistor
+        with np.errstate(invalid="ignore"):
+            temp[depth < 0.1] = np.nan
 
             # removing negative depth
-            df_in.loc[df_in[depth_cols_name[i]]<0, depth_cols_name[i]] = np.nan
+            depth[depth < 0] = np.nan
+        df_in[temp_cols_name] = temp
+        df_in[depth_cols_name] = depth
         logger.info("interpolating 10 m firn/ice temperature")
         df_in['t_i_10m'] = interpolate_temperature(
             df_in.index.values,
@@ -895,13 +972,84 @@ def get_thermistor_depth(df_in, site, station_config):
     return df_in[depth_cols_name + ['t_i_10m']]
 
 
+def _segment_thermistor_depth(time, z_surf, ini_depth, maintenance_string):
+    '''Thermistor depths for all timestamps and thermistors at once.
+
+    Each maintenance date starts a new segment. Within a segment, the depth of
+    a thermistor is its installation depth plus the surface height change since
+    the first valid surface height of the segment. Thermistors that are not
+    listed in a maintenance entry keep the installation depth and reference
+    surface height of the previous segment.
+
+    Parameters
+    ----------
+    time : numpy.ndarray
+        array of datetime64
+    z_surf : numpy.ndarray
+        interpolated surface height
+    ini_depth : list
+        initial installation depth of each thermistor
+    maintenance_string : pandas.DataFrame
+        maintenance dates and installation depths, sorted by date
+
+    Returns
+    -------
+    depth : numpy.ndarray
+        matrix of thermistor depths
+    ind_adapt : numpy.ndarray
+        boolean array, True within 7 days of a maintenance without installation
+        depths, where the thermistors are still adapting
+    '''
+    num_therm = len(ini_depth)
+    ind_valid = np.flatnonzero(~np.isnan(z_surf))
+
+    ind_str = maintenance_string.installation_depths.map(
+        lambda x: isinstance(x, str)).values.astype(bool)
+    dist = np.abs(time[:, None] - maintenance_string.date.values[ind_str][None, :])
+    ind_adapt = (dist < np.timedelta64(7, "D")).any(axis=1)
+
+    # maintenance after the last surface height are not used
+    resets = maintenance_string.loc[
+        ~ind_str & (maintenance_string.date.values <= time[ind_valid[-1]])
+    ].drop_duplicates(subset="date", keep="first")
+    dates = resets.date.values
+
+    # installation depth of each thermistor and each segment, NaN when the
+    # thermistor is not reset at that maintenance
+    install = np.full((len(dates) + 1, num_therm), np.nan)
+    install[0, :] = ini_depth
+    for k, new_depth in enumerate(resets.installation_depths.values):
+        new_depth = np.asarray(new_depth, dtype=float)[:num_therm]
+        install[k + 1, :len(new_depth)] = new_depth
+    ind_reset = np.zeros(install.shape, dtype=bool)
+    ind_reset[0, :] = True
+    ind_reset[1:, :] = np.array(
+        [np.arange(num_therm) < min(len(d), num_therm)
+         for d in resets.installation_depths.values],
+        dtype=bool,
+    ).reshape(len(dates), num_therm)
+
+    # surface height at the first valid value of each segment
+    seg_start = np.searchsorted(time, dates, side="left")
+    first_valid = ind_valid[np.searchsorted(ind_valid, seg_start, side="left")]
+    z_ref = np.concatenate(([z_surf[ind_valid[0]]], z_surf[first_valid]))
+
+    # last segment where each thermistor was reset
+    last_reset = np.where(ind_reset, np.arange(len(install))[:, None], 0)
+    last_reset = np.maximum.accumulate(last_reset, axis=0)
+    last_reset = last_reset[np.searchsorted(dates, time, side="right"), :]
+    cols = np.arange(num_therm)[None, :]
+    depth = install[last_reset, cols] + z_surf[:, None] - z_ref[last_reset]
+    return depth, ind_adapt
+
+
 def interpolate_temperature(dates, depth_cor, temp, depth=10, min_diff_to_depth=2,
     kind="quadratic"):
-    '''Calculates the depth of the thermistors through time based on their
-    installation depth (collected in a google sheet) and on the change of surface
-    height: instruments getting buried under new snow or surfacing due to ablation.
-    There is a potential for additional filtering of thermistor data for surfaced
-    (or just noisy) thermistors, but that is currently deactivated because slow.
+    '''Interpolates the thermistor string temperatures at one or several
+    constant depths. Each timestamp is interpolated from the thermistors that
+    have both a depth and a temperature, and is only interpolated if one of them
+    is within min_diff_to_depth of the target depth. Linear interpolation is
+    done for all timestamps at once.
 
     Parameters
     ----------
@@ -911,50 +1059,136 @@ def interpolate_temperature(dates, depth_cor, temp, depth=10, min_diff_to_depth=
         matrix of depths
     temp : numpy.ndarray
         matrix of temperatures
-    depth : float
-        constant depth at which (depth_cor, temp) should be interpolated.
+    depth : float or list of float
+        constant depth(s) at which (depth_cor, temp) should be interpolated.
     min_diff_to_depth: float
         maximum difference allowed between the available depht and the target depth
         for the interpolation to be done.
     kind : str
         type of interpolation from scipy.interpolate.interp1d
+
+    Returns
+    -------
+    pandas.DataFrame
+        "date" column and the interpolated temperatures, in a
+        "temperatureObserved" column if depth is a scalar, or in one column
+        per target depth, labelled by the depth, otherwise.
     '''
+    depths = np.atleast_1d(np.asarray(depth, dtype=float))
+    x, y, n_valid = _sorted_depth_profiles(depth_cor, temp)
+
+    # closest available depth for each target depth
+    dist = np.abs(x[:, :, None] - depths[None, None, :])
+    dist[np.isnan(dist)] = np.inf
+    ind_ok = (n_valid[:, None] >= 2) & (dist.min(axis=1) <= min_diff_to_depth)
+
+    if kind == "linear":
+        out = _interp_linear_rows(x, y, n_valid, depths)
+        out[~ind_ok] = np.nan
+    else:
+        from scipy.interpolate import interp1d
+
+        out = np.full((len(x), len(depths)), np.nan)
+        for i in np.flatnonzero(ind_ok.any(axis=1)):
+            f = interp1d(x[i, :n_valid[i]], y[i, :n_valid[i]], kind,
+                         fill_value="extrapolate")
+            out[i, ind_ok[i]] = f(depths[ind_ok[i]])
+
+    # discarding the first values if they are too noisy
+    with np.errstate(invalid="ignore"):
+        ind_noisy = pd.DataFrame(out[:5]).std().values > 0.1
+    out[:5, ind_noisy] = np.nan
 
-    depth_cor = depth_cor.astype(float)
     df_interp = pd.DataFrame()
     df_interp["date"] = dates
-    df_interp["temperatureObserved"] = np.nan
-
-    # preprocessing temperatures for small gaps
-    tmp = pd.DataFrame(temp)
-    tmp["time"] = dates
-    tmp = tmp.set_index("time")
-    # tmp = tmp.resample("H").mean()
-    # tmp = tmp.interpolate(limit=24*7)
-    temp = tmp.loc[dates].values
-    for i in (range(len(dates))):
-        x = depth_cor[i, :].astype(float)
-        y = temp[i, :].astype(float)
-        ind_no_nan = ~np.isnan(x + y)
-        x = x[ind_no_nan]
-        y = y[ind_no_nan]
-        x, indices = np.unique(x, return_index=True)
-        y = y[indices]
-        if len(x) < 2 or np.min(np.abs(x - depth)) > min_diff_to_depth:
-            continue
-        f = interp1d(x, y, kind, fill_value="extrapolate")
-        df_interp.iloc[i, 1] = np.min(f(depth), 0)
-
-    if df_interp.iloc[:5, 1].std() > 0.1:
-        df_interp.iloc[:5, 1] = np.nan
-
+    if np.ndim(depth) == 0:
+        df_interp["temperatureObserved"] = out[:, 0]
+    else:
+        for j, d in enumerate(depths):
+            df_interp[d] = out[:, j]
     return df_interp
 
-def gps_coordinate_postprocessing(ds, var, station_config={}):
+
+def _sorted_depth_profiles(depth_cor, temp):
+    '''Sorts each row of (depth_cor, temp) by depth, keeping only the pairs
+    where both are available and the first occurrence of repeated depths, as
+    numpy.unique(return_index=True) would. Removed pairs are moved to the end
+    of the rows as NaN.
+
+    Returns
+    -------
+    x, y : numpy.ndarray
+        sorted depths and corresponding temperatures
+    n_valid : numpy.ndarray
+        number of valid pairs in each row
+    '''
+    x = np.array(depth_cor, dtype=float)
+    y = np.array(temp, dtype=float)
+    x[np.isnan(x + y)] = np.inf
+
+    order = np.argsort(x, axis=1, kind="stable")
+    x = np.take_along_axis(x, order, axis=1)
+    y = np.take_along_axis(y, order, axis=1)
+
+    # the stable sort leaves the first occurrence of a depth ahead of its repeats
+    ind_dup = np.zeros(x.shape, dtype=bool)
+    ind_dup[:, 1:] = x[:, 1:] == x[:, :-1]
+    x[ind_dup] = np.inf
+    order = np.argsort(x, axis=1, kind="stable")
+    x = np.take_along_axis(x, order, axis=1)
+    y = np.take_along_axis(y, order, axis=1)
+
+    n_valid = np.isfinite(x).sum(axis=1)
+    x[~np.isfinite(x)] = np.nan
+    y[np.isnan(x)] = np.nan
+    return x, y, n_valid
+
+
+def _interp_linear_rows(x, y, n_valid, depths):
+    '''Row-wise linear inter/extrapolation of sorted profiles (x, y) at the
+    given depths, reproducing scipy.interpolate.interp1d(kind="linear",
+    fill_value="extrapolate"). Rows with less than two valid values are NaN.'''
+    rows = np.arange(len(x))[:, None]
+    with np.errstate(invalid="ignore"):
+        hi = (x[:, :, None] < depths[None, None, :]).sum(axis=1)
+    hi = np.clip(hi, 1, np.maximum(n_valid - 1, 1)[:, None])
+    lo = hi - 1
+    x_lo, x_hi = x[rows, lo], x[rows, hi]
+    y_lo, y_hi = y[rows, lo], y[rows, hi]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (y_hi - y_lo) / (x_hi - x_lo)
+        out = slope * (depths[None, :] - x_lo) + y_lo
+    out[n_valid < 2] = np.nan
+    return out
+
+def gps_coordinates_postprocessing(ds, station_config={},
+                                   variables=['gps_lat', 'gps_lon', 'gps_alt']):
+    '''Smoothes, inter- or extrapolate the GPS coordinates of a station, all
+    coordinates being processed together. Coordinates without any observation
+    are set to the static value found in the dataset attributes.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        L2 AWS data
+    station_config : dict
+        potentially containing the list of station relocation dates in
+        station_config["station_relocation"]
+    variables : list
+        GPS variables to process
+
+    Returns
+    -------
+    dict
+        Processed values of 'lat', 'lon' and/or 'alt'
+    '''
+    coord_names = {'lat':'latitude','lon':'longitude', 'alt':'altitude'}
+    out = {}
+    observed = []
+    for var in variables:
         # saving the static value of 'lat','lon' or 'alt' stored in attribute
         # as it might be the only coordinate available for certain stations (e.g. bedrock)
         var_out = var.replace('gps_','')
-        coord_names = {'lat':'latitude','lon':'longitude', 'alt':'altitude'}
         if coord_names[var_out] in list(ds.attrs.keys()):
             static_value = float(ds.attrs[coord_names[var_out]])
         else:
@@ -962,25 +1196,34 @@ def gps_coordinate_postprocessing(ds, var, station_config={}):
 
         # if there is no gps observations, then we use the static value repeated
         # for each time stamp
-        if var not in ds.data_vars:
+        if var not in ds.data_vars or ds[var].isnull().all():
             print('no',var,'at', ds.attrs['station_id'])
-            return np.ones_like(ds['t_u'].data)*static_value
+            out[var_out] = np.ones_like(ds['t_u'].data)*static_value
+        else:
+            observed.append(var)
 
-        if ds[var].isnull().all():
-            print('no',var,'at',ds.attrs['station_id'])
-            return np.ones_like(ds['t_u'].data)*static_value
+    if len(observed) == 0:
+        return out
 
-        # Extract station relocations from the config dict
-        station_relocations = station_config.get("station_relocation", [])
+    # Extract station relocations from the config dict
+    station_relocations = station_config.get("station_relocation", [])
 
-        # Convert the ISO8601 strings to pandas datetime objects
-        breaks = [pd.to_datetime(date_str) for date_str in station_relocations]
-        if len(breaks)==0:
-            logger.info('processing '+var+' without relocation')
-        else:
-            logger.info('processing '+var+' with relocation on ' + ', '.join([br.strftime('%Y-%m-%dT%H:%M:%S') for br in breaks]))
+    # Convert the ISO8601 strings to pandas datetime objects
+    breaks = [pd.to_datetime(date_str) for date_str in station_relocations]
+    if len(breaks)==0:
+        logger.info('processing '+', '.join(observed)+' without relocation')
+    else:
+        logger.info('processing '+', '.join(observed)+' with relocation on ' + ', '.join([br.strftime('%Y-%m-%dT%H:%M:%S') for br in breaks]))
 
-        return piecewise_smoothing_and_interpolation(ds[var].to_series(), breaks)
+    smoothed = piecewise_smoothing_and_interpolation(ds[observed].to_pandas(), breaks)
+    for i, var in enumerate(observed):
+        out[var.replace('gps_','')] = smoothed[:, i]
+    return out
+
+def gps_coordinate_postprocessing(ds, var, station_config={}):
+    '''Smoothes, inter- or extrapolate a single GPS coordinate, see
+    gps_coordinates_postprocessing'''
+    return gps_coordinates_postprocessing(ds, station_config, [var])[var.replace('gps_','')]
 
 def piecewise_smoothing_and_interpolation(data_series, breaks):
     '''Smoothes, inter- or extrapolate the GPS observations. The processing is
@@ -991,51 +1234,98 @@ def piecewise_smoothing_and_interpolation(data_series, breaks):
     interpolated curve is extrapolated linearly for timestamps before the first
     valid measurement and after the last valid measurement.
 
+    As in label-based slicing, an observation made exactly at a relocation
+    date is used in the regression of both periods, and takes the value of the
+    later one.
+
     Parameters
     ----------
-    data_series : pandas.Series
-        Series of observed latitude, longitude or elevation with datetime index.
+    data_series : pandas.Series or pandas.DataFrame
+        Series of observed latitude, longitude or elevation with datetime
+        index, or DataFrame with one of these in each column.
     breaks: list
-        List of timestamps of station relocation. First and last item should be
-        None so that they can be used in slice(breaks[i], breaks[i+1])
+        List of timestamps of station relocation.
 
     Returns
     -------
     np.ndarray
-        Smoothed and interpolated values corresponding to the input series.
+        Smoothed and interpolated values corresponding to the input series,
+        with one column per column of data_series if it is a DataFrame.
     '''
-    df_all = pd.Series(dtype=float)  # Initialize an empty Series to gather all smoothed pieces
-    breaks = [None] + breaks + [None]
-    _inferred_series = []
-    for i in range(len(breaks) - 1):
-        df = data_series.loc[slice(breaks[i], breaks[i+1])]
-
-        # Drop NaN values and calculate the number of segments based on valid data
-        df_valid = df.dropna()
-        if df_valid.shape[0] > 2:
-            # Fit linear regression model to the valid data range
-            x = pd.to_numeric(df_valid.index).values.reshape(-1, 1)
-            y = df_valid.values.reshape(-1, 1)
-
-            model = LinearRegression()
-            model.fit(x, y)
-
-            # Predict using the model for the entire segment range
-            x_pred = pd.to_numeric(df.index).values.reshape(-1, 1)
-
-            y_pred = model.predict(x_pred)
-            df =  pd.Series(y_pred.flatten(), index=df.index)
-        # adds to list the predicted values for the current segment
-        _inferred_series.append(df)
-
-    df_all = pd.concat(_inferred_series)
+    time = data_series.index.values
+    values = np.asarray(data_series.values, dtype=float)
+    values_2d = values.reshape(len(time), -1)
+    x = (time - time[0]) / np.timedelta64(1, 'D') if len(time) else np.zeros(0)
+
+    # rows of each period, with inclusive bounds at the relocation dates
+    breaks = pd.to_datetime(breaks).values
+    seg_start = np.r_[0, np.searchsorted(time, breaks, side='left')]
+    seg_end = np.r_[np.searchsorted(time, breaks, side='right'), len(time)]
+    seg_end = np.maximum(seg_start, seg_end)
+    rows = np.concatenate([np.arange(a, b) for a, b in zip(seg_start, seg_end)])
+    starts = np.r_[0, np.cumsum(seg_end - seg_start)[:-1]]
+
+    # piecewise linear regression on periods with more than two observations
+    y = values_2d[rows]
+    slope, intercept = _segment_linear_fit(x[rows], y, starts)
+    n_valid = segment_sum((~np.isnan(y)).astype(float), starts)
+    segment = np.repeat(np.arange(len(starts)), seg_end - seg_start)
+    fitted = n_valid[segment] > 2
+    y = np.where(fitted,
+                 slope[segment] * x[rows, None] + intercept[segment],
+                 y)
 
     # Fill internal gaps with linear interpolation
-    df_all = df_all.interpolate(method='linear', limit_area='inside')
+    position = np.arange(len(rows))
+    for j in range(y.shape[1]):
+        ind_valid = np.flatnonzero(~np.isnan(y[:, j]))
+        if len(ind_valid) > 1:
+            inside = slice(ind_valid[0], ind_valid[-1] + 1)
+            y[inside, j] = np.interp(position[inside], ind_valid, y[ind_valid, j])
+
+    # keeping the later period at the relocation dates
+    out = np.full(values_2d.shape, np.nan)
+    out[rows] = y
+    return out.reshape(values.shape)
+
+def _segment_linear_fit(x, y, starts):
+    '''Closed-form least squares fit of y = slope * x + intercept on each
+    segment of the rows of y, ignoring NaN values in y.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        1-D array of abscissa
+    y : numpy.ndarray
+        1-D or 2-D array of values, each column being fitted separately
+    starts : list
+        position of the first row of each segment
 
-    # Remove duplicate indices and return values as numpy array
-    df_all = df_all[~df_all.index.duplicated(keep='last')]
-    return df_all.values
+    Returns
+    -------
+    slope, intercept : numpy.ndarray
+        fitted coefficients for each segment (and column of y). NaN if a
+        segment has no observation, with a zero slope if it has a single one.
+    '''
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float).reshape((-1,) + (1,) * (y.ndim - 1))
+    valid = ~np.isnan(y)
+    w = valid.astype(float)
+    y0 = np.where(valid, y, 0)
+    lengths = np.diff(np.r_[starts, len(y)])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n = segment_sum(w, starts)
+        x_mean = segment_sum(w * x, starts) / n
+        y_mean = segment_sum(y0, starts) / n
+        dx = np.where(valid, x - np.repeat(x_mean, lengths, axis=0), 0)
+        dy = np.where(valid, y0 - np.repeat(y_mean, lengths, axis=0), 0)
+        sxx = segment_sum(dx * dx, starts)
+        sxy = segment_sum(dx * dy, starts)
+        slope = np.where(sxx > 0, sxy / sxx, 0)
+    slope = np.where(n > 0, slope, np.nan)
+    intercept = y_mean - slope * x_mean
+    return slope, intercept
 
 def calculate_tubulent_heat_fluxes(T_0, T_h, Tsurf_h, WS_h, z_WS, z_T, q_h, p_h,
                 kappa=0.4, WS_lim=1., z_0=0.001, g=9.82, es_0=6.1071, eps=0.622,
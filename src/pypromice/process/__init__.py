@@ -1,4 +1,19 @@
-from pypromice.process.aws import *
-from pypromice.process import L0toL1
-from pypromice.process import L1toL2
-from pypromice.process import L2toL3
+# The processing modules are imported on first access (PEP 562), so that the
+# command line tools only import what they use
+import importlib
+
+__all__ = ["AWS", "L0toL1", "L1toL2", "L2toL3"]
+
+
+def __getattr__(name):
+    if name == "AWS":
+        from pypromice.process.aws import AWS
+
+        return AWS
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
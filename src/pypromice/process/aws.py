@@ -18,8 +18,8 @@ from importlib import metadata
 import pypromice.resources
 from pypromice.process.L0toL1 import toL1
 from pypromice.process.L1toL2 import toL2
-from pypromice.process.L2toL3 import toL3
 from pypromice.process import write, load, utilities
+from pypromice.process.cache import hash_file, hash_json, hash_table
 from pypromice.utilities.git import get_commit_hash_and_check_dirty
 
 pd.set_option("display.precision", 2)
@@ -37,6 +37,9 @@ class AWS(object):
         data_issues_repository: Path | str,
         var_file=None,
         meta_file=None,
+        cache=None,
+        vars_df=None,
+        meta_dict=None,
     ):
         """Object initialisation
 
@@ -52,6 +55,15 @@ class AWS(object):
         meta_file: str, optional
             Metadata info file path. If not given then pypromice's
             metadata file is used. The default is None.
+        cache: pypromice.process.cache.StageCache, optional
+            Cache of the L1, L2 and L3 outputs. When given, the L0 files are only
+            loaded if the L1 output is not found in the cache. The default is
+            None.
+        vars_df: pandas.DataFrame, optional
+            Variables look-up table already loaded from var_file. The default
+            is None.
+        meta_dict: dict, optional
+            Metadata already loaded from meta_file. The default is None.
         """
         assert os.path.isfile(config_file), "cannot find " + config_file
         assert os.path.isdir(inpath), "cannot find " + inpath
@@ -67,8 +79,13 @@ class AWS(object):
 
         # Load config, variables CSF standards, and L0 files
         self.config = self.loadConfig(config_file, inpath)
-        self.vars = pypromice.resources.load_variables(var_file)
-        self.meta = pypromice.resources.load_metadata(meta_file)
+        if vars_df is None:
+            vars_df = pypromice.resources.load_variables(var_file)
+        if meta_dict is None:
+            meta_dict = pypromice.resources.load_metadata(meta_file)
+        self.vars = vars_df
+        # the source of the station is added to the metadata
+        self.meta = dict(meta_dict)
         self.data_issues_repository = Path(data_issues_repository)
 
         config_hash = get_commit_hash_and_check_dirty(Path(config_file))
@@ -84,7 +101,25 @@ class AWS(object):
         logger.debug('Source information: %s', source_dict)
         self.meta["source"] = json.dumps(source_dict)
 
-        # Load config file
+        self.cache = cache
+        self.stage_inputs = {}
+        self.stage_keys = {}
+        self.L0 = None
+        self.format = None
+        if self.cache is None:
+            self.initL0()
+
+        self.L1 = None
+        self.L1A = None
+        self.L2 = None
+        self.L3 = None
+
+    @property
+    def station_id(self):
+        return next(iter(self.config.values()))["station_id"]
+
+    def initL0(self):
+        """Load the L0 datasets and find the format of the station data"""
         L0 = self.loadL0()
         self.L0 = []
         for l in L0:
@@ -101,11 +136,6 @@ class AWS(object):
         else:
             raise ValueError(f"Unknown formats from l0 datasets: {','.join(formats)}")
 
-        self.L1 = None
-        self.L1A = None
-        self.L2 = None
-        self.L3 = None
-
     def process(self):
         """Perform L0 to L3 data processing"""
         try:
@@ -123,16 +153,94 @@ class AWS(object):
         self.getL2()
         self.getL3()
 
+    def stageInputs(self, stage):
+        """Hashes of the inputs of a processing stage, used as cache key
+
+        Parameters
+        ----------
+        stage : str
+            "L1", "L2" or "L3"
+
+        Returns
+        -------
+        dict
+            Hash of each input of the stage
+        """
+        adjustments = self.data_issues_repository / "adjustments" / f"{self.station_id}.csv"
+        if stage == "L1":
+            config = {
+                k: {kk: vv for kk, vv in conf.items() if kk not in ["conf", "file"]}
+                for k, conf in self.config.items()
+            }
+            return dict(
+                l0_files=hash_json(
+                    {k: hash_file(conf["file"]) for k, conf in self.config.items()}
+                ),
+                config=hash_json(config),
+                variables=hash_table(self.vars),
+            )
+        elif stage == "L2":
+            return dict(
+                L1=self.stage_keys["L1"],
+                flags=hash_file(
+                    self.data_issues_repository / "flags" / f"{self.station_id}.csv"
+                ),
+                adjustments=hash_file(adjustments),
+                variables=hash_table(self.vars),
+            )
+        elif stage == "L3":
+            return dict(
+                L2=self.stage_keys["L2"],
+                adjustments=hash_file(adjustments),
+                variables=hash_table(self.vars),
+            )
+        raise ValueError(f"Unknown stage {stage}")
+
+    def _getCached(self, stage):
+        if self.cache is None:
+            return None
+        return self.cache.get(stage, self.station_id, self.stage_inputs[stage])
+
+    def _putCached(self, stage, ds):
+        if self.cache is not None:
+            self.cache.put(stage, self.station_id, self.stage_inputs[stage], ds)
+
+    def _setStageKey(self, stage):
+        # The inputs are hashed before processing, as the processing can
+        # modify the configuration in place
+        if self.cache is not None:
+            self.stage_inputs[stage] = self.stageInputs(stage)
+            self.stage_keys[stage] = self.cache.key(self.stage_inputs[stage])
+
     def getL1(self):
         """Perform L0 to L1 data processing"""
+        self._setStageKey("L1")
+        self.L1A = self._getCached("L1")
+        if self.L1A is not None:
+            self.format = self.L1A.attrs["format"]
+            return
+
         logger.info("Level 1 processing...")
+        if self.L0 is None:
+            self.initL0()
         self.L0 = [utilities.addBasicMeta(item, self.vars) for item in self.L0]
         self.L1 = [toL1(item, self.vars) for item in self.L0]
         self.L1A = reduce(xr.Dataset.combine_first, reversed(self.L1))
         self.L1A.attrs["format"] = self.format
+        self._putCached("L1", self.L1A)
 
     def getL2(self):
         """Perform L1 to L2 data processing"""
+        if "L1" not in self.stage_keys:
+            self._setStageKey("L1")
+        self._setStageKey("L2")
+        self.L2 = self._getCached("L2")
+        if self.L2 is not None:
+            self.format = self.L2.attrs["format"]
+            return
+        if self.L1A is None:
+            self.getL1()
+
         logger.info("Level 2 processing...")
 
         self.L2 = toL2(
@@ -141,12 +249,22 @@ class AWS(object):
             data_flags_dir=self.data_issues_repository / "flags",
             data_adjustments_dir=self.data_issues_repository / "adjustments",
         )
+        self._putCached("L2", self.L2)
 
     def getL3(self):
         """Perform L2 to L3 data processing, including resampling and metadata
         and attribute population"""
+        if self.L2 is None:
+            self.getL2()
+        self._setStageKey("L3")
+        self.L3 = self._getCached("L3")
+        if self.L3 is not None:
+            return
+        from pypromice.process.L2toL3 import toL3
+
         logger.info("Level 3 processing...")
         self.L3 = toL3(self.L2, data_adjustments_dir=self.data_issues_repository / "adjustments")
+        self._putCached("L3", self.L3)
 
     def loadConfig(self, config_file, inpath):
         """Load configuration from .toml file
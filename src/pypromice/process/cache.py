@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Content-addressed cache of the outputs of the processing stages
+
+Each stage output is stored under a key computed from the hashes of all the
+inputs of the stage: the key of the upstream stage, the configuration, the
+flag and adjustment files, the variables look-up table and the pypromice
+version. A rerun can therefore start from the deepest stage whose inputs did
+not change. Only the last stored output of each stage and station is kept,
+together with its inputs, so that the reason for a cache miss can be
+reported.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+import xarray as xr
+
+from pypromice.process.resample import resample_products
+
+__all__ = [
+    "StageCache",
+    "hash_file",
+    "hash_json",
+    "hash_table",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path) -> str:
+    """
+    sha256 of the content of a file, "missing" if the file does not exist.
+    """
+    path = Path(path)
+    if not path.is_file():
+        return "missing"
+    sha = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_json(obj) -> str:
+    """
+    sha256 of the JSON representation of obj, with sorted keys.
+    """
+    return hashlib.sha256(
+        json.dumps(obj, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def hash_table(df: pd.DataFrame) -> str:
+    """
+    sha256 of the content of a table, such as the variables look-up table.
+    The table itself is hashed rather than the file it was read from, so that
+    a table passed in by the caller is accounted for.
+    """
+    return hash_json(df.to_csv())
+
+
+class StageCache:
+    """
+    Cache of stage outputs in a folder, organised as
+    cache_dir/<stage>/<name>/<key>.pkl. Datasets are pickled so that they are
+    restored exactly as they were produced, including dtypes and attributes.
+    Storing an output removes the previous outputs of the stage and station.
+
+    Parameters
+    ----------
+    cache_dir : Path or str
+        Root folder of the cache
+    explain : bool
+        If True, the reason for each cache miss is logged. The default is
+        False.
+    """
+
+    def __init__(self, cache_dir, explain: bool = False):
+        self.cache_dir = Path(cache_dir)
+        self.explain_misses = explain
+
+    @staticmethod
+    def key(inputs: Dict[str, str]) -> str:
+        """
+        Key of a stage output from the hashes of its inputs.
+        """
+        return hash_json(dict(inputs, pypromice=metadata.version("pypromice")))
+
+    def _folder(self, stage: str, name: str) -> Path:
+        return self.cache_dir / stage / name
+
+    def get(self, stage: str, name: str, inputs: Dict[str, str]) -> Optional[xr.Dataset]:
+        """
+        Load the output of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            Stage name, e.g. "L2"
+        name : str
+            Station or site id
+        inputs : dict
+            Hashes of the inputs of the stage
+
+        Returns
+        -------
+        xarray.Dataset or None
+            Cached output, None if not found
+        """
+        path = self._folder(stage, name) / f"{self.key(inputs)}.pkl"
+        if not path.exists():
+            if self.explain_misses:
+                for reason in self.explain(stage, name, inputs):
+                    logger.info(f"Cache miss for {stage} of {name}: {reason}")
+            return None
+        logger.info(f"Using cached {stage} of {name}")
+        with path.open("rb") as f:
+            return pickle.load(f)
+
+    def put(self, stage: str, name: str, inputs: Dict[str, str], ds: xr.Dataset) -> str:
+        """
+        Store the output of a stage, replacing its previous outputs.
+
+        Parameters
+        ----------
+        stage : str
+            Stage name, e.g. "L2"
+        name : str
+            Station or site id
+        inputs : dict
+            Hashes of the inputs of the stage
+        ds : xarray.Dataset
+            Output of the stage
+
+        Returns
+        -------
+        str
+            Key of the stored output
+        """
+        folder = self._folder(stage, name)
+        folder.mkdir(parents=True, exist_ok=True)
+        key = self.key(inputs)
+        tmp = folder / f"{key}.pkl.tmp"
+        with tmp.open("wb") as f:
+            pickle.dump(ds, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, folder / f"{key}.pkl")
+
+        manifest = dict(key=key, inputs=inputs, pypromice=metadata.version("pypromice"))
+        tmp = folder / "latest.json.tmp"
+        with tmp.open("w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, folder / "latest.json")
+
+        for path in folder.glob("*.pkl"):
+            if path.stem != key:
+                path.unlink(missing_ok=True)
+        return key
+
+    def explain(self, stage: str, name: str, inputs: Dict[str, str]) -> List[str]:
+        """
+        Compare inputs with the inputs of the last stored output of a stage.
+
+        Returns
+        -------
+        list
+            Descriptions of the inputs that changed
+        """
+        manifest_file = self._folder(stage, name) / "latest.json"
+        if not manifest_file.exists():
+            return ["no cached output"]
+        with manifest_file.open() as f:
+            manifest = json.load(f)
+        reasons = []
+        if manifest["pypromice"] != metadata.version("pypromice"):
+            reasons.append(
+                f"pypromice version changed ({manifest['pypromice']} -> "
+                f"{metadata.version('pypromice')})"
+            )
+        previous = manifest["inputs"]
+        for input_name in sorted(set(previous) | set(inputs)):
+            if input_name not in previous:
+                reasons.append(f"new input {input_name}")
+            elif input_name not in inputs:
+                reasons.append(f"input {input_name} removed")
+            elif previous[input_name] != inputs[input_name]:
+                reasons.append(f"{input_name} changed")
+        return reasons or ["output of unchanged inputs not found"]
+
+    def resample_products(self, ds: xr.Dataset, frequencies, name: str,
+                          upstream_key: str) -> Dict[str, xr.Dataset]:
+        """
+        Cached resample_products of the output of an upstream stage. Only
+        the frequencies that are not cached are computed.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+            Dataset to resample
+        frequencies : list
+            Resampling frequencies
+        name : str
+            Station or site id
+        upstream_key : str
+            Key of the stage that produced ds
+
+        Returns
+        -------
+        dict
+            Resampled dataset for each frequency
+        """
+        inputs = {t: dict(upstream=upstream_key, time=t) for t in frequencies}
+        products = {t: self.get(f"resample_{t}", name, inputs[t]) for t in frequencies}
+        missing = [t for t, resampled in products.items() if resampled is None]
+        if missing:
+            for t, resampled in resample_products(ds, missing).items():
+                self.put(f"resample_{t}", name, inputs[t], resampled)
+                products[t] = resampled
+        return products
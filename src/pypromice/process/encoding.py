@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Planning of the NetCDF encoding of the data products
+
+The variables with a number of decimals in the variables look-up table are
+packed as scaled integers, with a scale factor of 10^-max_decimals. The
+smallest of int16 and int32 that holds both the valid range of the variable
+(lo and hi) and the data is used. The other float variables are stored as
+float32 when this does not change their values. All variables are chunked
+along time, in chunks of about a year, and can be compressed with shuffle
+and zlib or zstd. The encoding is also used for the Zarr stores, with the
+Zarr default compressor.
+"""
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from pypromice.process.variable_catalog import VariableCatalog
+
+__all__ = [
+    "plan_encoding",
+    "chunk_length",
+]
+
+logger = logging.getLogger(__name__)
+
+PACKED_DTYPES = ["int16", "int32"]
+
+
+def chunk_length(time: pd.DatetimeIndex, period="365D", min_length: int = 512) -> int:
+    """
+    Number of time steps in a chunk, covering about a period of time.
+
+    Parameters
+    ----------
+    time : pandas.DatetimeIndex
+        Time coordinate of the dataset
+    period : str
+        Period of time covered by a chunk. The default is "365D".
+    min_length : int
+        Minimum number of time steps in a chunk, so that coarse products are
+        not split in many small chunks. The default is 512.
+
+    Returns
+    -------
+    int
+        Chunk length, not larger than the length of time
+    """
+    n = len(time)
+    if n < 2:
+        return max(n, 1)
+    step = pd.Series(time).diff().median()
+    length = max(int(pd.Timedelta(period) / step), min_length)
+    return min(length, n)
+
+
+def _packed_dtype(values: np.ndarray, decimals: int, lo=np.nan, hi=np.nan) -> Optional[str]:
+    """Smallest integer dtype holding values, lo and hi scaled by 10^decimals.
+    The minimum of the dtype is kept for the fill value."""
+    if np.isinf(values).any():
+        return None
+    valid = values[~np.isnan(values)]
+    extremes = [abs(x) for x in [lo, hi] if not pd.isnull(x)]
+    if valid.size:
+        extremes += [abs(valid.min()), abs(valid.max())]
+    largest = np.ceil(max(extremes, default=0) * 10**decimals)
+    for dtype in PACKED_DTYPES:
+        if largest < np.iinfo(dtype).max:
+            return dtype
+    return None
+
+
+def _compression_encoding(compression) -> Dict:
+    if compression is None or compression is False:
+        return {}
+    if compression is True or compression == "zlib":
+        return dict(zlib=True, complevel=4, shuffle=True)
+    if compression == "zstd":
+        return dict(compression="zstd", complevel=4, shuffle=True)
+    raise ValueError(f"Unknown compression {compression}")
+
+
+def plan_encoding(
+    ds: xr.Dataset,
+    names: Optional[List[str]] = None,
+    vars_df: Optional[pd.DataFrame] = None,
+    compression="zlib",
+    chunk_period="365D",
+) -> Dict[str, Dict]:
+    """
+    Encoding of the variables of a dataset for xarray.Dataset.to_netcdf.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dataset to write
+    names : list, optional
+        Variables to write. If None, all data variables are written.
+    vars_df : pandas.DataFrame or VariableCatalog, optional
+        Variables look-up table with the max_decimals, lo and hi columns. If
+        None, the variables are not packed.
+    compression : bool or str
+        "zlib", "zstd", True for "zlib", or None or False for no compression.
+        The default is "zlib".
+    chunk_period : str
+        Period of time covered by a chunk. The default is "365D".
+
+    Returns
+    -------
+    dict
+        Encoding of each variable
+    """
+    if names is None:
+        names = list(ds.data_vars)
+    catalog = VariableCatalog.of(vars_df) if vars_df is not None else None
+    compression_encoding = _compression_encoding(compression)
+    chunks = chunk_length(ds.indexes["time"], chunk_period) if "time" in ds.dims else None
+
+    encoding = {}
+    for var in names:
+        da = ds[var]
+        enc = dict(compression_encoding)
+        if chunks is not None and "time" in da.dims:
+            # chunks of one element along the other dimensions, e.g. station
+            enc["chunksizes"] = tuple(chunks if d == "time" else 1 for d in da.dims)
+        if da.dtype.kind != "f":
+            encoding[var] = enc
+            continue
+
+        values = da.values
+        dtype = None
+        decimals = catalog.decimals.get(var) if catalog is not None else None
+        if decimals is not None:
+            lo, hi = catalog.limits.get(var, (np.nan, np.nan))
+            dtype = _packed_dtype(values, decimals, lo, hi)
+        if dtype is not None:
+            enc.update(
+                dtype=dtype,
+                scale_factor=10.0 ** -decimals,
+                _FillValue=np.iinfo(dtype).min,
+            )
+        else:
+            with np.errstate(over="ignore"):
+                exact = values.astype("float32") == values
+            dtype = "float32" if (exact | np.isnan(values)).all() else "float64"
+            enc.update(dtype=dtype, _FillValue=np.nan)
+        encoding[var] = enc
+    return encoding
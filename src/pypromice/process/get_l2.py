@@ -6,7 +6,8 @@ from argparse import ArgumentParser
 from pathlib import Path
 
 from pypromice.process.aws import AWS
-from pypromice.process.write import prepare_and_write
+from pypromice.process.cache import StageCache
+from pypromice.process.write import write_products
 
 
 def parse_arguments_l2():
@@ -23,11 +24,16 @@ def parse_arguments_l2():
     parser.add_argument('-m', '--metadata', default=None, type=str, 
                         required=False, help='File path to metadata')
     parser.add_argument('--data_issues_path', '--issues', default=None, help="Path to data issues repository")
+    parser.add_argument('--cache_dir', default=None, type=str, required=False,
+                        help='Path to the cache of the processing stages')
+    parser.add_argument('--explain-cache', action='store_true',
+                        help='Print which input changed when a cached stage cannot be used')
     args = parser.parse_args()
     return args
 
 
-def get_l2(config_file, inpath, outpath, variables, metadata, data_issues_path: Path) -> AWS:
+def get_l2(config_file, inpath, outpath, variables, metadata, data_issues_path: Path,
+           cache_dir=None, explain_cache: bool = False, vars_df=None, meta_dict=None) -> AWS:
     # Define input path
     station_name = config_file.split('/')[-1].split('.')[0] 
     station_path = os.path.join(inpath, station_name)
@@ -40,29 +46,43 @@ def get_l2(config_file, inpath, outpath, variables, metadata, data_issues_path:
         else:
             raise ValueError("data_issues_path is missing. Please provide a valid path to the data issues repository")
 
+    cache = None
+    if cache_dir is not None:
+        cache = StageCache(cache_dir, explain=explain_cache)
+
     if os.path.exists(station_path):
         aws = AWS(config_file, 
                   station_path,
                   data_issues_repository=data_issues_path, 
                   var_file=variables, 
-                  meta_file=metadata)
+                  meta_file=metadata,
+                  cache=cache,
+                  vars_df=vars_df,
+                  meta_dict=meta_dict)
     else:
         aws = AWS(config_file, 
                   inpath, 
                   data_issues_repository=data_issues_path, 
                   var_file=variables, 
-                  meta_file=metadata)
+                  meta_file=metadata,
+                  cache=cache,
+                  vars_df=vars_df,
+                  meta_dict=meta_dict)
 
     # Perform level 1 and 2 processing
-    aws.getL1()
     aws.getL2()
     # Write out level 2
     if outpath is not None:
         if not os.path.isdir(outpath):
             os.mkdir(outpath)
+        frequencies = ['60min']
         if aws.L2.attrs['format'] == 'raw':
-            prepare_and_write(aws.L2, outpath, aws.vars, aws.meta, '10min')
-        prepare_and_write(aws.L2, outpath, aws.vars, aws.meta, '60min')
+            frequencies = ['10min', '60min']
+        products = None
+        if aws.cache is not None:
+            products = aws.cache.resample_products(
+                aws.L2, frequencies, aws.station_id, aws.stage_keys["L2"])
+        write_products(aws.L2, outpath, frequencies, aws.vars, aws.meta, products=products)
     return aws
 
 
@@ -82,6 +102,8 @@ def main():
         args.variables,
         args.metadata,
         args.data_issues_path,
+        args.cache_dir,
+        args.explain_cache,
     )
 
 
@@ -6,8 +6,10 @@ import xarray as xr
 from argparse import ArgumentParser
 import pypromice
 from pypromice.process.L2toL3 import toL3
+from pypromice.process.cache import StageCache, hash_file, hash_json, hash_table
+from pypromice.process.incremental import load_l3_state, save_l3_state, toL3_incremental
 import pypromice.resources
-from pypromice.process.write import prepare_and_write
+from pypromice.process.write import write_products
 logger = logging.getLogger(__name__)
 
 def parse_arguments_l2tol3(debug_args=None):
@@ -26,12 +28,25 @@ def parse_arguments_l2tol3(debug_args=None):
     parser.add_argument('-m', '--metadata', default=None, type=str, 
                         required=False, help='File path to metadata')
     parser.add_argument('--data_issues_path', '--issues', default=None, help="Path to data issues repository")
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only process the L2 timestamps added since the previous run, '+
+                        'using the L3 state saved in the state directory, and update the '+
+                        'output files from the first changed time step')
+    parser.add_argument('--cache_dir', default=None, type=str, required=False,
+                        help='Path to the cache of the processing stages')
+    parser.add_argument('--state_dir', default=None, type=str, required=False,
+                        help='Path where the L3 state of the incremental processing is saved. '+
+                        'Defaults to the L3_state folder of the cache directory')
+    parser.add_argument('--explain-cache', action='store_true',
+                        help='Print which input changed when a cached stage cannot be used')
 
 
     args = parser.parse_args(args=debug_args)
     return args
 
-def get_l2tol3(config_folder: Path|str, inpath, outpath, variables, metadata, data_issues_path: Path|str):
+def get_l2tol3(config_folder: Path|str, inpath, outpath, variables, metadata, data_issues_path: Path|str,
+               incremental: bool = False, cache_dir=None, explain_cache: bool = False,
+               vars_df=None, meta_dict=None, state_dir=None):
     if isinstance(config_folder, str):
         config_folder = Path(config_folder)
 
@@ -82,17 +97,49 @@ def get_l2tol3(config_folder: Path|str, inpath, outpath, variables, metadata, da
         data_issues_path = Path(data_issues_path)
 
     data_adjustments_dir = data_issues_path / "adjustments"
-    
+
+    v = pypromice.resources.load_variables(variables) if vars_df is None else vars_df
+    m = pypromice.resources.load_metadata(metadata) if meta_dict is None else meta_dict
+
+    cache = None
+    if cache_dir is not None:
+        cache = StageCache(cache_dir, explain=explain_cache)
+        cache_inputs = dict(
+            L2=hash_file(inpath),
+            station_config=hash_json(station_config),
+            adjustments=hash_file(data_adjustments_dir / (l2.attrs['station_id']+'.csv')),
+            variables=hash_table(v),
+        )
+        cache_key = cache.key(cache_inputs)
+
+    # The state of the incremental processing is kept out of the output folder
+    if incremental and state_dir is None:
+        if cache_dir is None:
+            raise ValueError("state_dir or cache_dir is needed for the incremental processing")
+        state_dir = Path(cache_dir) / 'L3_state'
+
     # Perform Level 3 processing
-    l3 = toL3(l2, data_adjustments_dir, station_config)
+    if incremental:
+        previous_l3, state = load_l3_state(state_dir, l2.attrs['station_id'])
+        l3, state = toL3_incremental(l2, data_adjustments_dir, station_config,
+                                     previous_l3, state)
+        save_l3_state(state_dir, l3, state)
+    elif cache is not None:
+        l3 = cache.get('L3', l2.attrs['station_id'], cache_inputs)
+        if l3 is None:
+            l3 = toL3(l2, data_adjustments_dir, station_config)
+            cache.put('L3', l2.attrs['station_id'], cache_inputs, l3)
+    else:
+        l3 = toL3(l2, data_adjustments_dir, station_config)
 
     # Write Level 3 dataset to file if output directory given
-    v = pypromice.resources.load_variables(variables)
-    m = pypromice.resources.load_metadata(metadata)
     if outpath is not None:
-        prepare_and_write(l3, outpath, v, m, '60min')
-        prepare_and_write(l3, outpath, v, m, '1D')
-        prepare_and_write(l3, outpath, v, m, 'M')
+        frequencies = ['60min', '1D', 'M']
+        products = None
+        if cache is not None and not incremental:
+            products = cache.resample_products(l3, frequencies, l3.attrs['station_id'], cache_key)
+        write_products(l3, outpath, frequencies, v, m, products=products,
+                       update=incremental)
     return l3
 
 def main():
@@ -105,7 +152,11 @@ def main():
                    args.outpath,
                    args.variables, 
                    args.metadata, 
-                   args.data_issues_path)
+                   args.data_issues_path,
+                   args.incremental,
+                   args.cache_dir,
+                   args.explain_cache,
+                   state_dir=args.state_dir)
     
 if __name__ == "__main__":  
     main()
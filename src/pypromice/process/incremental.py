@@ -0,0 +1,802 @@
+#!/usr/bin/env python
+"""
+Incremental Level 3 (L3) processing for near-real-time runs
+
+A full L3 processing of the station history is done once, after which the
+state needed by the stateful L3 steps is stored in a L3State. The following
+runs only process the timestamps after the anchor of the state, using a
+bounded trailing window of L2 data for the steps that need past values, and
+replace them in the previous L3 dataset:
+
+    - turbulent heat fluxes and specific humidity are calculated as in toL3
+    - GPS coordinates follow the linear regression of the current relocation
+      period, updated from its sufficient statistics
+    - surface heights are derived from the sonic rangers, the stake and the
+      pressure transducer as in combine_surface_height, using the offsets
+      between the processed sensor readings and the L3 surface heights found
+      in the last full processing
+    - the ice surface height is smoothed with smooth_ice_surface_height and
+      continues the running minimum and the gap filling of the previous run
+    - thermistor depths follow the surface height from the depths of the
+      last full processing
+
+The anchor lags SETTLING_TIME behind the last processed timestamp, because
+the centred filters of the surface height processing change the values of the
+last days when new data arrives. The timestamps up to the anchor are final.
+
+The offsets of the surface heights are only adjusted by combine_surface_height
+around the ablation seasons, and some of them depend on the following months.
+A full processing is therefore done whenever the processed timestamps reach
+the ablation months, a maintenance or relocation date or a data adjustment of
+the surface heights, when the gap filling of the ice surface height would
+change the final timestamps, and at the latest max_age after the last full
+processing. The full processing is also done whenever the station
+configuration, the data adjustments or flags of the station or the pypromice
+version change, and when the L2 data up to the last processed timestamp
+differs from the L2 data of the previous run, e.g. after the L2 processing
+was redone with new flags.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import attrs
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from pypromice.process.L2toL3 import (
+    combine_surface_height,
+    fill_short_gaps,
+    hampel,
+    interpolate_temperature,
+    process_turbulent_heat_fluxes,
+    smooth_ice_surface_height,
+    surface_height_inputs,
+    toL3,
+)
+from pypromice.process.cache import hash_json
+from pypromice.qc.github_data_issues import _getDF
+
+__all__ = [
+    "L3State",
+    "get_fingerprint",
+    "get_state",
+    "hash_l2",
+    "load_l3_state",
+    "save_l3_state",
+    "toL3_incremental",
+]
+
+logger = logging.getLogger(__name__)
+
+GPS_VARIABLES = ["gps_lat", "gps_lon", "gps_alt"]
+
+# surface height variables created by surface_height_inputs at ablation and
+# other sites, the sensor readings they are derived from, in order of
+# priority, and the sign of the relation
+SURFACE_HEIGHT_SENSORS = {
+    "ablation": {
+        "z_surf_1": [("z_boom_u", -1)],
+        "z_surf_2": [("z_stake", -1)],
+        "z_ice_surf": [("z_pt_cor", 1)],
+    },
+    "accumulation": {
+        "z_surf_1": [("z_boom_u", -1)],
+        "z_surf_2": [("z_stake", -1), ("z_boom_l", -1)],
+    },
+}
+
+# the 14-day centred median of the ice surface height only settles 7 days
+# after a timestamp, and the surface height filter of the thermistor depths
+# looks 7 timestamps further
+SETTLING_TIME = pd.Timedelta("8D")
+
+# months in which combine_surface_height detects the ablation season
+ABLATION_MONTHS = [6, 7, 8, 9]
+
+# gap filling of the ice surface height in process_surface_height
+MAX_GAP_DURATION = np.timedelta64(365, "D")
+MAX_GAP_DIFF = 0.01
+
+
+@attrs.define
+class L3State:
+    """
+    State of the stateful L3 processing steps after processing a station up
+    to last_time.
+
+    Attributes
+    ----------
+    fingerprint : str
+        Fingerprint of the inputs of the L3 processing, see get_fingerprint
+    last_time : str
+        Last processed timestamp, ISO8601
+    anchor_time : str
+        Timestamps up to anchor_time are final, the later ones are processed
+        again by the next run, ISO8601
+    full_time : str
+        Last processed timestamp of the last full processing, ISO8601
+    site_type : str
+        Site type of the station
+    gps : dict
+        For each GPS variable, start of the current relocation period and sums
+        (n, x, y, xx, xy) of the observations in that period, x being the
+        time in days since the start of the period
+    surface_offsets : dict
+        For each surface height variable of surface_height_inputs, the
+        sensors it is derived from with the offset between the variable and
+        each sensor reading, and the offset between the adjusted variable of
+        combine_surface_height and the processed variable, None if the
+        adjusted variable is missing
+    z_ice_surf_min : float, optional
+        Running minimum of the smoothed ice surface height at anchor_time
+    z_ice_surf_last : dict, optional
+        Time and value of the last ice surface height before gap filling, up
+        to anchor_time
+    z_ice_surf_gap_filled : bool, optional
+        Whether the gap following z_ice_surf_last is filled, None if there is
+        no gap at anchor_time
+    z_surf_last : dict, optional
+        Time and value of the last filtered surface height used for the
+        thermistor depths, up to anchor_time
+    thermistor_offsets : dict
+        For each thermistor depth variable, offset between the depth and the
+        filtered surface height
+    l2_hash : str, optional
+        Hash of the L2 data up to last_time, see hash_l2
+    """
+
+    fingerprint: str
+    last_time: str
+    anchor_time: Optional[str] = None
+    full_time: Optional[str] = None
+    site_type: Optional[str] = None
+    gps: Dict = attrs.field(factory=dict)
+    surface_offsets: Dict = attrs.field(factory=dict)
+    z_ice_surf_min: Optional[float] = None
+    z_ice_surf_last: Optional[Dict] = None
+    z_ice_surf_gap_filled: Optional[bool] = None
+    z_surf_last: Optional[Dict] = None
+    thermistor_offsets: Dict = attrs.field(factory=dict)
+    l2_hash: Optional[str] = None
+
+    @classmethod
+    def load_json(cls, path):
+        with Path(path).open() as fp:
+            return cls(**json.load(fp))
+
+    def dump_json(self, path):
+        with Path(path).open("w") as fp:
+            json.dump(self.as_dict(), fp, indent=2)
+
+    def as_dict(self) -> Dict:
+        return attrs.asdict(self)
+
+
+def get_fingerprint(station_config: Dict, data_adjustments_dir, station_id: str) -> str:
+    """
+    Fingerprint of the inputs that the L3 history depends on: the station
+    configuration, the data adjustment and flag files of the station and the
+    pypromice version. The flag files are read from the flags directory next
+    to data_adjustments_dir in the data issues repository.
+
+    Parameters
+    ----------
+    station_config : dict
+        Station configuration
+    data_adjustments_dir : Path or str
+        Directory of the data adjustment files
+    station_id : str
+        Station id
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+    sha = hashlib.sha256()
+    sha.update(metadata.version("pypromice").encode())
+    sha.update(json.dumps(station_config, sort_keys=True, default=str).encode())
+    data_issues_dir = Path(data_adjustments_dir).parent
+    for kind in ["adjustments", "flags"]:
+        sha.update(kind.encode())
+        issues_file = data_issues_dir / kind / f"{station_id}.csv"
+        if issues_file.exists():
+            sha.update(issues_file.read_bytes())
+    return sha.hexdigest()
+
+
+def hash_l2(l2: xr.Dataset, last_time) -> str:
+    """
+    Hash of the timestamps and data variables of a L2 dataset up to and
+    including last_time.
+
+    Parameters
+    ----------
+    l2 : xarray.Dataset
+        L2 dataset
+    last_time : str or pandas.Timestamp
+        Last timestamp included in the hash
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+    return _hash_dataset(l2.sel(time=slice(None, pd.Timestamp(last_time))))
+
+
+def _hash_dataset(ds):
+    sha = hashlib.sha256()
+    sha.update(np.ascontiguousarray(ds.time.values.astype("datetime64[ns]")).tobytes())
+    for var in sorted(ds.data_vars):
+        values = ds[var].values
+        sha.update(f"{var}:{values.dtype.str}:{values.shape}".encode())
+        if values.dtype.kind == "O":
+            sha.update("\0".join(map(str, values.ravel())).encode())
+        else:
+            sha.update(np.ascontiguousarray(values).tobytes())
+    return sha.hexdigest()
+
+
+def get_state(l2: xr.Dataset, l3: xr.Dataset, station_config: Dict,
+              fingerprint: str, data_adjustments_dir) -> L3State:
+    """
+    Extract the state of the stateful L3 steps from a L3 dataset processed
+    in full by toL3. The surface heights of surface_height_inputs and
+    combine_surface_height, which are not all kept in the L3 dataset, are
+    derived again from the L2 dataset.
+
+    Parameters
+    ----------
+    l2 : xarray.Dataset
+        L2 dataset from which l3 was processed
+    l3 : xarray.Dataset
+        L3 dataset
+    station_config : dict
+        Station configuration
+    fingerprint : str
+        Fingerprint of the L3 inputs
+    data_adjustments_dir : Path
+        Directory of the data adjustment files
+
+    Returns
+    -------
+    L3State
+        State of the L3 processing at the last timestamp of l3
+    """
+    time = l3.time.values
+    last_time = pd.Timestamp(time[-1])
+    anchor = last_time - SETTLING_TIME
+    state = L3State(
+        fingerprint=fingerprint,
+        last_time=last_time.isoformat(),
+        anchor_time=anchor.isoformat(),
+        full_time=last_time.isoformat(),
+        site_type=l3.attrs.get("site_type"),
+    )
+    state.l2_hash = hash_l2(l2, state.last_time)
+
+    # sums of the GPS observations since the last relocation
+    breaks = pd.to_datetime(station_config.get("station_relocation", []))
+    start = pd.Timestamp(time[0]) if len(breaks) == 0 else max(breaks)
+    for var in GPS_VARIABLES:
+        if var not in l2.data_vars:
+            continue
+        obs = l2[var].sel(time=slice(start, None)).to_series().dropna()
+        state.gps[var] = dict(start=start.isoformat(), n=0, x=0.0, y=0.0, xx=0.0, xy=0.0)
+        _update_gps_sums(state.gps[var], obs)
+
+    if "z_surf_combined" not in l3.data_vars or \
+            state.site_type not in ["ablation", "accumulation", "bedrock"]:
+        return state
+
+    # surface heights before and after combine_surface_height
+    surface_sensors = _surface_height_sensors(state.site_type)
+    sensors = [s for v in surface_sensors.values() for s, _ in v if s in l2.data_vars]
+    ds = surface_height_inputs(l2[sensors].copy(), data_adjustments_dir)
+    variables = [v for v in surface_sensors if v in ds.data_vars]
+    df = ds[variables].to_dataframe()[variables]
+    z_surf_combined, z_ice_surf, z_surf_1_adj, z_surf_2_adj = combine_surface_height(
+        df.copy(), state.site_type)
+    adjusted = {"z_surf_1": z_surf_1_adj, "z_surf_2": z_surf_2_adj, "z_ice_surf": z_ice_surf}
+
+    # offsets between sensor readings and surface heights
+    for var in variables:
+        info = dict(sensors=[], adjusted=None)
+        covered = pd.Series(False, index=df.index)
+        for sensor, sign in surface_sensors[var]:
+            if sensor not in l2.data_vars:
+                continue
+            reading = l2[sensor].to_series()
+            diff = (df[var] - sign * reading)[~covered].dropna()
+            if len(diff) > 0:
+                info["sensors"].append(dict(sensor=sensor, sign=sign, offset=float(diff.iloc[-1])))
+            covered |= reading.notnull()
+        processed = _process_surface_height(df[var], var, state.site_type)
+        diff = (adjusted[var] - processed).dropna()
+        # a missing adjustment makes the rest of the adjusted series missing
+        if len(diff) > 0 and processed.last_valid_index() == adjusted[var].last_valid_index():
+            info["adjusted"] = float(diff.iloc[-1])
+        state.surface_offsets[var] = info
+
+    if state.site_type == "ablation":
+        smoothed = smooth_ice_surface_height(z_ice_surf, z_surf_combined, z_surf_2_adj)
+        running_min = smoothed.cummin()
+        filled = fill_short_gaps(running_min.index.values, running_min.values,
+                                 max_duration=MAX_GAP_DURATION, max_diff=MAX_GAP_DIFF)
+        _update_ice_surface_state(state, smoothed, running_min, filled, anchor)
+
+    # offsets between thermistor depths and filtered surface height
+    z_surf = _filter_surface_height(l3.z_surf_combined.to_series())
+    _update_surface_state(state, z_surf, anchor)
+    z_surf = z_surf.interpolate()
+    for var in [v for v in l3.data_vars if v.startswith("d_t_i_")]:
+        diff = (l3[var].to_series() - z_surf).dropna()
+        if len(diff) > 0:
+            state.thermistor_offsets[var] = float(diff.iloc[-1])
+    return state
+
+
+def toL3_incremental(
+    l2: xr.Dataset,
+    data_adjustments_dir: Path,
+    station_config: Dict = {},
+    previous_l3: Optional[xr.Dataset] = None,
+    state: Optional[L3State] = None,
+    window: str = "30D",
+    max_age: str = "7D",
+) -> Tuple[xr.Dataset, L3State]:
+    """
+    Process a L2 dataset to L3, only processing the timestamps after the
+    anchor of the previous run when a valid state is available.
+
+    Parameters
+    ----------
+    l2 : xarray.Dataset
+        L2 AWS data, full history
+    data_adjustments_dir : Path
+        Directory of the data adjustment files
+    station_config : dict
+        Station configuration
+    previous_l3 : xarray.Dataset, optional
+        L3 dataset of the previous run
+    state : L3State, optional
+        State of the previous run
+    window : str
+        Length of the trailing window of L2 data before the anchor used when
+        processing the timestamps after the anchor. The default is "30D".
+    max_age : str
+        Maximum time between the last timestamp of the last full processing
+        and the last L2 timestamp, after which the processing is done in full
+        again. The default is "7D".
+
+    Returns
+    -------
+    l3 : xarray.Dataset
+        L3 dataset
+    state : L3State
+        Updated state
+    """
+    station_id = l2.attrs["station_id"]
+    fingerprint = get_fingerprint(station_config, data_adjustments_dir, station_id)
+
+    if state is None or previous_l3 is None:
+        reason = "no previous state"
+    elif state.fingerprint != fingerprint:
+        reason = "configuration, data issues or pypromice version changed"
+    elif pd.Timestamp(previous_l3.time.values[-1]) != pd.Timestamp(state.last_time):
+        reason = "previous L3 and state do not match"
+    elif state.l2_hash != hash_l2(l2, state.last_time):
+        reason = f"L2 data changed before {state.last_time}"
+    elif not (l2.time.values > pd.Timestamp(state.last_time).to_datetime64()).any():
+        logger.info(f"No new L2 data for {station_id}")
+        return previous_l3, state
+    else:
+        reason = _full_processing_reason(l2, state, station_config,
+                                         data_adjustments_dir, window, max_age)
+
+    if reason is None:
+        l3, new_state, reason = _process_tail(l2, previous_l3, state, window)
+        if reason is None:
+            logger.info(f"Incremental L3 processing of {station_id} after {state.anchor_time}")
+            return l3, new_state
+
+    logger.info(f"Full L3 processing of {station_id}: {reason}")
+    l3 = toL3(l2.copy(deep=True), data_adjustments_dir, station_config)
+    return l3, get_state(l2, l3, station_config, fingerprint, data_adjustments_dir)
+
+
+def load_l3_state(folder, station_id: str) -> Tuple[Optional[xr.Dataset], Optional[L3State]]:
+    """
+    Load the L3 dataset and state saved by save_l3_state.
+
+    Parameters
+    ----------
+    folder : Path or str
+        State directory, the state of each station is saved in a sub-folder
+    station_id : str
+        Station id
+
+    Returns
+    -------
+    l3 : xarray.Dataset or None
+        L3 dataset of the previous run, None if not found
+    state : L3State or None
+        State of the previous run, None if not found
+    """
+    folder = Path(folder) / station_id
+    state_file = folder / f"{station_id}_L3_state.json"
+    years_file = folder / f"{station_id}_L3_years.json"
+    if not (state_file.exists() and years_file.exists()):
+        return None, None
+    with years_file.open() as fp:
+        years = json.load(fp)
+    parts = []
+    for year in sorted(years):
+        year_file = folder / f"{station_id}_L3_{year}.nc"
+        if not year_file.exists():
+            logger.warning(f"Missing L3 state file {year_file}")
+            return None, None
+        with xr.open_dataset(year_file) as ds:
+            parts.append(ds.load())
+    l3 = xr.concat(parts, dim="time", data_vars="all", coords="minimal",
+                   combine_attrs="override") if len(parts) > 1 else parts[0]
+    l3.attrs = parts[-1].attrs
+    for varname in l3.variables:
+        l3[varname].encoding = {}
+    if 'bedrock' in l3.attrs.keys():
+        l3.attrs['bedrock'] = l3.attrs['bedrock'] == 'True'
+    if 'number_of_booms' in l3.attrs.keys():
+        l3.attrs['number_of_booms'] = int(l3.attrs['number_of_booms'])
+    return l3, L3State.load_json(state_file)
+
+
+def save_l3_state(folder, l3: xr.Dataset, state: L3State):
+    """
+    Save the unrounded L3 dataset and the state of a run, to be used by the
+    next incremental run. The L3 dataset is saved in yearly files, and only
+    the years that changed since the previous save are written.
+
+    Parameters
+    ----------
+    folder : Path or str
+        State directory, the state of each station is saved in a sub-folder
+    l3 : xarray.Dataset
+        L3 dataset
+    state : L3State
+        State of the L3 processing
+    """
+    station_id = l3.attrs["station_id"]
+    folder = Path(folder) / station_id
+    folder.mkdir(exist_ok=True, parents=True)
+    years_file = folder / f"{station_id}_L3_years.json"
+    previous = {}
+    if years_file.exists():
+        with years_file.open() as fp:
+            previous = json.load(fp)
+
+    l3 = l3.copy()
+    l3.attrs = {k: str(v) if isinstance(v, bool) else v for k, v in l3.attrs.items()}
+    years = {}
+    for year, ds in l3.groupby(l3.time.dt.strftime("%Y")):
+        # the attributes are hashed as they are kept from the last year
+        years[year] = _hash_dataset(ds) + hash_json(ds.attrs)
+        year_file = folder / f"{station_id}_L3_{year}.nc"
+        if previous.get(year) != years[year] or not year_file.exists():
+            tmp = folder / f"{station_id}_L3_{year}.nc.tmp"
+            ds.to_netcdf(tmp)
+            os.replace(tmp, year_file)
+    for year in set(previous) - set(years):
+        (folder / f"{station_id}_L3_{year}.nc").unlink(missing_ok=True)
+
+    # the state is written last, as it is only valid with these L3 files
+    tmp = folder / f"{station_id}_L3_years.json.tmp"
+    with tmp.open("w") as fp:
+        json.dump(years, fp, indent=2)
+    os.replace(tmp, years_file)
+    tmp = folder / f"{station_id}_L3_state.json.tmp"
+    state.dump_json(tmp)
+    os.replace(tmp, folder / f"{station_id}_L3_state.json")
+
+
+def _full_processing_reason(l2, state, station_config, data_adjustments_dir,
+                            window, max_age) -> Optional[str]:
+    # reasons for a full processing that are known before processing the
+    # timestamps after the anchor
+    end = pd.Timestamp(l2.time.values[-1])
+    anchor = pd.Timestamp(state.anchor_time)
+    start = anchor - pd.Timedelta(window)
+    # timestamps whose surface heights are smoothed with the new data
+    smoothed = l2.time.sel(time=slice(anchor - pd.Timedelta("7D"), None))
+
+    if end - pd.Timestamp(state.full_time) > pd.Timedelta(max_age):
+        return f"more than {max_age} since the last full processing"
+    if start < pd.Timestamp(l2.time.values[0]):
+        return "record shorter than the processing window"
+    if state.site_type not in ["ablation", "accumulation", "bedrock"]:
+        return f"site type {state.site_type} not supported"
+    if state.site_type == "ablation" and smoothed.dt.month.isin(ABLATION_MONTHS).any():
+        return "ablation season"
+
+    dates = [m.get("date") for m in station_config.get("string_maintenance", [])]
+    dates += list(station_config.get("station_relocation", []))
+    dates = pd.to_datetime(dates)
+    if ((dates > anchor - pd.Timedelta("7D")) & (dates < end + pd.Timedelta("7D"))).any():
+        return "maintenance or relocation"
+
+    adjustments = _getDF(Path(data_adjustments_dir) / f"{l2.attrs['station_id']}.csv")
+    if adjustments is not None:
+        for var, t0, t1 in zip(adjustments.variable, adjustments.t0, adjustments.t1):
+            if not any(var == v or ("*" in var and var != "*" and re.search(var, v))
+                       for v in ["z_surf_1", "z_surf_2", "z_ice_surf"]):
+                continue
+            t0 = pd.Timestamp.min if pd.isnull(t0) else pd.to_datetime(t0, utc=True).tz_localize(None)
+            t1 = pd.Timestamp.max if pd.isnull(t1) else pd.to_datetime(t1, utc=True).tz_localize(None)
+            if t0 <= end and t1 >= start:
+                return f"data adjustment of {var}"
+
+    new = l2.sel(time=slice(pd.Timestamp(state.last_time) + pd.Timedelta("1ns"), None))
+    for var, sums in state.gps.items():
+        if sums["n"] + int(new[var].notnull().sum()) in [1, 2]:
+            return f"fewer than three {var} observations"
+    for var, info in state.surface_offsets.items():
+        known = [s["sensor"] for s in info["sensors"]]
+        for sensor, _ in _surface_height_sensors(state.site_type)[var]:
+            if sensor not in known and sensor in new.data_vars and new[sensor].notnull().any():
+                return f"first {sensor} readings"
+    return None
+
+
+def _process_tail(l2, previous_l3, state, window):
+    # processing of the timestamps after the anchor, returning the reason for
+    # a full processing if the new data changes the final timestamps
+    last_time = pd.Timestamp(state.last_time)
+    anchor = pd.Timestamp(state.anchor_time)
+    state = L3State(**state.as_dict())
+
+    tail = l2.sel(time=slice(anchor - pd.Timedelta(window), None)).copy()
+    tail.attrs["level"] = "L3"
+    tail = process_turbulent_heat_fluxes(tail)
+    df = tail.to_dataframe()
+    ind_new = df.index > anchor
+    end = df.index[-1]
+    # the anchor only moves forward
+    new_anchor = max(anchor, end - SETTLING_TIME)
+
+    # GPS coordinates from the regression of the current relocation period
+    for var, sums in state.gps.items():
+        _update_gps_sums(sums, df.loc[df.index > last_time, var].dropna())
+        x = (df.index - pd.Timestamp(sums["start"])) / pd.Timedelta("1D")
+        out = var.replace("gps_", "")
+        if sums["n"] > 2:
+            slope, intercept = _gps_fit(sums)
+            df[out] = slope * x + intercept
+        else:
+            df[out] = previous_l3[out].values[-1]
+    # coordinates without observations keep their static value
+    for out in ["lat", "lon", "alt"]:
+        if out in previous_l3.data_vars and out not in df:
+            df[out] = previous_l3[out].values[-1]
+
+    if "z_surf_combined" in previous_l3.data_vars:
+        df, reason = _surface_height(df, state, ind_new, new_anchor)
+        if reason is not None:
+            return None, None, reason
+        if state.site_type != "bedrock":
+            df, reason = _thermistor_depth(df, state, ind_new, previous_l3, new_anchor)
+            if reason is not None:
+                return None, None, reason
+
+    new = xr.Dataset.from_dataframe(df.loc[ind_new])
+    new.attrs = previous_l3.attrs
+    for var in previous_l3.data_vars:
+        if var not in new.data_vars:
+            new[var] = ("time", np.full(len(new.time), np.nan))
+    new = new[list(previous_l3.data_vars)]
+    l3 = xr.concat([previous_l3.sel(time=slice(None, anchor)), new], dim="time",
+                   data_vars="all", coords="minimal", combine_attrs="override")
+
+    state.last_time = end.isoformat()
+    state.anchor_time = new_anchor.isoformat()
+    state.l2_hash = hash_l2(l2, state.last_time)
+    return l3, state, None
+
+
+def _update_gps_sums(sums, obs):
+    x = ((obs.index - pd.Timestamp(sums["start"])) / pd.Timedelta("1D")).values
+    y = obs.values.astype(float)
+    sums["n"] += len(y)
+    sums["x"] += float(x.sum())
+    sums["y"] += float(y.sum())
+    sums["xx"] += float((x * x).sum())
+    sums["xy"] += float((x * y).sum())
+
+
+def _gps_fit(sums):
+    n = sums["n"]
+    sxx = sums["xx"] - sums["x"] ** 2 / n
+    sxy = sums["xy"] - sums["x"] * sums["y"] / n
+    slope = sxy / sxx if sxx > 0 else 0.0
+    intercept = (sums["y"] - slope * sums["x"]) / n
+    return slope, intercept
+
+
+def _surface_height_sensors(site_type):
+    if site_type == "ablation":
+        return SURFACE_HEIGHT_SENSORS["ablation"]
+    return SURFACE_HEIGHT_SENSORS["accumulation"]
+
+
+def _process_surface_height(values, var, site_type):
+    # filtering and interpolation of a surface height in
+    # combine_surface_height, before the adjustments
+    values = values.interpolate(limit=72)
+    if site_type != "ablation":
+        return hampel(values)
+    if var == "z_ice_surf":
+        values = hampel(values)
+    else:
+        values = hampel(values, k=24, t0=5)
+    return values.interpolate(limit=24*2).interpolate(limit=24*2)
+
+
+def _filter_surface_height(z_surf):
+    # surface height filter of get_thermistor_depth
+    return z_surf.where(~(z_surf.rolling(window=14, center=True).var() > 0.1))
+
+
+def _update_ice_surface_state(state, smoothed, running_min, filled, anchor):
+    # running minimum and gap filling of the ice surface height at the anchor
+    upto = running_min.index <= anchor
+    if not upto.any():
+        return
+    if smoothed[upto].notnull().any():
+        state.z_ice_surf_min = float(np.fmin(
+            np.nan if state.z_ice_surf_min is None else state.z_ice_surf_min,
+            smoothed[upto].min()))
+    valid = running_min[upto].dropna()
+    if len(valid) > 0:
+        state.z_ice_surf_last = dict(time=valid.index[-1].isoformat(),
+                                     value=float(valid.iloc[-1]))
+    state.z_ice_surf_gap_filled = None
+    if state.z_ice_surf_last is not None:
+        gap = (running_min.index > pd.Timestamp(state.z_ice_surf_last["time"])) & upto
+        if gap.any():
+            state.z_ice_surf_gap_filled = bool(~np.isnan(filled[gap][-1]))
+
+
+def _update_surface_state(state, z_surf, anchor):
+    # last filtered surface height at the anchor
+    valid = z_surf[z_surf.index <= anchor].dropna()
+    if len(valid) > 0:
+        state.z_surf_last = dict(time=valid.index[-1].isoformat(),
+                                 value=float(valid.iloc[-1]))
+
+
+def _surface_height(df, state, ind_new, new_anchor):
+    adjusted = {}
+    for var, info in state.surface_offsets.items():
+        values = pd.Series(np.nan, index=df.index)
+        for sensor in info["sensors"]:
+            values = values.combine_first(
+                sensor["sign"] * df[sensor["sensor"]] + sensor["offset"])
+        df[var] = values
+        if info["adjusted"] is None:
+            adjusted[var] = pd.Series(np.nan, index=df.index)
+        else:
+            adjusted[var] = _process_surface_height(values, var, state.site_type) \
+                + info["adjusted"]
+
+    nan = pd.Series(np.nan, index=df.index)
+    df["z_surf_1_adj"] = adjusted.get("z_surf_1", nan)
+    df["z_surf_2_adj"] = adjusted.get("z_surf_2", nan)
+    # outside of the ablation season, the average of both surface heights
+    z_surf = df[["z_surf_1_adj", "z_surf_2_adj"]].mean(axis=1)
+
+    if state.site_type != "ablation":
+        df["z_surf_combined"] = z_surf
+        df["z_ice_surf"] = np.nan
+        df["snow_height"] = z_surf
+        return df, None
+
+    smoothed = smooth_ice_surface_height(adjusted.get("z_ice_surf", nan), z_surf,
+                                         df["z_surf_2_adj"])[ind_new]
+    # continuing the running minimum of the previous run
+    z_ice_min = np.nan if state.z_ice_surf_min is None else state.z_ice_surf_min
+    running_min = np.fmin.accumulate(np.r_[z_ice_min, smoothed.values])[1:]
+    running_min = pd.Series(np.where(smoothed.isnull(), np.nan, running_min),
+                            index=smoothed.index)
+
+    # gap filling, continuing the gap following the last value of the
+    # previous run
+    last = state.z_ice_surf_last
+    if last is None:
+        if running_min.notnull().any():
+            return df, "first ice surface height"
+        filled = running_min.values
+    else:
+        time = np.r_[np.datetime64(pd.Timestamp(last["time"])),
+                     np.datetime64(pd.Timestamp(state.anchor_time)),
+                     running_min.index.values]
+        filled = fill_short_gaps(time, np.r_[last["value"], np.nan, running_min.values],
+                                 max_duration=MAX_GAP_DURATION, max_diff=MAX_GAP_DIFF)
+        if state.z_ice_surf_gap_filled is not None and \
+                state.z_ice_surf_gap_filled == np.isnan(filled[1]):
+            return df, "ice surface height gap filled differently"
+        filled = filled[2:]
+
+    df["z_ice_surf"] = np.nan
+    df.loc[ind_new, "z_ice_surf"] = filled
+    df["z_surf_combined"] = np.maximum(z_surf, df["z_ice_surf"])
+    df["snow_height"] = np.maximum(0, df["z_surf_combined"] - df["z_ice_surf"])
+    df["z_ice_surf"] = df["z_ice_surf"].where(df["snow_height"].notnull())
+
+    _update_ice_surface_state(state, smoothed, running_min, filled, new_anchor)
+    return df, None
+
+
+def _thermistor_depth(df, state, ind_new, previous_l3, new_anchor):
+    depth_cols = sorted([v for v in previous_l3.data_vars if v.startswith("d_t_i_")],
+                        key=lambda v: int(v.split("_")[-1]))
+    temp_cols = [f"t_i_{i}" for i in range(12) if f"t_i_{i}" in df]
+    if len(depth_cols) == 0:
+        return df, None
+
+    # the filter looks at the final surface heights before the anchor
+    z_surf = df["z_surf_combined"].copy()
+    previous = previous_l3.z_surf_combined.to_series().reindex(df.index[~ind_new])
+    z_surf[~ind_new] = previous.values
+    z_surf = _filter_surface_height(z_surf)[ind_new]
+    if len(state.thermistor_offsets) == 0 and z_surf.notnull().any():
+        return df, "first surface height for the thermistor depths"
+
+    # linear interpolation over the timestamps, as pandas' interpolate, from
+    # the last surface height of the previous run
+    position = np.flatnonzero(ind_new).astype(float)
+    valid = z_surf.notnull().values
+    xp, fp = position[valid], z_surf.values[valid]
+    if state.z_surf_last is not None:
+        # number of timestamps between the last surface height and the anchor
+        time = previous_l3.time.values
+        n_gap = np.searchsorted(time, np.datetime64(pd.Timestamp(state.anchor_time)),
+                                side="right") \
+            - np.searchsorted(time, np.datetime64(pd.Timestamp(state.z_surf_last["time"])),
+                              side="right")
+        if n_gap > 0 and valid.any():
+            # the interpolation in the gap before the anchor changes
+            return df, "surface height gap closed"
+        xp = np.r_[position[0] - 1 - n_gap, xp]
+        fp = np.r_[state.z_surf_last["value"], fp]
+    if len(xp) > 0:
+        z_interp = np.interp(position, xp, fp, left=np.nan)
+    else:
+        z_interp = np.full(len(position), np.nan)
+    _update_surface_state(state, z_surf, new_anchor)
+
+    offsets = np.array([state.thermistor_offsets.get(v, np.nan) for v in depth_cols])
+    depth = z_interp[:, None] + offsets[None, :]
+    temp = df.loc[ind_new, temp_cols].values.astype(float)
+    with np.errstate(invalid="ignore"):
+        # surfaced thermistor
+        temp[depth < 0.1] = np.nan
+        # removing negative depth
+        depth[depth < 0] = np.nan
+    df.loc[ind_new, temp_cols] = temp
+    df[depth_cols] = np.nan
+    df.loc[ind_new, depth_cols] = depth
+
+    t_i_10m = interpolate_temperature(
+        df.index.values[ind_new], depth, temp, kind="linear", min_diff_to_depth=1.5,
+    )["temperatureObserved"].values
+    with np.errstate(invalid="ignore"):
+        t_i_10m[(t_i_10m > 0.1) | (t_i_10m < -70)] = np.nan
+    df["t_i_10m"] = np.nan
+    df.loc[ind_new, "t_i_10m"] = t_i_10m
+    return df, None
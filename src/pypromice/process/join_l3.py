@@ -6,7 +6,7 @@ from argparse import ArgumentParser
 from pypromice.utilities.git import get_commit_hash_and_check_dirty
 
 import pypromice.resources
-from pypromice.process.write import prepare_and_write
+from pypromice.process.write import write_products
 import numpy as np
 import pandas as pd
 import xarray as xr
@@ -308,7 +308,30 @@ def align_surface_heights(data_series_new, data_series_old):
     return data_series_new
 
 
-def build_station_list(config_folder: str, target_station_site: str) -> list:
+def load_station_configs(config_folder: str) -> dict:
+    """
+    Load all the station configuration TOML files of a folder.
+
+    Parameters
+    ----------
+    config_folder : str
+        Path to the folder containing the station configuration TOML files.
+
+    Returns
+    -------
+    dict
+        Station configurations by file name, without the .toml extension.
+    """
+    station_configs = {}
+    for filename in sorted(os.listdir(config_folder)):
+        if filename.endswith(".toml"):
+            with open(os.path.join(config_folder, filename), "r") as file:
+                station_configs[filename[:-5]] = toml.load(file)
+    return station_configs
+
+
+def build_station_list(config_folder: str, target_station_site: str,
+                       station_configs: dict = None) -> list:
     """
     Get a list of unique station information dictionaries for a given station site.
 
@@ -318,32 +341,32 @@ def build_station_list(config_folder: str, target_station_site: str) -> list:
         Path to the folder containing the station configuration TOML files.
     target_station_site : str
         The station site to filter the station information by.
+    station_configs : dict, optional
+        Station configurations already loaded with load_station_configs. If
+        None, they are loaded from config_folder.
 
     Returns
     -------
     list
         A list of dictionaries containing station information that have the specified station site.
     """
+    if station_configs is None:
+        station_configs = load_station_configs(config_folder)
     station_info_list = []  # Initialize an empty list to store station information
 
     found_as_station = False
-    for filename in os.listdir(config_folder):
-        if filename.endswith(".toml"):
-            file_path = os.path.join(config_folder, filename)
-
-            with open(file_path, "r") as file:
-                data = toml.load(file)  # Load the TOML file
-                station_site = data.get("station_site")  # Get the station site
-                stid = data.get("stid")  # Get the station ID
-
-                # Check if the station site matches the target and stid is unique
-                if stid == target_station_site:
-                    found_as_station = True
-                if station_site == target_station_site and stid:
-                    station_info = data.copy()  # Copy all attributes from the TOML file
-                    station_info_list.append(
-                        station_info
-                    )  # Add the station info to the list
+    for data in station_configs.values():
+        station_site = data.get("station_site")  # Get the station site
+        stid = data.get("stid")  # Get the station ID
+
+        # Check if the station site matches the target and stid is unique
+        if stid == target_station_site:
+            found_as_station = True
+        if station_site == target_station_site and stid:
+            station_info = data.copy()  # Copy all attributes from the TOML file
+            station_info_list.append(
+                station_info
+            )  # Add the station info to the list
 
     if len(station_info_list) == 0 and not found_as_station:
         logger.error(
@@ -366,9 +389,10 @@ def build_station_list(config_folder: str, target_station_site: str) -> list:
     return station_info_list
 
 
-def join_l3(config_folder, site, folder_l3, folder_gcnet, outpath, variables, metadata):
+def join_l3(config_folder, site, folder_l3, folder_gcnet, outpath, variables, metadata,
+            vars_df=None, meta_dict=None, station_configs=None):
     # Get the list of station information dictionaries associated with the given site
-    list_station_info = build_station_list(config_folder, site)
+    list_station_info = build_station_list(config_folder, site, station_configs)
 
     # Read the datasets and store them into a list along with their latest timestamp and station info
     list_station_data = []
@@ -535,12 +559,11 @@ def join_l3(config_folder, site, folder_l3, folder_gcnet, outpath, variables, me
                     site_source[k] = v
     l3_merged.attrs["source"] = json.dumps(site_source)
 
-    v = pypromice.resources.load_variables(variables)
-    m = pypromice.resources.load_metadata(metadata)
+    v = pypromice.resources.load_variables(variables) if vars_df is None else vars_df
+    m = pypromice.resources.load_metadata(metadata) if meta_dict is None else meta_dict
     if outpath is not None:
-        prepare_and_write(l3_merged, outpath, v, m, "60min", nc_compression=True)
-        prepare_and_write(l3_merged, outpath, v, m, "1D", nc_compression=True)
-        prepare_and_write(l3_merged, outpath, v, m, "M", nc_compression=True)
+        write_products(l3_merged, outpath, ["60min", "1D", "M"], v, m,
+                       nc_compression=True)
     return l3_merged, sorted_list_station_data
 
 
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+"""
+Batch processing of a fleet of stations
+
+All the stations with a L0 configuration file in a folder are processed from
+L0 to L3 on a pool of worker processes, and the sites are joined once all
+their member stations are processed, following a station to site
+dependency graph. The workers are started once, so that
+the package import and the parsing of the variables and metadata tables are
+only done once per worker instead of once per station.
+"""
+import json
+import logging
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import attr
+import pandas as pd
+
+import pypromice.resources
+from pypromice.process import load
+from pypromice.process.cache import hash_file, hash_json
+from pypromice.process.get_l2 import get_l2
+from pypromice.process.get_l2tol3 import get_l2tol3
+from pypromice.process.join_l3 import join_l3, load_station_configs
+from pypromice.utilities.dependency_graph import DependencyGraph
+
+__all__ = [
+    "FleetTask",
+    "build_fleet_graph",
+    "build_fleet_tasks",
+    "get_affected_tasks",
+    "get_task_hashes",
+    "process_fleet",
+]
+
+logger = logging.getLogger(__name__)
+
+# Rough ratio between the memory used by a task and the size of its input
+# files, used to estimate the memory use of a task
+MEMORY_PER_INPUT_BYTE = 10
+
+# Variables and metadata tables parsed once for each worker process
+_resources = {}
+
+
+def parse_arguments_fleet(debug_args=None):
+    parser = ArgumentParser(description="Process a fleet of AWS from L0 to L3 "+
+                            "and join the L3 data of each site")
+    parser.add_argument('-c', '--config_folder', type=str, required=True,
+                        help='Path to folder with the L0 configuration (TOML) files')
+    parser.add_argument('-i', '--inpath', type=str, required=True,
+                        help='Path to L0 data')
+    parser.add_argument('-s', '--station_config_folder', type=str, required=True,
+                        help='Path to folder with sites configuration (TOML) files')
+    parser.add_argument('--data_issues_path', '--issues', default=None,
+                        help="Path to data issues repository")
+    parser.add_argument('--outpath_l2', type=str, required=True,
+                        help='Path where to write the L2 station data')
+    parser.add_argument('--outpath_l3', type=str, required=True,
+                        help='Path where to write the L3 station data')
+    parser.add_argument('--outpath_sites', type=str, default=None,
+                        help='Path where to write the L3 site data. '+
+                        'Sites are not joined if not given')
+    parser.add_argument('-gc', '--folder_gcnet', type=str, required=True,
+                        help='Path to GC-Net historical L1 folder')
+    parser.add_argument('-v', '--variables', default=None, type=str,
+                        required=False, help='File path to variables look-up table')
+    parser.add_argument('-m', '--metadata', default=None, type=str,
+                        required=False, help='File path to metadata')
+    parser.add_argument('-w', '--workers', default=None, type=int,
+                        help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--memory_budget', default=None, type=float,
+                        help='Maximum estimated memory in GB used by the running tasks')
+    parser.add_argument('--summary', default=None, type=str,
+                        help='Path of the .csv summary of the run')
+    parser.add_argument('--only-changed', action='store_true',
+                        help='Only process the stations and sites whose inputs changed '+
+                        'since their last successful run')
+    args = parser.parse_args(args=debug_args)
+    return args
+
+
+@attr.define
+class FleetTask:
+    """
+    Processing of a station from L0 to L3 (kind "station") or join of the L3
+    data of a site (kind "site").
+    """
+    name: str
+    kind: str
+    memory: int = 0
+    config_file: Optional[str] = None
+    input_files: List[str] = attr.field(factory=list)
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}:{self.name}"
+
+
+def _station_inpath(config_file, inpath) -> str:
+    station_name = Path(config_file).stem
+    station_path = os.path.join(inpath, station_name)
+    return station_path if os.path.exists(station_path) else inpath
+
+
+def _l0_files(config_file, inpath) -> List[str]:
+    try:
+        conf = load.getConfig(config_file, _station_inpath(config_file, inpath))
+    except Exception:
+        # the error is reported when the station is processed
+        return []
+    return [c["file"] for c in conf.values()]
+
+
+def _estimate_memory(paths) -> int:
+    size = sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+    return size * MEMORY_PER_INPUT_BYTE
+
+
+def _station_site(stid, station_configs) -> str:
+    return station_configs.get(stid, {}).get("station_site", stid)
+
+
+def build_fleet_tasks(config_folder, inpath, station_config_folder,
+                      data_issues_path=None, folder_gcnet=None,
+                      join_sites: bool = True,
+                      station_configs: Optional[dict] = None) -> Dict[str, FleetTask]:
+    """
+    List the station and site tasks of a fleet, with their input files.
+
+    Parameters
+    ----------
+    config_folder : str or Path
+        Folder with the L0 configuration files, one per station
+    inpath : str or Path
+        Folder with the L0 data
+    station_config_folder : str or Path
+        Folder with the station configuration files, giving the site of
+        each station
+    data_issues_path : str or Path, optional
+        Path to the data issues repository
+    folder_gcnet : str or Path, optional
+        Folder with the historical GC-Net data
+    join_sites : bool
+        If True, a task is added for the site of each station. The default
+        is True.
+    station_configs : dict, optional
+        Station configurations loaded with join_l3.load_station_configs. If
+        None, they are loaded from station_config_folder.
+
+    Returns
+    -------
+    dict
+        Tasks by key
+    """
+    if station_configs is None:
+        station_configs = load_station_configs(station_config_folder)
+    tasks = {}
+    for config_file in sorted(Path(config_folder).glob("*.toml")):
+        stid = config_file.stem
+        l0_files = _l0_files(config_file.as_posix(), inpath)
+        input_files = [config_file.as_posix(), *l0_files,
+                       os.path.join(station_config_folder, f"{stid}.toml")]
+        if data_issues_path is not None:
+            input_files += [os.path.join(data_issues_path, folder, f"{stid}.csv")
+                            for folder in ["flags", "adjustments"]]
+        task = FleetTask(name=stid, kind="station",
+                         memory=_estimate_memory(l0_files),
+                         config_file=config_file.as_posix(),
+                         input_files=input_files)
+        tasks[task.key] = task
+    if not join_sites:
+        return tasks
+
+    stids = set(station_configs) | {task.name for task in tasks.values()}
+    sites = sorted({_station_site(task.name, station_configs) for task in tasks.values()})
+    for site in sites:
+        members = sorted(stid for stid in stids
+                         if _station_site(stid, station_configs) == site)
+        input_files = [os.path.join(station_config_folder, f"{stid}.toml")
+                       for stid in members]
+        if folder_gcnet is not None:
+            input_files += [os.path.join(folder_gcnet, f"{stid}.csv")
+                            for stid in members]
+        task = FleetTask(
+            name=site,
+            kind="site",
+            memory=sum(tasks[f"station:{stid}"].memory for stid in members
+                       if f"station:{stid}" in tasks),
+            input_files=input_files,
+        )
+        tasks[task.key] = task
+    return tasks
+
+
+def build_fleet_graph(tasks: Dict[str, FleetTask], station_configs: dict) -> DependencyGraph:
+    """
+    Dependency graph of the tasks, with an edge from each station to its site.
+
+    Parameters
+    ----------
+    tasks : dict
+        Tasks by key, from build_fleet_tasks
+    station_configs : dict
+        Station configurations by station id
+
+    Returns
+    -------
+    DependencyGraph
+        Graph with the task keys as node names
+    """
+    graph = DependencyGraph()
+    for key, task in tasks.items():
+        graph.add_node(key)
+        site_key = f"site:{_station_site(task.name, station_configs)}"
+        if task.kind == "station" and site_key in tasks:
+            graph.add_edge(key, site_key)
+    return graph
+
+
+def get_task_hashes(tasks: Dict[str, FleetTask], extra_files=()) -> Dict[str, str]:
+    """
+    Hash of the input files of each task, extra_files being inputs of all
+    tasks, such as the variables and metadata tables.
+    """
+    extra = {str(f): hash_file(f) for f in extra_files}
+    return {
+        key: hash_json(dict(extra, **{str(f): hash_file(f) for f in task.input_files}))
+        for key, task in tasks.items()
+    }
+
+
+def get_affected_tasks(graph: DependencyGraph, changed: Set[str]) -> Set[str]:
+    """
+    Tasks to run when the inputs of the changed tasks were modified: the
+    changed tasks and all the tasks that depend on them.
+    """
+    affected = set(changed)
+    for key in changed:
+        affected |= graph.nodes[key].get_children_closure()
+    return affected
+
+
+def _output_file(task: FleetTask, outpath_l3, outpath_sites) -> Path:
+    folder = outpath_l3 if task.kind == "station" else outpath_sites
+    return Path(folder) / task.name / f"{task.name}_hour.nc"
+
+
+def _init_worker(vars_df, meta_dict):
+    _resources["vars_df"] = vars_df
+    _resources["meta_dict"] = meta_dict
+
+
+def _run_station(config_file, inpath, station_config_folder, data_issues_path,
+                 outpath_l2, outpath_l3, variables, metadata) -> float:
+    start = time.perf_counter()
+    aws = get_l2(config_file, inpath, outpath_l2, variables, metadata,
+                 data_issues_path, **_resources)
+    stid = aws.L2.attrs["station_id"]
+    get_l2tol3(station_config_folder,
+               os.path.join(outpath_l2, stid, f"{stid}_hour.nc"),
+               outpath_l3, variables, metadata, data_issues_path,
+               **_resources)
+    return time.perf_counter() - start
+
+
+def _run_site(site, station_config_folder, folder_l3, folder_gcnet, outpath,
+              variables, metadata, station_configs) -> float:
+    start = time.perf_counter()
+    l3, _ = join_l3(station_config_folder, site, folder_l3, folder_gcnet,
+                    outpath, variables, metadata, station_configs=station_configs,
+                    **_resources)
+    if l3 is None:
+        raise ValueError(f"No station data could be joined for {site}")
+    return time.perf_counter() - start
+
+
+def _load_state(state_file) -> Dict[str, str]:
+    if state_file is None or not os.path.isfile(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def _save_state(state_file, state: Dict[str, str]):
+    tmp = f"{state_file}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, state_file)
+
+
+def process_fleet(config_folder, inpath, station_config_folder, data_issues_path,
+                  outpath_l2, outpath_l3, folder_gcnet, outpath_sites=None,
+                  variables=None, metadata=None, workers: Optional[int] = None,
+                  memory_budget: Optional[float] = None,
+                  summary_file=None, only_changed: bool = False,
+                  state_file=None) -> pd.DataFrame:
+    """
+    Process all stations of a folder of L0 configuration files from L0 to L3
+    and join the sites of the stations.
+
+    The station configurations are read once to build the station to site
+    dependency graph. Tasks are started in topological order on a process
+    pool: a site is joined when all its stations are done, and only if at
+    least one of them succeeded. A failing task is logged and reported in the
+    summary without stopping the run.
+
+    The hash of the input files of every successful task is stored in a state
+    file. With only_changed, only the tasks whose inputs changed since their
+    last successful run, or whose output is missing, are run together with
+    the tasks depending on them.
+
+    Parameters
+    ----------
+    config_folder : str or Path
+        Folder with the L0 configuration files, one per station
+    inpath : str or Path
+        Folder with the L0 data
+    station_config_folder : str or Path
+        Folder with the station configuration files
+    data_issues_path : str or Path
+        Path to the data issues repository
+    outpath_l2 : str or Path
+        Output folder of the L2 station data
+    outpath_l3 : str or Path
+        Output folder of the L3 station data
+    folder_gcnet : str or Path
+        Folder with the historical GC-Net data
+    outpath_sites : str or Path, optional
+        Output folder of the L3 site data. Sites are not joined if None.
+    variables : str, optional
+        Variables look-up table file path
+    metadata : str, optional
+        Metadata file path
+    workers : int, optional
+        Number of worker processes. The default is the number of CPUs.
+    memory_budget : float, optional
+        Maximum estimated memory in GB of the running tasks. A task that
+        exceeds the budget on its own is run alone. The default is no limit.
+    summary_file : str or Path, optional
+        Path of the .csv summary of the run
+    only_changed : bool
+        If True, only the tasks affected by changed inputs are run. The
+        default is False.
+    state_file : str or Path, optional
+        Path of the input hashes of the last successful run of each task.
+        The default is fleet_state.json in outpath_l3.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Summary with the kind, status, duration in seconds and error of
+        each task
+    """
+    if data_issues_path is None:
+        data_issues_path = Path("../PROMICE-AWS-data-issues")
+        if data_issues_path.exists():
+            logging.warning(f"data_issues_path is missing. Using default data issues path: {data_issues_path}")
+        else:
+            raise ValueError("data_issues_path is missing. Please provide a valid path to the data issues repository")
+    for folder in [outpath_l2, outpath_l3, outpath_sites]:
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+    if state_file is None:
+        state_file = Path(outpath_l3) / "fleet_state.json"
+
+    station_configs = load_station_configs(station_config_folder)
+    tasks = build_fleet_tasks(config_folder, inpath, station_config_folder,
+                              data_issues_path, folder_gcnet,
+                              join_sites=outpath_sites is not None,
+                              station_configs=station_configs)
+    graph = build_fleet_graph(tasks, station_configs)
+    hashes = get_task_hashes(tasks, [
+        pypromice.resources.DEFAULT_VARIABLES_PATH if variables is None else variables,
+        pypromice.resources.DEFAULT_METADATA_PATH if metadata is None else metadata,
+    ])
+    state = _load_state(state_file)
+    if only_changed:
+        changed = {key for key, task in tasks.items()
+                   if state.get(key) != hashes[key]
+                   or not _output_file(task, outpath_l3, outpath_sites).exists()}
+        to_run = get_affected_tasks(graph, changed)
+    else:
+        to_run = set(tasks)
+    logger.info(f"Processing {len(to_run)} of {len(tasks)} tasks")
+
+    budget = None if memory_budget is None else memory_budget * 1e9
+    vars_df = pypromice.resources.load_variables(variables)
+    meta_dict = pypromice.resources.load_metadata(metadata)
+
+    results = {key: dict(name=task.name, kind=task.kind, status="unchanged",
+                         duration=0.0, error="")
+               for key, task in tasks.items() if key not in to_run}
+    pending = [key for key in graph.topological_sort() if key in to_run]
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(vars_df, meta_dict)) as executor:
+        while pending or running:
+            for key in list(pending):
+                task = tasks[key]
+                parents = [node.name for node in graph.nodes[key].parents
+                           if node.name in to_run]
+                if any(parent not in results for parent in parents):
+                    continue
+                if parents and all(results[p]["status"] == "failed" for p in parents):
+                    logger.error(f"Skipping {task.kind} {task.name}: none of its stations succeeded")
+                    results[key] = dict(name=task.name, kind=task.kind,
+                                        status="skipped", duration=0.0, error="")
+                    pending.remove(key)
+                    continue
+                used = sum(tasks[k].memory for k in running.values())
+                if budget is not None and running and used + task.memory > budget:
+                    continue
+                if task.kind == "station":
+                    future = executor.submit(
+                        _run_station, task.config_file, inpath,
+                        station_config_folder, data_issues_path, outpath_l2,
+                        outpath_l3, variables, metadata)
+                else:
+                    future = executor.submit(
+                        _run_site, task.name, station_config_folder, outpath_l3,
+                        folder_gcnet, outpath_sites, variables, metadata,
+                        station_configs)
+                running[future] = key
+                pending.remove(key)
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                task = tasks[key]
+                try:
+                    duration = future.result()
+                    results[key] = dict(name=task.name, kind=task.kind,
+                                        status="success", duration=duration, error="")
+                    logger.info(f"Processed {task.kind} {task.name} in {duration:.1f} s")
+                    state[key] = hashes[key]
+                except Exception as e:
+                    logger.exception(f"Processing of {task.kind} {task.name} failed")
+                    results[key] = dict(name=task.name, kind=task.kind,
+                                        status="failed", duration=float("nan"),
+                                        error=repr(e))
+                    state.pop(key, None)
+                _save_state(state_file, state)
+
+    summary = pd.DataFrame([results[key] for key in tasks],
+                           columns=["name", "kind", "status", "duration", "error"])
+    counts = summary.status.value_counts()
+    logger.info("Fleet processing finished: "
+                + ", ".join(f"{n} {status}" for status, n in counts.items()))
+    if summary_file is not None:
+        summary.to_csv(summary_file, index=False)
+    return summary
+
+
+def main():
+    args = parse_arguments_fleet()
+
+    logging.basicConfig(
+        format="%(asctime)s; %(levelname)s; %(name)s; %(message)s",
+        level=logging.INFO,
+        stream=sys.stdout,
+    )
+
+    summary = process_fleet(
+        args.config_folder,
+        args.inpath,
+        args.station_config_folder,
+        args.data_issues_path,
+        args.outpath_l2,
+        args.outpath_l3,
+        args.folder_gcnet,
+        outpath_sites=args.outpath_sites,
+        variables=args.variables,
+        metadata=args.metadata,
+        workers=args.workers,
+        memory_budget=args.memory_budget,
+        summary_file=args.summary,
+        only_changed=args.only_changed,
+    )
+    if (summary.status == "failed").any():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,17 +7,21 @@ Created on Mon Jun 10 10:58:39 2024
 """
 import logging
 import numpy as np
+import pandas as pd
 import xarray as xr
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import MonthBegin, MonthEnd, Tick, YearBegin, YearEnd
 from pypromice.process.L1toL2 import calcDirWindSpeeds
+from pypromice.utilities.segments import segment_sum
 logger = logging.getLogger(__name__)
 
 def resample_dataset(ds_h, t):
-    '''Resample L2 AWS data, e.g. hourly to daily average. This uses pandas
-    DataFrame resampling at the moment as a work-around to the xarray Dataset
-    resampling. As stated, xarray resampling is a lengthy process that takes
-    ~2-3 minutes per operation: ds_d = ds_h.resample({'time':"1D"}).mean()
-    This has now been fixed, so needs implementing:
-    https://github.com/pydata/xarray/issues/4498#event-6610799698
+    '''Resample L2 AWS data, e.g. hourly to daily average. The group
+    boundaries are computed once, and the sums and counts of valid values
+    of all numeric variables are computed on a single 2-D array. The wind
+    direction is derived from the averaged directional wind speeds and the
+    relative humidity from the averaged vapour pressure and saturation
+    vapour pressure, which are reduced together with the other variables.
 
     Parameters
     ----------
@@ -32,88 +36,312 @@ def resample_dataset(ds_h, t):
     ds_d : xarray.Dataset
         L3 AWS dataset resampled to the frequency defined by t
     '''
-    # Convert dataset to DataFrame
-    df_d = ds_h.to_dataframe()
-    
-    # Identify non-numeric columns
-    non_numeric_cols = df_d.select_dtypes(exclude=['number']).columns
-    
-    # Log a warning and drop non-numeric columns
-    if len(non_numeric_cols) > 0:
-        for col in non_numeric_cols:
-            unique_values = df_d[col].unique()
-            logger.warning(f"Dropping column '{col}' because it is of type '{df_d[col].dtype}' and contains unique values: {unique_values}")
-
-        df_d = df_d.drop(columns=non_numeric_cols)
-    # Resample the DataFrame
-    df_d = df_d.resample(t).mean()
-
-    # taking the 10 min data and using it as instantaneous values:
-    is_10_minutes_timestamp = (ds_h.time.diff(dim='time') / np.timedelta64(1, 's') == 600)
-    if (t == '60min') and is_10_minutes_timestamp.any():
-        cols_to_update = ['p_i', 't_i', 'rh_i', 'rh_i_wrt_ice_or_water', 'wspd_i', 'wdir_i','wspd_x_i','wspd_y_i']
-        cols_origin = ['p_u', 't_u', 'rh_u', 'rh_u_wrt_ice_or_water', 'wspd_u', 'wdir_u','wspd_x_u','wspd_y_u']
-        timestamp_10min = ds_h.time.where(is_10_minutes_timestamp, drop=True).to_index()
-        timestamp_round_hour = df_d.index
-        timestamp_to_update = timestamp_round_hour.intersection(timestamp_10min)
+    if not ds_h.indexes['time'].is_monotonic_increasing:
+        ds_h = ds_h.sortby('time')
+    return ResampleAccumulator.from_dataset(ds_h, t).to_dataset(ds_h, t)
+
+
+def resample_products(ds_h, frequencies=('60min', '1D', 'M')):
+    '''Resample a dataset to several frequencies in one pass over the data.
+    The sums and counts of the finest frequency are computed from the data,
+    and each coarser frequency whose groups contain whole groups of a finer
+    one is rolled up from the sums and counts of the finer one, e.g. daily
+    from hourly and monthly from daily. The averages are the same as
+    resampling the data directly, up to floating point rounding.
+
+    Parameters
+    ----------
+    ds_h : xarray.Dataset
+        L3 AWS dataset either at 10 min (for raw data) or hourly (for tx data)
+    frequencies : list
+        Resample factors, same variable definition as in
+        pandas.DataFrame.resample()
+
+    Returns
+    -------
+    dict
+        Resampled dataset for each frequency
+    '''
+    if not ds_h.indexes['time'].is_monotonic_increasing:
+        ds_h = ds_h.sortby('time')
+    accumulators = {}
+    for t in frequencies:
+        finer = [f for f in accumulators if _is_nested(f, t)]
+        if finer:
+            accumulators[t] = accumulators[finer[-1]].rollup(t)
+        else:
+            accumulators[t] = ResampleAccumulator.from_dataset(ds_h, t)
+    return {t: acc.to_dataset(ds_h, t) for t, acc in accumulators.items()}
+
+
+def _is_nested(fine, coarse):
+    '''True if each resampling group of frequency fine is included in a
+    group of frequency coarse'''
+    fine, coarse = to_offset(fine), to_offset(coarse)
+    one_day = pd.Timedelta('1D').value
+    if isinstance(fine, Tick) and isinstance(coarse, Tick):
+        return coarse.nanos > fine.nanos and coarse.nanos % fine.nanos == 0
+    if isinstance(fine, Tick):
+        # calendar frequencies start at midnight
+        return one_day % fine.nanos == 0 and coarse.n == 1 and isinstance(
+            coarse, (MonthEnd, MonthBegin, YearEnd, YearBegin))
+    if isinstance(fine, (MonthEnd, MonthBegin)) and fine.n == 1:
+        return coarse.n == 1 and isinstance(coarse, (YearEnd, YearBegin))
+    return False
+
+
+class ResampleAccumulator:
+    '''Sums and counts of the valid values of the numeric variables of a
+    dataset over resampling groups. The auxiliary variables are the
+    directional wind speeds and vapour pressures used to derive the wind
+    direction and relative humidity of the resampled dataset.
+
+    Parameters
+    ----------
+    index : pandas.DatetimeIndex
+        Timestamp of each group
+    sums : numpy.ndarray
+        Sums with one row per variable and one column per group
+    counts : numpy.ndarray
+        Counts of valid values, same shape as sums
+    columns : list
+        Names of the variables
+    aux_columns : list
+        Names of the auxiliary variables, after the variables in the rows
+        of sums and counts
+    '''
+    def __init__(self, index, sums, counts, columns, aux_columns=()):
+        self.index = pd.DatetimeIndex(index, name='time')
+        self.sums = sums
+        self.counts = counts
+        self.columns = list(columns)
+        self.aux_columns = list(aux_columns)
+
+    @classmethod
+    def from_dataset(cls, ds_h, t):
+        '''Accumulate the values of a dataset sorted by time'''
+        columns = _numeric_variables(ds_h)
+        aux = _auxiliary_variables(ds_h, columns)
+
+        # one row per variable, so that each time series is contiguous
+        values = np.empty((len(columns) + len(aux), ds_h.sizes['time']))
+        for i, var in enumerate(columns):
+            values[i] = ds_h[var].values
+        for i, arr in enumerate(aux.values()):
+            values[len(columns) + i] = arr
+
+        index, sizes = get_resample_groups(ds_h.time.values, t)
+        sums, counts = group_sums(values, sizes)
+        return cls(index, sums, counts, columns, aux.keys())
+
+    def rollup(self, t):
+        '''Accumulator of a coarser frequency, whose groups contain whole
+        groups of this accumulator'''
+        index, sizes = get_resample_groups(self.index.values, t)
+        starts = np.cumsum(sizes) - sizes
+        return ResampleAccumulator(
+            index,
+            segment_sum(self.sums, starts, axis=-1),
+            segment_sum(self.counts, starts, axis=-1),
+            self.columns,
+            self.aux_columns,
+        )
+
+    def update(self, other):
+        '''Accumulator where the groups from the first group of other
+        onwards are replaced by the groups of other, e.g. to add the data
+        received since the accumulator was computed'''
+        if self.columns != other.columns or self.aux_columns != other.aux_columns:
+            raise ValueError("Cannot update an accumulator with different variables")
+        keep = self.index < other.index[0] if len(other.index) else np.ones(len(self.index), bool)
+        return ResampleAccumulator(
+            self.index[keep].append(other.index),
+            np.concatenate([self.sums[:, keep], other.sums], axis=1),
+            np.concatenate([self.counts[:, keep], other.counts], axis=1),
+            self.columns,
+            self.aux_columns,
+        )
+
+    def means(self):
+        '''Average of each variable and group, NaN for groups without
+        valid values'''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.sums / self.counts
+        means[self.counts == 0] = np.nan
+        return means
+
+    def to_netcdf(self, path):
+        '''Write the sums and counts to a NetCDF file'''
+        names = self.columns + self.aux_columns
+        xr.Dataset(
+            {'sum': (('variable', 'time'), self.sums),
+             'count': (('variable', 'time'), self.counts)},
+            coords={'variable': names,
+                    'auxiliary': ('variable', np.isin(names, self.aux_columns).astype('int8')),
+                    'time': self.index.values},
+        ).to_netcdf(path)
+
+    @classmethod
+    def open(cls, path):
+        '''Read sums and counts written with to_netcdf'''
+        with xr.open_dataset(path) as ds:
+            ds.load()
+        names = [str(v) for v in ds['variable'].values]
+        auxiliary = ds['auxiliary'].values.astype(bool)
+        return cls(ds.time.values, ds['sum'].values, ds['count'].values,
+                   [v for v, a in zip(names, auxiliary) if not a],
+                   [v for v, a in zip(names, auxiliary) if a])
+
+    def to_dataset(self, ds_h, t):
+        '''Resampled dataset
+
+        Parameters
+        ----------
+        ds_h : xarray.Dataset
+            Dataset that was accumulated, giving the attributes and the
+            instantaneous values of hourly datasets from 10 min data
+        t : str
+            Resample factor of the accumulator
+        '''
+        columns = self.columns
+        means = self.means()
+        df_d = pd.DataFrame(means[:len(columns)].T, index=self.index, columns=columns)
+        aux_d = dict(zip(self.aux_columns, means[len(columns):]))
+
+        # taking the 10 min data and using it as instantaneous values:
+        is_10_minutes_timestamp = (ds_h.time.diff(dim='time') / np.timedelta64(1, 's') == 600)
+        if (t == '60min') and is_10_minutes_timestamp.any():
+            cols_to_update = ['p_i', 't_i', 'rh_i', 'rh_i_wrt_ice_or_water', 'wspd_i', 'wdir_i','wspd_x_i','wspd_y_i']
+            cols_origin = ['p_u', 't_u', 'rh_u', 'rh_u_wrt_ice_or_water', 'wspd_u', 'wdir_u','wspd_x_u','wspd_y_u']
+            timestamp_10min = ds_h.time.where(is_10_minutes_timestamp, drop=True).to_index()
+            timestamp_round_hour = df_d.index
+            timestamp_to_update = timestamp_round_hour.intersection(timestamp_10min)
         
-        for col, col_org in zip(cols_to_update, cols_origin):
-            if col not in df_d.columns:
-                df_d[col] = np.nan
-            else:
-                # if there are already instantaneous values in the dataset
-                # we want to keep them as they are
-                # removing timestamps where there is already t_i filled from a TX file
-                missing_instantaneous = ds_h.reindex(time=timestamp_to_update)[col].isnull()
-                timestamp_to_update = timestamp_to_update[missing_instantaneous]
-            df_d.loc[timestamp_to_update, col] = ds_h.reindex(
-                time= timestamp_to_update
-                )[col_org].values
-            if col == 'p_i':
-                df_d.loc[timestamp_to_update, col] = df_d.loc[timestamp_to_update, col].values-1000
+            for col, col_org in zip(cols_to_update, cols_origin):
+                if col not in df_d.columns:
+                    df_d[col] = np.nan
+                else:
+                    # if there are already instantaneous values in the dataset
+                    # we want to keep them as they are
+                    # removing timestamps where there is already t_i filled from a TX file
+                    missing_instantaneous = ds_h[col].reindex(time=timestamp_to_update).isnull()
+                    timestamp_to_update = timestamp_to_update[missing_instantaneous.values]
+                df_d.loc[timestamp_to_update, col] = ds_h[col_org].reindex(
+                    time= timestamp_to_update
+                    ).values
+                if col == 'p_i':
+                    df_d.loc[timestamp_to_update, col] = df_d.loc[timestamp_to_update, col].values-1000
             
 
-    # recalculating wind direction from averaged directional wind speeds
-    for var in ['wdir_u','wdir_l']:
-        boom = var.split('_')[1]
-        if var in df_d.columns:
-            if ('wspd_x_'+boom in df_d.columns) & ('wspd_y_'+boom in df_d.columns):
-                df_d[var] = _calcWindDir(df_d['wspd_x_'+boom], df_d['wspd_y_'+boom])
-            else:
-                logger.info(var+' in dataframe but not wspd_x_'+boom+' nor wspd_y_'+boom+', recalculating them')
-                ds_h['wspd_x_'+boom], ds_h['wspd_y_'+boom] = calcDirWindSpeeds(ds_h['wspd_'+boom], ds_h['wdir_'+boom])
-                df_d[['wspd_x_'+boom, 'wspd_y_'+boom]] = ds_h[['wspd_x_'+boom, 'wspd_y_'+boom]].to_dataframe().resample(t).mean()
+        # recalculating wind direction from averaged directional wind speeds
+        for var in ['wdir_u','wdir_l']:
+            boom = var.split('_')[1]
+            if var in df_d.columns:
+                for xy in ['wspd_x_'+boom, 'wspd_y_'+boom]:
+                    if xy not in df_d.columns:
+                        df_d[xy] = aux_d[xy]
                 df_d[var] = _calcWindDir(df_d['wspd_x_'+boom], df_d['wspd_y_'+boom])
     
-    # recalculating relative humidity from average vapour pressure and average
-    # saturation vapor pressure
-    for var in ['rh_u','rh_l']:
-        lvl = var.split('_')[1]
-        if var in df_d.columns:
-            if ('t_'+lvl in ds_h.keys()):
-                es_wtr, es_cor = calculateSaturationVaporPressure(ds_h['t_'+lvl])
-                p_vap = ds_h[var] / 100 * es_wtr
-                
-                df_d[var] = (p_vap.to_series().resample(t).mean() \
-                           / es_wtr.to_series().resample(t).mean())*100
+        # recalculating relative humidity from average vapour pressure and average
+        # saturation vapor pressure
+        for var in ['rh_u','rh_l']:
+            if 'p_vap_'+var in aux_d:
+                df_d[var] = aux_d['p_vap_'+var] / aux_d['es_wtr_'+var] * 100
                 if var+'_wrt_ice_or_water' in df_d.keys():
-                    df_d[var+'_wrt_ice_or_water'] = (p_vap.to_series().resample(t).mean() \
-                               / es_cor.to_series().resample(t).mean())*100
+                    df_d[var+'_wrt_ice_or_water'] = aux_d['p_vap_'+var] / aux_d['es_cor_'+var] * 100
     
-    # passing each variable attribute to the ressample dataset
-    vals = []
-    for c in df_d.columns:
-        if c in ds_h.data_vars:
-            vals.append(xr.DataArray(
-                data=df_d[c], dims=['time'],
-               coords={'time':df_d.index}, attrs=ds_h[c].attrs))
+        # passing each variable attribute to the ressample dataset
+        ds_d = xr.Dataset(
+            {c: ('time', df_d[c].values, ds_h[c].attrs if c in ds_h.data_vars else None)
+             for c in df_d.columns},
+            coords={'time': df_d.index.values},
+            attrs=ds_h.attrs)
+        return ds_d
+
+
+def get_resample_groups(time, t):
+    '''Resampling groups of sorted timestamps
+
+    Parameters
+    ----------
+    time : numpy.ndarray
+        Sorted timestamps
+    t : str
+        Resample factor, same variable definition as in
+        pandas.DataFrame.resample()
+
+    Returns
+    -------
+    index : pandas.DatetimeIndex
+        Timestamp of each group, as given by pandas resampling
+    sizes : numpy.ndarray
+        Number of timestamps in each group
+    '''
+    sizes = pd.Series(np.zeros(len(time)), index=pd.DatetimeIndex(time)).resample(t).size()
+    sizes.index.name = 'time'
+    return sizes.index, sizes.values
+
+
+def group_sums(values, sizes):
+    '''Sums and counts of the valid values of consecutive groups of
+    timestamps
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Array with the timestamps along the last axis, NaN values being
+        ignored
+    sizes : numpy.ndarray
+        Number of timestamps of each group
+
+    Returns
+    -------
+    sums : numpy.ndarray
+        Sum of the valid values of each group
+    counts : numpy.ndarray
+        Number of valid values of each group
+    '''
+    starts = np.cumsum(sizes) - sizes
+    valid = ~np.isnan(values)
+    sums = segment_sum(np.where(valid, values, 0), starts, axis=-1)
+    counts = segment_sum(valid, starts, axis=-1, dtype=np.int64)
+    return sums, counts
+
+
+def _numeric_variables(ds):
+    '''Names of the time series of ds that can be averaged'''
+    columns = []
+    for var in ds.data_vars:
+        if ds[var].dims != ('time',):
+            logger.warning(f"Dropping variable '{var}' because it has dimensions {ds[var].dims}")
+        elif np.issubdtype(ds[var].dtype, np.number):
+            columns.append(var)
         else:
-            vals.append(xr.DataArray(
-                data=df_d[c], dims=['time'],
-               coords={'time':df_d.index}, attrs=None))
-            
-    ds_d = xr.Dataset(dict(zip(df_d.columns,vals)), attrs=ds_h.attrs)
-    return ds_d
+            unique_values = pd.unique(ds[var].values)
+            logger.warning(f"Dropping column '{var}' because it is of type '{ds[var].dtype}' and contains unique values: {unique_values}")
+    return columns
+
+
+def _auxiliary_variables(ds, columns):
+    '''Time series averaged along with the variables to derive the wind
+    direction and the relative humidity'''
+    aux = {}
+    for var in ['wdir_u','wdir_l']:
+        boom = var.split('_')[1]
+        if var in columns and not ('wspd_x_'+boom in columns and 'wspd_y_'+boom in columns):
+            logger.info(var+' in dataframe but not wspd_x_'+boom+' nor wspd_y_'+boom+', recalculating them')
+            wspd_x, wspd_y = calcDirWindSpeeds(ds['wspd_'+boom], ds['wdir_'+boom])
+            aux['wspd_x_'+boom] = np.asarray(wspd_x)
+            aux['wspd_y_'+boom] = np.asarray(wspd_y)
+
+    for var in ['rh_u','rh_l']:
+        lvl = var.split('_')[1]
+        if var in columns and 't_'+lvl in ds.keys():
+            es_wtr, es_cor = calculateSaturationVaporPressure(ds['t_'+lvl])
+            aux['p_vap_'+var] = (ds[var] / 100 * es_wtr).values
+            aux['es_wtr_'+var] = es_wtr.values
+            aux['es_cor_'+var] = es_cor.values
+    return aux
 
 
 def calculateSaturationVaporPressure(t, T_0=273.15, T_100=373.15, es_0=6.1071,
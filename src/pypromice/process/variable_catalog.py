@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Compiled form of the variables look-up table used on the write path
+
+The variables look-up table is filtered and converted the same way for every
+product that is written: the variables of each processing level and station
+type, the number of decimals of each variable and their attributes. The
+VariableCatalog computes these once, so that all the variables of a dataset
+can be rounded and annotated in one operation.
+"""
+from typing import Dict, List, Optional, Tuple, Union
+
+import attrs
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+__all__ = [
+    "VariableCatalog",
+    "round_variables",
+]
+
+ATTRIBUTE_COLUMNS = [
+    "standard_name",
+    "long_name",
+    "units",
+    "coverage_content_type",
+    "coordinates",
+]
+
+STATION_TYPES = {1: ["one-boom", "all"], 2: ["two-boom", "all"]}
+
+# Levels for which the variables depend on the number of booms
+BOOM_LEVELS = ["L0", "L1", "L2"]
+
+
+@attrs.define(frozen=True)
+class VariableCatalog:
+    """
+    Variables look-up table with precomputed column lists, decimals and
+    attributes.
+
+    Attributes
+    ----------
+    table : pandas.DataFrame
+        Variables look-up table, as returned by
+        pypromice.resources.load_variables
+    columns : dict
+        Variables of each (level, number of booms) in the order of the
+        table. The number of booms is None for the levels above L2.
+    decimals : dict
+        Number of decimals of the variables with a max_decimals value
+    limits : dict
+        Valid range (lo, hi) of each variable, with nan for missing limits
+    attributes : dict
+        Attributes of each variable
+    """
+
+    table: pd.DataFrame
+    columns: Dict[Tuple[str, Optional[int]], List[str]]
+    decimals: Dict[str, int]
+    limits: Dict[str, Tuple[float, float]]
+    attributes: Dict[str, Dict]
+
+    @classmethod
+    def from_dataframe(cls, table: pd.DataFrame) -> "VariableCatalog":
+        levels = [c for c in table.columns if c.startswith("L") and c[1:].isdigit()]
+        columns = {}
+        for level in levels:
+            at_level = table.loc[table[level] == 1]
+            columns[level, None] = list(at_level.index)
+            if level in BOOM_LEVELS:
+                for booms, station_types in STATION_TYPES.items():
+                    selected = at_level["station_type"].isin(station_types)
+                    columns[level, booms] = list(at_level.index[selected])
+
+        decimals = {}
+        if "max_decimals" in table.columns:
+            decimals = table["max_decimals"].dropna().astype(int).to_dict()
+        limits = {}
+        if "lo" in table.columns and "hi" in table.columns:
+            limits = {
+                var: (lo, hi) for var, lo, hi in zip(table.index, table["lo"], table["hi"])
+            }
+        attributes = {}
+        if set(ATTRIBUTE_COLUMNS) <= set(table.columns):
+            attributes = table[ATTRIBUTE_COLUMNS].to_dict("index")
+        return cls(table, columns, decimals, limits, attributes)
+
+    @classmethod
+    def of(cls, variables: Union[pd.DataFrame, "VariableCatalog"]) -> "VariableCatalog":
+        """
+        Catalog of a variables look-up table, or the catalog itself.
+        """
+        if isinstance(variables, cls):
+            return variables
+        return cls.from_dataframe(variables)
+
+    def column_names(self, level: str, number_of_booms: Optional[int] = None) -> List[str]:
+        """
+        Variables of a processing level, and of a number of booms for the
+        levels up to L2.
+        """
+        if level not in BOOM_LEVELS or number_of_booms not in STATION_TYPES:
+            number_of_booms = None
+        return list(self.columns[level, number_of_booms])
+
+    def round(self, ds: xr.Dataset) -> xr.Dataset:
+        """
+        Dataset with the variables rounded to their number of decimals.
+        """
+        return round_variables(ds, self.decimals)
+
+    def add_attributes(self, ds: xr.Dataset) -> xr.Dataset:
+        """
+        Add the attributes of the data variables of a dataset, in place.
+        """
+        for var in ds.data_vars:
+            if var in self.attributes:
+                ds[var].attrs.update(self.attributes[var])
+        return ds
+
+
+def round_variables(ds: xr.Dataset, decimals: Dict[str, int]) -> xr.Dataset:
+    """
+    Round variables of a dataset to a number of decimals. The float variables
+    along time are rounded together, as np.round does, on a single 2-D
+    array. The input dataset is not modified.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dataset to round
+    decimals : dict
+        Number of decimals of each variable to round
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with rounded variables
+    """
+    names = [
+        var for var in decimals
+        if var in ds.variables and ds[var].dtype.kind == "f"
+    ]
+    batched = [var for var in names if ds[var].dims == ("time",)]
+    rounded = {}
+    if batched:
+        values = np.stack([ds[var].values for var in batched])
+        factors = 10.0 ** np.array([decimals[var] for var in batched], dtype=float)
+        values = np.rint(values * factors[:, None]) / factors[:, None]
+        for var, row in zip(batched, values):
+            rounded[var] = ds[var].variable.copy(deep=False, data=row)
+    for var in names:
+        if var not in rounded:
+            rounded[var] = ds[var].variable.round(decimals[var])
+    return ds.assign(rounded)
@@ -4,17 +4,34 @@
 Module containing all the functions needed to prepare and AWS data
 """
 import datetime
+import gzip
+import importlib.util
 import logging
 import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import netCDF4
 import numpy as np
 import pandas as pd
-from pypromice.process.resample import resample_dataset
+import xarray as xr
+from pypromice.process.encoding import chunk_length, plan_encoding
+from pypromice.process.resample import resample_products
+from pypromice.process.variable_catalog import VariableCatalog, round_variables
 import pypromice.resources
 
 logger = logging.getLogger(__name__)
 
+# The netCDF4 library is not thread-safe, concurrent writes are serialised
+_netcdf_lock = threading.Lock()
+
+# Instantaneous values are not written to the daily and monthly products
+INSTANTANEOUS_VARIABLES = frozenset(
+    ["p_i", "t_i", "rh_i", "wspd_i", "wdir_i", "wspd_x_i", "wspd_y_i"]
+)
+
 
 def prepare_and_write(
     dataset,
@@ -23,7 +40,8 @@ def prepare_and_write(
         meta_dict=None,
         time="60min",
         resample=True,
-        nc_compression:bool=False,
+        nc_compression:bool=True,
+        zarr: bool = False,
 ):
     """Prepare data with resampling, formating and metadata population; then
     write data to .nc and .csv hourly and daily files
@@ -40,61 +58,151 @@ def prepare_and_write(
         Metadata dictionary to write to dataset
     time : str
         Resampling interval for output dataset
+    zarr : bool
+        If True, the data is also written to a .zarr store. The default is
+        False.
     """
-    # Resample dataset
-    if isinstance(output_path, str):
-        output_path = Path(output_path)
-
-    if resample:
-        d2 = resample_dataset(dataset, time)
-        logger.info("Resampling to " + str(time))
-        if len(d2.time) == 1:
-            logger.warning(
-                "Output of resample has length 1. Not enough data to calculate daily/monthly average."
-            )
-            return None
-    else:
-        d2 = dataset.copy()
-
-    # Reformat time
-    d2 = reformat_time(d2)
+    write_products(dataset, output_path, [time], vars_df, meta_dict,
+                   resample=resample, nc_compression=nc_compression, zarr=zarr)
 
-    # finding station/site name
-    if "station_id" in d2.attrs.keys():
-        name = d2.attrs["station_id"]
-    else:
-        name = d2.attrs["site_id"]
 
-    # Reformat longitude (to negative values)
-    if "gps_lon" in d2.keys():
-        d2 = reformat_lon(d2)
-    else:
-        logger.info("%s does not have gps_lon" % name)
+def write_products(
+        dataset,
+        output_path: Path | str,
+        frequencies=("60min", "1D", "M"),
+        vars_df=None,
+        meta_dict=None,
+        products=None,
+        resample: bool = True,
+        nc_compression: bool = True,
+        csv_compression: str | None = None,
+        max_workers: int = 1,
+        update: bool = False,
+        zarr: bool = False,
+        parquet: bool = False,
+):
+    """Resample a dataset to several frequencies, format it, populate its
+    metadata and write each product to .nc and .csv files. The variable
+    attributes, the list of variables to write and the coordinates and
+    geospatial bounds are computed once, the latter from the finest product,
+    and shared by all products.
 
-    # Add variable attributes and metadata
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        Dataset to write to file
+    output_path : Path|str
+        Output directory
+    frequencies : list
+        Resampling intervals of the output datasets
+    vars_df : pandas.DataFrame
+        Variables look-up table dataframe
+    meta_dict : dictionary
+        Metadata dictionary to write to dataset
+    products : dict, optional
+        Already resampled dataset for each frequency. If None, the dataset is
+        resampled with resample_products.
+    resample : bool
+        If False, the dataset is written as it is for each frequency, and
+        products is ignored. The default is True.
+    nc_compression : bool
+        If True, the NetCDF files are compressed. The default is True.
+    csv_compression : str, optional
+        Compression of the .csv files, "gzip" or "zstd". The default is None.
+    max_workers : int
+        Number of products written concurrently. Only the .csv files are
+        written in parallel. The default is 1.
+    update : bool
+        If True, existing files are updated from the first changed time step
+        with updateNC and updateCSV instead of being rewritten. The default
+        is False.
+    zarr : bool
+        If True, each product is also written to a .zarr store with
+        writeZarr. The default is False.
+    parquet : bool
+        If True, each product is also written with writeParquet to a Parquet
+        dataset shared by all stations, in output_path/parquet/<time step>.
+        The default is False.
+    """
+    if isinstance(output_path, str):
+        output_path = Path(output_path)
     if vars_df is None:
         vars_df = pypromice.resources.load_variables()
     if meta_dict is None:
         meta_dict = pypromice.resources.load_metadata()
+    # compiled once and used by all the functions of the write path
+    vars_df = VariableCatalog.of(vars_df)
+
+    if not resample:
+        products = {time: dataset for time in frequencies}
+    elif products is None:
+        logger.info("Resampling to " + ", ".join(frequencies))
+        products = resample_products(dataset, frequencies)
+
+    col_names = None
+    coordinate_attrs = None
+    to_write = []
+    for time in frequencies:
+        d2 = products[time].copy()
+        if resample and len(d2.time) == 1:
+            logger.warning(
+                "Output of resample has length 1. Not enough data to calculate daily/monthly average."
+            )
+            continue
 
-    d2 = addVars(d2, vars_df)
-    d2 = addMeta(d2, meta_dict)
-
-    # Round all values to specified decimals places
-    d2 = roundValues(d2, vars_df)
-
-    # Get variable names to write out
-    if "site_id" in d2.attrs.keys():
-        remove_nan_fields = True
+        # Reformat time
+        d2 = reformat_time(d2)
+
+        # finding station/site name
+        if "station_id" in d2.attrs.keys():
+            name = d2.attrs["station_id"]
+        else:
+            name = d2.attrs["site_id"]
+
+        # Reformat longitude (to negative values)
+        if "gps_lon" in d2.keys():
+            d2 = reformat_lon(d2)
+        else:
+            logger.info("%s does not have gps_lon" % name)
+
+        # Add variable attributes and metadata
+        vars_df.add_attributes(d2)
+        if coordinate_attrs is None:
+            coordinate_attrs = _coordinateAttributes(d2)
+        d2 = addMeta(d2, meta_dict, coordinate_attrs=coordinate_attrs)
+
+        # Get variable names to write out
+        if "site_id" in d2.attrs.keys():
+            names = getColNames(vars_df, d2, remove_nan_fields=True)
+        else:
+            if col_names is None:
+                col_names = getColNames(vars_df, d2)
+            names = list(col_names)
+        to_write.append((d2, output_path / name, name, names, time))
+
+    def write(args):
+        _writeProduct(*args, vars_df=vars_df, nc_compression=nc_compression,
+                      csv_compression=csv_compression, update=update, zarr=zarr,
+                      parquet=parquet)
+
+    if max_workers > 1 and len(to_write) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(write, to_write))
     else:
-        remove_nan_fields = False
-    col_names = getColNames(vars_df, d2, remove_nan_fields=remove_nan_fields)
+        for args in to_write:
+            write(args)
+
 
+def _writeProduct(d2, output_dir, name, col_names, time=None, vars_df=None,
+                  nc_compression=True, csv_compression=None, update=False,
+                  zarr=False, parquet=False):
+    """Write a formatted dataset to .csv and .nc files, and optionally a
+    .zarr store and a Parquet dataset, named after its time step. The time
+    step of a dataset with a single time step is given by its frequency."""
     # Define filename based on resample rate
-    t = int(pd.Timedelta((d2["time"][1] - d2["time"][0]).values).total_seconds())
+    t = _timeStep(d2, time)
 
     # Create out directory
-    output_dir = output_path / name
     output_dir.mkdir(exist_ok=True, parents=True)
 
     if t == 600:
@@ -105,31 +213,67 @@ def prepare_and_write(
         out_nc = output_dir / f"{name}_hour.nc"
     elif t == 86400:
         # removing instantaneous values from daily and monthly files
-        for v in col_names:
-            if v in ['p_i', 't_i', 'rh_i', 'wspd_i', 'wdir_i', 'wspd_x_i', 'wspd_y_i']:
-                col_names.remove(v)
+        col_names = [v for v in col_names if v not in INSTANTANEOUS_VARIABLES]
         out_csv = output_dir / f"{name}_day.csv"
         out_nc = output_dir / f"{name}_day.nc"
     else:
         # removing instantaneous values from daily and monthly files
-        for v in col_names:
-            if v in ['p_i', 't_i', 'rh_i', 'wspd_i', 'wdir_i', 'wspd_x_i', 'wspd_y_i']:
-                col_names.remove(v)
+        col_names = [v for v in col_names if v not in INSTANTANEOUS_VARIABLES]
         out_csv = output_dir / f"{name}_month.csv"
         out_nc = output_dir / f"{name}_month.nc"
 
-    # Write to csv file
+    if csv_compression is not None:
+        out_csv = out_csv.with_name(out_csv.name + _CSV_SUFFIXES[csv_compression])
+
     logger.info("Writing to files...")
-    writeCSV(out_csv, d2, col_names)
+    if update:
+        # The csv file is updated from the first time step changed in the
+        # netcdf file, and checked against the data if none changed
+        with _netcdf_lock:
+            since = updateNC(out_nc, d2, col_names, compression=nc_compression,
+                             vars_df=vars_df)
+        updateCSV(out_csv, d2, col_names, since, vars_df=vars_df,
+                  compression=csv_compression)
+    else:
+        # Write to csv file
+        writeCSV(out_csv, d2, col_names, vars_df=vars_df, compression=csv_compression)
 
-    # Write to netcdf file
-    writeNC(out_nc, d2, col_names, compression=nc_compression)
+        # Write to netcdf file
+        with _netcdf_lock:
+            writeNC(out_nc, d2, col_names, compression=nc_compression, vars_df=vars_df)
     logger.info(f"Written to {out_csv}")
     logger.info(f"Written to {out_nc}")
 
+    if zarr:
+        out_zarr = out_nc.with_suffix(".zarr")
+        writeZarr(out_zarr, d2, col_names, vars_df=vars_df)
+        logger.info(f"Written to {out_zarr}")
+
+    if parquet:
+        step = out_nc.stem[len(name) + 1:]
+        out_parquet = output_dir.parent / "parquet" / step
+        writeParquet(out_parquet, d2, col_names, vars_df=vars_df, station_id=name)
+        logger.info(f"Written to {out_parquet}")
 
-def writeCSV(outfile, Lx, csv_order):
-    """Write data product to CSV file
+
+def _timeStep(d2, time=None):
+    """Time step in seconds, from the first two time steps or else from the
+    frequency. None for monthly frequencies."""
+    if len(d2["time"]) > 1:
+        return int(pd.Timedelta((d2["time"][1] - d2["time"][0]).values).total_seconds())
+    try:
+        return int(pd.Timedelta(pd.tseries.frequencies.to_offset(time)).total_seconds())
+    except ValueError:
+        return None
+
+
+def writeCSV(outfile, Lx, csv_order, vars_df=None, compression="infer",
+             chunk_size=10000):
+    """Write data product to CSV file. The values of each variable are
+    rounded to the number of decimals given in the variables look-up table
+    and formatted in the same step, and the rows are written in chunks.
+    Rows where all variables are missing are not written. The file is
+    written next to outfile and then moved in place.
 
     Parameters
     ----------
@@ -139,16 +283,284 @@ def writeCSV(outfile, Lx, csv_order):
         Dataset to write to file
     csv_order : list
         List order of variables
+    vars_df : pandas.DataFrame, optional
+        Variables look-up table with the max_decimals column. If None, the
+        values are not rounded.
+    compression : str, optional
+        "gzip", "zstd" or None. The default, "infer", compresses the file if
+        its name ends with .gz or .zst
+    chunk_size : int
+        Number of rows formatted and written at once. The default is 10000.
     """
-    Lcsv = Lx.to_dataframe().dropna(how="all")
-    if csv_order is not None:
-        names = [c for c in csv_order if c in list(Lcsv.columns)]
-        Lcsv = Lcsv[names]
-    Lcsv.to_csv(outfile)
+    outfile = Path(outfile)
+    if compression == "infer":
+        compression = _inferCompression(outfile)
+    names = _csvColumns(Lx, csv_order)
+
+    tmp = _tmpPath(outfile)
+    with _openCSV(tmp, compression) as f:
+        f.write(",".join(["time"] + names) + "\n")
+        _writeCSVRows(f, Lx, names, vars_df, chunk_size=chunk_size)
+    os.replace(tmp, outfile)
+
+
+def updateCSV(outfile, Lx, csv_order, since=None, vars_df=None,
+              compression="infer", chunk_size=10000):
+    """Update a CSV file written by writeCSV with the rows of Lx from a
+    given time. The rows of the file before that time are kept as they are.
+    The file is fully written if it does not exist, has other columns, or
+    if its last row before that time differs from Lx, for instance when the
+    file was truncated. Compressed files are fully written. The update is
+    done on a copy of the file, which is then moved in place, so that
+    readers never see a partially written file.
 
+    Parameters
+    ----------
+    outfile : str
+        Output file path
+    Lx : xr.Dataset
+        Dataset to write to file
+    csv_order : list
+        List order of variables
+    since : datetime-like, optional
+        Time of the first row to write. If None, Lx is unchanged since the
+        last update and the file is only written if it does not match Lx.
+    vars_df : pandas.DataFrame, optional
+        Variables look-up table with the max_decimals column
+    compression : str, optional
+        "gzip", "zstd" or None. The default, "infer", compresses the file if
+        its name ends with .gz or .zst
+    chunk_size : int
+        Number of rows formatted and written at once. The default is 10000.
+    """
+    outfile = Path(outfile)
+    if compression == "infer":
+        compression = _inferCompression(outfile)
+    names = _csvColumns(Lx, csv_order)
+    header = ",".join(["time"] + names)
+
+    offset = None
+    if outfile.is_file():
+        if compression is not None:
+            if since is None and _csvLastRows(outfile, compression) == (
+                    header, _csvLastRow(Lx, names, vars_df)):
+                return
+        else:
+            offset = _csvOffset(outfile, Lx, names, header, since, vars_df)
+    if offset is None:
+        writeCSV(outfile, Lx, csv_order, vars_df, compression=compression,
+                 chunk_size=chunk_size)
+        return
+    if since is None:
+        return
+
+    tmp = _tmpPath(outfile)
+    shutil.copyfile(outfile, tmp)
+    with open(tmp, "r+b") as f:
+        f.truncate(offset)
+    with open(tmp, "a") as f:
+        _writeCSVRows(f, Lx, names, vars_df, since=since, chunk_size=chunk_size)
+    os.replace(tmp, outfile)
+
+
+def _csvOffset(outfile, Lx, names, header, since, vars_df):
+    """Position in an uncompressed CSV file of the first row from time
+    since, or None if the file does not match Lx before that time"""
+    with open(outfile, "rb") as f:
+        if f.readline().decode().rstrip("\r\n") != header:
+            return None
+        if since is None:
+            # only the last row is compared
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - 4096, 0))
+            lines = f.read().split(b"\n")
+            last = lines[-2].decode() if len(lines) > 1 and lines[-1] == b"" else None
+            position = size
+        else:
+            since_str = pd.Timestamp(since).strftime(_csvTimeFormat(Lx))
+            last = None
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    # end of the file, or truncated last row
+                    if line:
+                        return None
+                    break
+                if line.split(b",", 1)[0].decode() >= since_str:
+                    return position
+                last = line.decode().rstrip("\r\n")
+    if position == len(header) + 1:
+        # no rows
+        last = None
+    if last != _csvLastRow(Lx, names, vars_df, before=since):
+        return None
+    return position
+
+
+def _csvLastRows(outfile, compression):
+    """Header and last row of a compressed CSV file, None if it cannot be
+    read"""
+    try:
+        with _openCSV(outfile, compression, mode="r") as f:
+            header = f.readline().rstrip("\r\n")
+            last = None
+            for line in f:
+                if not line.endswith("\n"):
+                    return None
+                last = line.rstrip("\r\n")
+    except (OSError, EOFError, UnicodeDecodeError):
+        return None
+    return header, last
+
+
+def _csvLastRow(Lx, names, vars_df=None, before=None):
+    """Last row of Lx before a given time as written by writeCSV, None if
+    there is no row"""
+    valid = _validRows(Lx)
+    if before is not None:
+        valid &= pd.DatetimeIndex(Lx["time"].values) < pd.Timestamp(before)
+    rows = np.flatnonzero(valid)[-1:]
+    if len(rows) == 0:
+        return None
+    return next(_formatRows(Lx, names, rows, vars_df))
+
+
+def _tmpPath(path):
+    """Temporary path next to a file, to write the file before moving it in
+    place"""
+    path = Path(path)
+    return path.with_name(path.name + ".tmp")
+
+
+def _inferCompression(outfile):
+    return {v: k for k, v in _CSV_SUFFIXES.items()}.get(Path(outfile).suffix)
+
+
+def _csvColumns(Lx, csv_order):
+    """Variables written to the CSV file, in the order of csv_order"""
+    variables = [v for v in Lx.variables if v != "time" and Lx[v].dims == ("time",)]
+    if csv_order is None:
+        return variables
+    return [c for c in csv_order if c in variables]
+
+
+def _csvTimeFormat(Lx):
+    """Dates only if all times are at midnight, as written by pandas"""
+    time = pd.DatetimeIndex(Lx["time"].values)
+    if (time != time.normalize()).any():
+        return "%Y-%m-%d %H:%M:%S"
+    return "%Y-%m-%d"
+
+
+def _validRows(Lx):
+    """Mask of the time steps where at least one variable has a value"""
+    valid = np.zeros(Lx.sizes["time"], dtype=bool)
+    for v in Lx.variables:
+        if v != "time" and Lx[v].dims == ("time",):
+            valid |= ~pd.isnull(Lx[v].values)
+    return valid
+
+
+def _writeCSVRows(f, Lx, names, vars_df=None, since=None, chunk_size=10000):
+    """Write the rows of Lx, from time since, where at least one variable
+    has a value"""
+    if vars_df is not None:
+        vars_df = VariableCatalog.of(vars_df)
+
+    valid = _validRows(Lx)
+    if since is not None:
+        valid &= pd.DatetimeIndex(Lx["time"].values) >= pd.Timestamp(since)
+    rows = np.flatnonzero(valid)
+
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        f.writelines(row + "\n" for row in _formatRows(Lx, names, chunk, vars_df))
+
+
+def _formatRows(Lx, names, rows, vars_df=None):
+    """Formatted CSV rows of Lx at the given indices, without line ends"""
+    decimals = {}
+    if vars_df is not None:
+        decimals = VariableCatalog.of(vars_df).decimals
+    time = pd.DatetimeIndex(Lx["time"].values[rows])
+    columns = [time.strftime(_csvTimeFormat(Lx)).tolist()]
+    for v in names:
+        columns.append(_formatValues(Lx[v].values[rows], decimals.get(v)))
+    return (",".join(row) for row in zip(*columns))
+
+
+_CSV_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def _openCSV(outfile, compression=None, mode="w"):
+    """Open a text file for writing, or reading with mode "r", compressed
+    with gzip or zstd"""
+    if compression is None:
+        return open(outfile, mode)
+    if compression == "gzip":
+        return gzip.open(outfile, mode + "t", compresslevel=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires the zstandard package")
+        return zstandard.open(outfile, mode + "t")
+    raise ValueError(f"Unknown compression {compression}")
+
+
+def _formatValues(values, decimals=None):
+    """Format an array of values as strings, rounded to a number of decimals.
+    Missing values are formatted as empty strings."""
+    if values.dtype.kind == "f":
+        if decimals is not None:
+            values = values.round(decimals)
+        return ["" if v != v else repr(v) for v in values.tolist()]
+    return ["" if pd.isnull(v) else str(v) for v in values.tolist()]
+
+
+def writeNC(outfile, Lx, col_names=None, compression=False, vars_df=None):
+    """Write data product to NetCDF file with compression. The encoding of
+    the variables is given by plan_encoding: the variables are packed as
+    scaled integers from their max_decimals when vars_df is given, and
+    chunked along an unlimited time dimension, so that the file can be
+    updated with updateNC. The file is written next to outfile and then
+    moved in place.
 
-def writeNC(outfile, Lx, col_names=None, compression=False):
-    """Write data product to NetCDF file with compression
+    Parameters
+    ----------
+    outfile : str
+        Output file path
+    Lx : xr.Dataset
+        Dataset to write to file
+    col_names : list, optional
+        Variables to write. If None, all variables are written.
+    compression : bool or str
+        If True or "zlib", the variables are compressed with shuffle and zlib,
+        if "zstd" with shuffle and zstd. The default is False.
+    vars_df : pandas.DataFrame, optional
+        Variables look-up table. If given, the values are rounded to its
+        max_decimals and packed before writing.
+    """
+    ds, names, encoding = _prepareNC(Lx, col_names, compression, vars_df)
+    # the encoding of the source files is replaced by the planned one
+    ds = ds.copy()
+    for var in names:
+        ds[var].encoding = {}
+    tmp = _tmpPath(outfile)
+    ds.to_netcdf(tmp, mode="w", format="NETCDF4", compute=True, encoding=encoding,
+                 unlimited_dims=["time"])
+    os.replace(tmp, outfile)
+
+
+def updateNC(outfile, Lx, col_names=None, compression=False, vars_df=None):
+    """Update a NetCDF file written by writeNC. Only the time steps from the
+    first one that differs from the file are written, and the global
+    attributes are updated, except date_created and date_issued. The file
+    is fully written if it does not exist or if its variables or their
+    encoding differ, for instance when new values do not fit in the packed
+    data type. The update is done on a copy of the file, which is then
+    moved in place, so that readers never see a partially written file.
 
     Parameters
     ----------
@@ -156,22 +568,279 @@ def writeNC(outfile, Lx, col_names=None, compression=False):
         Output file path
     Lx : xr.Dataset
         Dataset to write to file
+    col_names : list, optional
+        Variables to write. If None, all variables are written.
+    compression : bool or str
+        Compression of the variables, see writeNC. The default is False.
+    vars_df : pandas.DataFrame, optional
+        Variables look-up table
+
+    Returns
+    -------
+    pandas.Timestamp or None
+        Time of the first written time step, None if the file is unchanged
     """
+    ds, names, encoding = _prepareNC(Lx, col_names, compression, vars_df)
+    time = pd.DatetimeIndex(ds["time"].values)
+    packed = {var: _packValues(ds[var].values, encoding[var]) for var in names}
+
+    update = None
     if os.path.isfile(outfile):
-        os.remove(outfile)
+        update = _firstChangedIndex(outfile, ds, names, encoding, packed)
+    if update is None:
+        writeNC(outfile, Lx, col_names, compression, vars_df)
+        return time[0]
+    start, time_values = update
+    if start == len(time):
+        logger.info(f"{outfile} is unchanged")
+        return None
+
+    tmp = _tmpPath(outfile)
+    shutil.copyfile(outfile, tmp)
+    with netCDF4.Dataset(tmp, "a") as nc:
+        nc.set_auto_maskandscale(False)
+        nc.variables["time"][start:] = time_values[start:]
+        for var in names:
+            nc.variables[var][start:] = packed[var][start:]
+        nc.setncatts(
+            {k: v for k, v in ds.attrs.items() if k not in ["date_created", "date_issued"]}
+        )
+    os.replace(tmp, outfile)
+    logger.info(f"Updated {outfile} from {time[start]}")
+    return time[start]
+
+
+def writeZarr(outfile, Lx, col_names=None, vars_df=None):
+    """Write data product to a Zarr store with consolidated metadata. The
+    variables are selected, rounded, packed and chunked along time as in
+    writeNC. The store is written next to outfile and then moved in place.
+    Requires the zarr package.
+
+    Parameters
+    ----------
+    outfile : str
+        Output store path
+    Lx : xr.Dataset
+        Dataset to write to file
+    col_names : list, optional
+        Variables to write. If None, all variables are written.
+    vars_df : pandas.DataFrame, optional
+        Variables look-up table. If given, the values are rounded to its
+        max_decimals and packed before writing.
+    """
+    ds, names, encoding = _prepareNC(Lx, col_names, None, vars_df)
+    _writeZarrStore(outfile, ds, names, encoding)
+
+
+def writeZarrCollection(outfile, datasets, col_names=None, vars_df=None):
+    """Write the same product of several stations or sites to a single Zarr
+    store, with a station dimension. The datasets are aligned on the union
+    of their time steps and variables, and chunked with one station per
+    chunk and about a year of time steps, so that xr.open_zarr can lazily
+    select stations and time ranges. The latitude, longitude and altitude
+    attributes of the datasets are stored as station coordinates. Requires
+    the zarr package.
+
+    Parameters
+    ----------
+    outfile : str
+        Output store path
+    datasets : dict
+        Dataset of each station or site id
+    col_names : list, optional
+        Variables to write. If None, all variables are written.
+    vars_df : pandas.DataFrame, optional
+        Variables look-up table. If given, the values are rounded to its
+        max_decimals and packed before writing.
+    """
+    selected = {}
+    for name, ds in datasets.items():
+        ds, _, _ = _prepareNC(ds, col_names, None, vars_df)
+        ds = ds.copy()
+        for var in ds.variables:
+            ds[var].encoding = {}
+        selected[name] = ds
+    names = list(dict.fromkeys(v for ds in selected.values() for v in ds.data_vars))
     if col_names is not None:
-        names = [c for c in col_names if c in list(Lx.keys())]
+        names = [c for c in col_names if c in names]
+
+    aligned = xr.align(*selected.values(), join="outer")
+    stations = []
+    for name, ds in zip(selected, aligned):
+        for var in names:
+            if var not in ds:
+                ds[var] = ("time", np.full(ds.sizes["time"], np.nan))
+        stations.append(ds[names].expand_dims(station=[name]))
+    collection = xr.concat(stations, dim="station", combine_attrs="drop_conflicts")
+    for key in ["latitude", "longitude", "altitude"]:
+        values = [ds.attrs.get(key, np.nan) for ds in selected.values()]
+        collection.coords[key] = ("station", pd.to_numeric(values, errors="coerce"))
+        collection.attrs.pop(key, None)
+
+    encoding = plan_encoding(collection, names, vars_df, compression=None)
+    _writeZarrStore(outfile, collection, names, encoding)
+
+
+def _writeZarrStore(outfile, ds, names, encoding):
+    """Write a dataset to a Zarr store with an encoding planned for NetCDF,
+    replacing an existing store"""
+    if importlib.util.find_spec("zarr") is None:
+        raise ImportError("Zarr output requires the zarr package")
+    outfile = Path(outfile)
+    ds = ds.copy()
+    zarr_encoding = {}
+    for var in names:
+        ds[var].encoding = {}
+        enc = {k: v for k, v in encoding[var].items()
+               if k in ["dtype", "scale_factor", "_FillValue"]}
+        if "chunksizes" in encoding[var]:
+            enc["chunks"] = encoding[var]["chunksizes"]
+        zarr_encoding[var] = enc
+
+    tmp = _tmpPath(outfile)
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    ds.to_zarr(tmp, mode="w", consolidated=True, encoding=zarr_encoding)
+    _replaceDirectory(tmp, outfile)
+
+
+def writeParquet(outdir, Lx, col_names=None, vars_df=None, station_id=None):
+    """Write data product to a Parquet dataset partitioned by station and
+    year, as outdir/station=<id>/year=<year>/data.parquet. The rows are
+    sorted by time and written in row groups of about a month, with
+    statistics, so that readers can skip the files and row groups outside
+    a time range. Rows where all variables are missing are not written, as
+    in writeCSV. The previous partitions of the station are replaced.
+    Requires the pyarrow package.
+
+    Parameters
+    ----------
+    outdir : str
+        Root folder of the Parquet dataset
+    Lx : xr.Dataset
+        Dataset to write to file
+    col_names : list, optional
+        Variables to write. If None, all variables are written.
+    vars_df : pandas.DataFrame, optional
+        Variables look-up table. If given, the values are rounded to its
+        max_decimals.
+    station_id : str, optional
+        Station or site id. If None, the station_id or site_id attribute of
+        Lx is used.
+    """
+    if importlib.util.find_spec("pyarrow") is None:
+        raise ImportError("Parquet output requires the pyarrow package")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if station_id is None:
+        station_id = Lx.attrs.get("station_id", Lx.attrs.get("site_id"))
+    ds, names, _ = _prepareNC(Lx, col_names, None, vars_df)
+    ds = ds.sortby("time").isel(time=_validRows(ds))
+    time = pd.DatetimeIndex(ds["time"].values)
+
+    target = Path(outdir) / f"station={station_id}"
+    tmp = _tmpPath(target)
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    for year in np.unique(time.year):
+        rows = np.flatnonzero(time.year == year)
+        table = pa.table(
+            {"time": time[rows], **{var: ds[var].values[rows] for var in names}}
+        )
+        folder = tmp / f"year={year}"
+        folder.mkdir(parents=True)
+        pq.write_table(
+            table,
+            folder / "data.parquet",
+            row_group_size=chunk_length(time[rows], "31D", min_length=256),
+            write_statistics=True,
+            compression="zstd",
+        )
+    target.parent.mkdir(parents=True, exist_ok=True)
+    _replaceDirectory(tmp, target)
+
+
+def _replaceDirectory(tmp, target):
+    """Move a directory in place of another one. A directory cannot be
+    replaced atomically, the previous one is moved away first."""
+    if not tmp.exists():
+        tmp.mkdir()
+    if target.exists():
+        old = target.with_name(target.name + ".old")
+        if old.exists():
+            shutil.rmtree(old)
+        os.replace(target, old)
+        os.replace(tmp, target)
+        shutil.rmtree(old)
     else:
-        names = list(Lx.keys())
+        os.replace(tmp, target)
 
-    encoding = {var: dict() for var in names}
 
-    if compression:
-        comp = dict(zlib=True, complevel=4)
+def _prepareNC(Lx, col_names, compression, vars_df):
+    """Variables to write, rounded, and their encoding"""
+    if col_names is not None:
+        names = [c for c in col_names if c in list(Lx.keys())]
+    else:
+        names = list(Lx.keys())
+    ds = Lx[names]
+    if vars_df is not None:
+        ds = roundValues(ds, vars_df)
+    encoding = plan_encoding(ds, names, vars_df, compression=compression)
+    return ds, names, encoding
+
+
+def _packValues(values, encoding):
+    """Values as stored in a NetCDF variable with a planned encoding"""
+    if values.dtype.kind != "f":
+        return values
+    if "scale_factor" in encoding:
+        packed = np.round(values / encoding["scale_factor"])
+        packed[np.isnan(packed)] = encoding["_FillValue"]
+        return packed.astype(encoding["dtype"])
+    return values.astype(encoding["dtype"])
+
+
+def _firstChangedIndex(outfile, ds, names, encoding, packed):
+    """Index of the first time step of ds that differs from a NetCDF file,
+    and the encoded times of ds. None if the file cannot be updated."""
+    with netCDF4.Dataset(outfile) as nc:
+        nc.set_auto_maskandscale(False)
+        if "time" not in nc.dimensions or not nc.dimensions["time"].isunlimited():
+            return None
+        if set(nc.variables) != set(names) | {"time"}:
+            return None
         for var in names:
-            encoding[var].update(comp)
+            v = nc.variables[var]
+            if packed[var].dtype != v.dtype:
+                return None
+            if encoding[var].get("scale_factor") != getattr(v, "scale_factor", None):
+                return None
+
+        time_var = nc.variables["time"]
+        time_values, _, _ = xr.coding.times.encode_cf_datetime(
+            ds["time"].values, time_var.units,
+            getattr(time_var, "calendar", "proleptic_gregorian"),
+        )
+        time_values = np.asarray(time_values)
+        if time_var.dtype.kind == "i" and not np.all(np.mod(time_values, 1) == 0):
+            return None
+        n = len(time_var)
+        if n > len(time_values):
+            return None
 
-    Lx[names].to_netcdf(outfile, mode="w", format="NETCDF4", compute=True, encoding=encoding)
+        start = n
+        changed = time_var[:] != time_values[:n]
+        for var in names:
+            old = nc.variables[var][:]
+            new = packed[var][:n]
+            if new.dtype.kind == "f":
+                changed |= ~((old == new) | (np.isnan(old) & np.isnan(new)))
+            else:
+                changed |= old != new
+        if changed.any():
+            start = int(np.argmax(changed))
+        return start, time_values.astype(time_var.dtype)
 
 
 def getColNames(vars_df, ds, remove_nan_fields=False):
@@ -189,27 +858,31 @@ def getColNames(vars_df, ds, remove_nan_fields=False):
      list
          Variable names
     """
-    # selecting variable list based on level
-    vars_df = vars_df.loc[vars_df[ds.attrs["level"]] == 1]
-
-    # selecting variable list based on geometry
-    if ds.attrs["level"] in ["L0", "L1", "L2"]:
-        if ds.attrs["number_of_booms"] == 1:
-            vars_df = vars_df.loc[vars_df["station_type"].isin(["one-boom", "all"])]
-        elif ds.attrs["number_of_booms"] == 2:
-            vars_df = vars_df.loc[vars_df["station_type"].isin(["two-boom", "all"])]
-
-    var_list = list(vars_df.index)
+    # selecting variable list based on level and geometry
+    var_list = VariableCatalog.of(vars_df).column_names(
+        ds.attrs["level"], ds.attrs.get("number_of_booms")
+    )
     if remove_nan_fields:
-        for v in var_list:
-            if v not in ds.keys():
-                var_list.remove(v)
-                continue
-            if ds[v].isnull().all():
-                var_list.remove(v)
+        empty = _emptyVariables(ds, var_list)
+        var_list = [v for v in var_list if v in ds.data_vars and v not in empty]
     return var_list
 
 
+def _emptyVariables(ds, names):
+    """Names of the data variables of a dataset with only missing values.
+    The float variables along time are checked in one reduction."""
+    names = [v for v in names if v in ds.data_vars]
+    batched = [v for v in names if ds[v].dims == ("time",) and ds[v].dtype.kind == "f"]
+    empty = set()
+    if batched:
+        values = np.stack([ds[v].values for v in batched])
+        empty.update(np.asarray(batched)[np.isnan(values).all(axis=1)])
+    for v in set(names).difference(batched):
+        if ds[v].isnull().all():
+            empty.add(v)
+    return empty
+
+
 def addVars(ds, variables):
     """Add variable attributes from file to dataset
 
@@ -217,7 +890,7 @@ def addVars(ds, variables):
     ----------
     ds : xarray.Dataset
         Dataset to add variable attributes to
-    variables : pandas.DataFrame
+    variables : pandas.DataFrame or VariableCatalog
         Variables lookup table file
 
     Returns
@@ -225,18 +898,10 @@ def addVars(ds, variables):
     ds : xarray.Dataset
         Dataset with metadata
     """
-    for k in ds.keys():
-        if k not in variables.index:
-            continue
-        ds[k].attrs["standard_name"] = variables.loc[k]["standard_name"]
-        ds[k].attrs["long_name"] = variables.loc[k]["long_name"]
-        ds[k].attrs["units"] = variables.loc[k]["units"]
-        ds[k].attrs["coverage_content_type"] = variables.loc[k]["coverage_content_type"]
-        ds[k].attrs["coordinates"] = variables.loc[k]["coordinates"]
-    return ds
+    return VariableCatalog.of(variables).add_attributes(ds)
 
 
-def addMeta(ds, meta):
+def addMeta(ds, meta, coordinate_attrs=None):
     """Add metadata attributes from file to dataset
 
     Parameters
@@ -245,38 +910,23 @@ def addMeta(ds, meta):
         Dataset to add metadata attributes to
     meta : dict
         Metadata file
+    coordinate_attrs : dict, optional
+        Coordinates and geospatial bounds computed with
+        _coordinateAttributes, e.g. on another product of the same data. If
+        None, they are computed from ds.
 
     Returns
     -------
     ds : xarray.Dataset
         Dataset with metadata
     """
+    if coordinate_attrs is None:
+        coordinate_attrs = _coordinateAttributes(ds)
 
     # a static latitude, longitude and altitude is saved as attribute along its origin
-    var_alias = {"lat": "latitude", "lon": "longitude", "alt": "altitude"}
-    for v in ["lat", "lon", "alt"]:
-        # saving the reference latitude/longitude/altitude
-        original_value = np.nan
-        if var_alias[v] in ds.attrs.keys():
-            original_value = ds.attrs[var_alias[v]]
-        if v in ds.keys():
-            # if possible, replacing it with average coordinates based on the extra/interpolated coords
-            ds.attrs[var_alias[v]] = ds[v].mean().item()
-            ds.attrs[var_alias[v] + "_origin"] = (
-                "average of gap-filled postprocessed " + v
-            )
-        elif "gps_" + v in ds.keys():
-            # if possible, replacing it with average coordinates based on the measured coords (can be gappy)
-            ds.attrs[var_alias[v]] = ds["gps_" + v].mean().item()
-            ds.attrs[var_alias[v] + "_origin"] = (
-                "average of GPS-measured " + v + ", potentially including gaps"
-            )
-
-        if np.isnan(ds.attrs[var_alias[v]]):
-            # if no better data was available to update the coordinate, then we
-            # re-use the original value
-            ds.attrs[var_alias[v]] = original_value
-            ds.attrs[var_alias[v] + "_origin"] = "reference value, origin unknown"
+    for k, v in coordinate_attrs.items():
+        if not k.startswith("geospatial_"):
+            ds.attrs[k] = v
 
     # Attribute convention for data discovery
     # https://wiki.esipfed.org/Attribute_Convention_for_Data_Discovery_1-3
@@ -332,60 +982,9 @@ def addMeta(ds, meta):
         sample_rate=sample_rate.capitalize(),
     )
 
-    if "lat" in ds.keys():
-        lat_min = ds["lat"].min().values
-        lat_max = ds["lat"].max().values
-    elif "gps_lat" in ds.keys():
-        lat_min = ds["gps_lat"].min().values
-        lat_max = ds["gps_lat"].max().values
-    elif "latitude" in ds.attrs.keys():
-        lat_min = ds.attrs["latitude"]
-        lat_max = ds.attrs["latitude"]
-    else:
-        lat_min = np.nan
-        lat_max = np.nan
-
-    if "lon" in ds.keys():
-        lon_min = ds["lon"].min().values
-        lon_max = ds["lon"].max().values
-    elif "gps_lon" in ds.keys():
-        lon_min = ds["gps_lon"].min().values
-        lon_max = ds["gps_lon"].max().values
-    elif "longitude" in ds.attrs.keys():
-        lon_min = ds.attrs["longitude"]
-        lon_max = ds.attrs["longitude"]
-    else:
-        lon_min = np.nan
-        lon_max = np.nan
-
-    if "alt" in ds.keys():
-        alt_min = ds["alt"].min().values
-        alt_max = ds["alt"].max().values
-    elif "gps_alt" in ds.keys():
-        alt_min = ds["gps_alt"].min().values
-        alt_max = ds["gps_alt"].max().values
-    elif "altitude" in ds.attrs.keys():
-        alt_min = ds.attrs["altitude"]
-        alt_max = ds.attrs["altitude"]
-    else:
-        alt_min = np.nan
-        alt_max = np.nan
-
-    ds.attrs["geospatial_bounds"] = (
-        "POLYGON(("
-        + f"{lat_min} {lon_min}, "
-        + f"{lat_min} {lon_max}, "
-        + f"{lat_max} {lon_max}, "
-        + f"{lat_max} {lon_min}, "
-        + f"{lat_min} {lon_min}))"
-    )
-
-    ds.attrs["geospatial_lat_min"] = str(lat_min)
-    ds.attrs["geospatial_lat_max"] = str(lat_max)
-    ds.attrs["geospatial_lon_min"] = str(lon_min)
-    ds.attrs["geospatial_lon_max"] = str(lon_max)
-    ds.attrs["geospatial_vertical_min"] = str(alt_min)
-    ds.attrs["geospatial_vertical_max"] = str(alt_max)
+    for k, v in coordinate_attrs.items():
+        if k.startswith("geospatial_"):
+            ds.attrs[k] = v
 
     ds.attrs["geospatial_vertical_positive"] = "up"
     ds.attrs["time_coverage_start"] = str(ds["time"][0].values)
@@ -418,6 +1017,77 @@ def addMeta(ds, meta):
     return ds
 
 
+def _coordinateAttributes(ds):
+    """Average coordinates of a dataset, with their origin, and geospatial
+    bounds
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dataset with reformatted longitudes
+
+    Returns
+    -------
+    dict
+        Attributes
+    """
+    attrs = {}
+    var_alias = {"lat": "latitude", "lon": "longitude", "alt": "altitude"}
+    for v in ["lat", "lon", "alt"]:
+        # saving the reference latitude/longitude/altitude
+        original_value = np.nan
+        if var_alias[v] in ds.attrs.keys():
+            original_value = ds.attrs[var_alias[v]]
+        value = original_value
+        origin = None
+        if v in ds.keys():
+            # if possible, replacing it with average coordinates based on the extra/interpolated coords
+            value = ds[v].mean().item()
+            origin = "average of gap-filled postprocessed " + v
+        elif "gps_" + v in ds.keys():
+            # if possible, replacing it with average coordinates based on the measured coords (can be gappy)
+            value = ds["gps_" + v].mean().item()
+            origin = "average of GPS-measured " + v + ", potentially including gaps"
+
+        if np.isnan(value):
+            # if no better data was available to update the coordinate, then we
+            # re-use the original value
+            value = original_value
+            origin = "reference value, origin unknown"
+        attrs[var_alias[v]] = value
+        if origin is not None:
+            attrs[var_alias[v] + "_origin"] = origin
+
+    bounds = {}
+    for v in ["lat", "lon", "alt"]:
+        if v in ds.keys():
+            bounds[v] = ds[v].min().values, ds[v].max().values
+        elif "gps_" + v in ds.keys():
+            bounds[v] = ds["gps_" + v].min().values, ds["gps_" + v].max().values
+        elif var_alias[v] in attrs.keys():
+            bounds[v] = attrs[var_alias[v]], attrs[var_alias[v]]
+        else:
+            bounds[v] = np.nan, np.nan
+    (lat_min, lat_max), (lon_min, lon_max), (alt_min, alt_max) = bounds.values()
+
+    attrs["geospatial_bounds"] = (
+        "POLYGON(("
+        + f"{lat_min} {lon_min}, "
+        + f"{lat_min} {lon_max}, "
+        + f"{lat_max} {lon_max}, "
+        + f"{lat_max} {lon_min}, "
+        + f"{lat_min} {lon_min}))"
+    )
+
+    attrs["geospatial_lat_min"] = str(lat_min)
+    attrs["geospatial_lat_max"] = str(lat_max)
+    attrs["geospatial_lon_min"] = str(lon_min)
+    attrs["geospatial_lon_max"] = str(lon_max)
+    attrs["geospatial_vertical_min"] = str(alt_min)
+    attrs["geospatial_vertical_max"] = str(alt_max)
+    return attrs
+
+
 def _addAttr(ds, key, value):
     """Add attribute to xarray dataset
 
@@ -439,26 +1109,29 @@ def _addAttr(ds, key, value):
 
 def roundValues(ds, df, col="max_decimals"):
     """Round all variable values in data array based on pre-defined rounding
-    value in variables look-up table DataFrame
+    value in variables look-up table DataFrame. All variables are rounded
+    in one operation with round_variables.
 
     Parameters
     ----------
     ds : xr.Dataset
         Dataset to round values in
-    df : pd.Dataframe
+    df : pd.Dataframe or VariableCatalog
         Variable look-up table with rounding values
     col : str
         Column in variable look-up table that contains rounding values. The
         default is "max_decimals"
+
+    Returns
+    -------
+    ds : xr.Dataset
+        Dataset with rounded values
     """
-    df = df[col]
-    df = df.dropna(how="all")
-    for var in df.index:
-        if var not in list(ds.variables):
-            continue
-        if df[var] is not np.nan:
-            ds[var] = ds[var].round(decimals=int(df[var]))
-    return ds
+    if col == "max_decimals":
+        decimals = VariableCatalog.of(df).decimals
+    else:
+        decimals = df[col].dropna().astype(int).to_dict()
+    return round_variables(ds, decimals)
 
 
 def reformat_time(dataset):
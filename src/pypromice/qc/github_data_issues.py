@@ -5,6 +5,8 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 
+from pypromice.qc.hampel import hampel_filter
+
 __all__ = [
     'flagNAN',
     'adjustTime',
@@ -327,14 +329,5 @@ def _hampel(vals_orig, k=7*24, t0=3):
     '''
     #Make copy so original not edited
     vals=vals_orig.copy()
-
-    #Hampel Filter
-    L= 1.4826
-    rolling_median=vals.rolling(k).median()
-    difference=np.abs(rolling_median-vals)
-    median_abs_deviation=difference.rolling(k).median()
-    threshold= t0 *L * median_abs_deviation
-    outlier_idx=difference>threshold
-    outlier_idx[0:round(k/2)]=False
-    vals.loc[outlier_idx]=np.nan
+    vals[:] = hampel_filter(vals_orig.values, k=k, t0=t0)
     return(vals)
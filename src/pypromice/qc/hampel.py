@@ -0,0 +1,42 @@
+import numpy as np
+
+from pypromice.utilities.rolling import rolling_median
+
+__all__ = [
+    "hampel_filter",
+]
+
+
+def hampel_filter(values, k: int = 7 * 24, t0: float = 15) -> np.ndarray:
+    """
+    Hampel filter removing outliers from one or several time series.
+
+    A value is flagged as outlier when its absolute difference to the rolling
+    median of the previous k values exceeds t0 times the (scaled) rolling
+    median absolute deviation. The first round(k/2) values are never flagged.
+
+    Parameters
+    ----------
+    values : array-like
+        1-D array, or 2-D array where each column is filtered separately
+    k : int
+        Size of window, including the sample. For example, 7 is equal to 3 on
+        either side of value. The default is 7*24.
+    t0 : float
+        Threshold value. The default is 15.
+
+    Returns
+    -------
+    numpy.ndarray
+        Copy of values where the outliers are set to NaN
+    """
+    vals = np.array(values, dtype=float)
+    L = 1.4826
+    difference = np.abs(rolling_median(vals, k) - vals)
+    median_abs_deviation = rolling_median(difference, k)
+    threshold = t0 * L * median_abs_deviation
+    with np.errstate(invalid="ignore"):
+        outlier_idx = difference > threshold
+    outlier_idx[0:round(k / 2)] = False
+    vals[outlier_idx] = np.nan
+    return vals
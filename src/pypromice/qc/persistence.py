@@ -1,12 +1,16 @@
 import logging
 
+import attrs
 import numpy as np
 import pandas as pd
 import xarray as xr
-from typing import Mapping, Optional, Union
+from typing import Dict, Mapping, Optional, Tuple, Union
 
 __all__ = [
+    "PersistenceState",
     "persistence_qc",
+    "persistence_qc_incremental",
+    "find_persistent_values",
     "find_persistent_regions",
     "count_consecutive_persistent_values",
     "get_duration_consecutive_true",
@@ -46,6 +50,34 @@ DEFAULT_VARIABLE_THRESHOLDS = {
 }
 
 
+@attrs.define
+class PersistenceState:
+    """
+    State of the persistence detection at the end of the processed data,
+    from which persistence_qc_incremental continues on new data.
+
+    Attributes
+    ----------
+    last_time : str
+        Last processed timestamp, ISO8601, None if nothing was processed
+    elapsed_hours : float
+        Hours elapsed from the first processed timestamp
+    last_value : dict
+        For each filtered variable, last valid value, or None
+    run_start : dict
+        For each filtered variable in a run of persistent values, hours
+        elapsed before the start of the run, or None
+    """
+
+    last_time: Optional[str]
+    elapsed_hours: float = 0.0
+    last_value: Dict[str, Optional[float]] = attrs.field(factory=dict)
+    run_start: Dict[str, Optional[float]] = attrs.field(factory=dict)
+
+    def as_dict(self) -> Dict:
+        return attrs.asdict(self)
+
+
 def persistence_qc(
     ds: xr.Dataset,
     variable_thresholds: Optional[Mapping] = None,
@@ -77,14 +109,55 @@ def persistence_qc(
     # This is best done by running aws.py directly and setting 'test_station'
     # Plots will be shown before and after flag removal for each var
 
-    df = ds.to_dataframe()  # Switch to pandas
+    ds_out, _ = _persistence_qc(ds, variable_thresholds)
+    return ds_out
+
+
+def persistence_qc_incremental(
+    ds: xr.Dataset,
+    state: Optional[PersistenceState] = None,
+    variable_thresholds: Optional[Mapping] = None,
+) -> Tuple[xr.Dataset, PersistenceState]:
+    """
+    Filter persistent values of new data, continuing the runs of persistent
+    values from the state of the previous call. The values filtered are the
+    same as with persistence_qc on the full history.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Level 1 dataset. Only the timestamps after state.last_time are
+        processed.
+    state : PersistenceState, optional
+        State of the previous call. If None, ds is processed from its start.
+    variable_thresholds : Mapping, optional
+        Persistence thresholds, see persistence_qc. They must be the same
+        for all calls.
+
+    Returns
+    -------
+    ds_out : xr.Dataset
+        Timestamps of ds after state.last_time, with persistent values set
+        to NaN
+    state : PersistenceState
+        Updated state
+    """
+    if state is not None and state.last_time is None:
+        state = None
+    if state is not None:
+        ds = ds.sel(time=ds.time.values > pd.Timestamp(state.last_time).to_datetime64())
+    return _persistence_qc(ds, variable_thresholds, state)
+
 
+def _persistence_qc(ds, variable_thresholds=None, state=None):
     if variable_thresholds is None:
         variable_thresholds = DEFAULT_VARIABLE_THRESHOLDS
         logger.debug(f"Running persistence_qc using {variable_thresholds}")
     else:
         logger.info(f"Running persistence_qc using custom thresholds:\n {variable_thresholds}")    
 
+    # Variables filtered together, with their persistence thresholds
+    targets = []
     for k in variable_thresholds.keys():
         if k in ["t", "p", "rh", "wspd", "wdir", "z_boom"]:
             var_all = [
@@ -98,38 +171,182 @@ def persistence_qc(
         period = variable_thresholds[k]["period"]  # loading diff period
 
         for v in var_all:
-            if v in df:
-                mask = find_persistent_regions(df[v], period, max_diff)
-                if "rh" in v:
-                    mask = mask & (df[v] < 99)
-                n_masked = mask.sum()
-                n_samples = len(mask)
-                logger.debug(
-                    f"Applying persistent QC in {v}. Filtering {n_masked}/{n_samples} samples"
-                )
-                # setting outliers to NaN
-                df.loc[mask, v] = np.nan
-            elif v == "gps_lat_lon":
-                mask = find_persistent_regions(
-                    df["gps_lon"], period, max_diff
-                ) & find_persistent_regions(df["gps_lat"], period, max_diff)
-
-                n_masked = mask.sum()
-                n_samples = len(mask)
-                logger.debug(
-                    f"Applying persistent QC in {v}. Filtering {n_masked}/{n_samples} samples"
-                )
-                # setting outliers to NaN
-                df.loc[mask, "gps_lon"] = np.nan
-                df.loc[mask, "gps_lat"] = np.nan
-
-    # Back to xarray, and re-assign the original attrs
-    ds_out = df.to_xarray()
-    ds_out = ds_out.assign_attrs(ds.attrs)  # Dataset attrs
-    for x in ds_out.data_vars:  # variable-specific attrs
-        ds_out[x].attrs = ds[x].attrs
+            if v in ds:
+                targets.append((v, [v], max_diff, period))
+            elif v == "gps_lat_lon" and "gps_lon" in ds and "gps_lat" in ds:
+                # removed where gps_lat and gps_lon are both persistent
+                targets.append((v, ["gps_lon", "gps_lat"], max_diff, period))
 
-    return ds_out
+    ds_out = ds.copy()
+    time = ds["time"].values
+    if state is None:
+        new_state = PersistenceState(last_time=None)
+    else:
+        new_state = PersistenceState(**state.as_dict())
+    if len(time) == 0:
+        return ds_out, new_state
+    new_state.last_time = pd.Timestamp(time[-1]).isoformat()
+    for level, batch in enumerate(_batches(targets)):
+        columns = [name for _, names, _, _ in batch for name in names]
+        # the state of a variable filtered again is kept apart
+        keys = [name if level == 0 else f"{name}:{level}" for name in columns]
+        # one row per variable
+        series = np.stack([ds_out[name].values for name in columns]).astype(float)
+        max_diffs = np.array([max_diff for _, names, max_diff, _ in batch for _ in names])
+        periods = np.array([period for _, names, _, period in batch for _ in names])
+        previous = None
+        if state is not None:
+            previous = (
+                state.last_time,
+                state.elapsed_hours,
+                np.array([_nan_if_none(state.last_value.get(key)) for key in keys]),
+                np.array([_nan_if_none(state.run_start.get(key)) for key in keys]),
+            )
+        persistent, (_, elapsed_hours, last_value, run_start) = _find_persistent_runs(
+            series, time, periods, max_diffs, previous
+        )
+        new_state.elapsed_hours = float(elapsed_hours)
+        new_state.last_value.update(zip(keys, map(_none_if_nan, last_value)))
+        new_state.run_start.update(zip(keys, map(_none_if_nan, run_start)))
+        persistent = persistent.T
+        values = series.T
+
+        i = 0
+        for v, names, _, _ in batch:
+            mask = persistent[:, i:i + len(names)].all(axis=1)
+            if "rh" in v:
+                mask &= values[:, i] < 99
+            i += len(names)
+            logger.debug(
+                f"Applying persistent QC in {v}. Filtering {mask.sum()}/{len(mask)} samples"
+            )
+            # setting outliers to NaN
+            for name in names:
+                variable = ds_out[name].variable
+                ds_out[name] = variable.copy(data=np.where(mask, np.nan, variable.values))
+
+    return ds_out, new_state
+
+
+def _nan_if_none(value):
+    return np.nan if value is None else value
+
+
+def _none_if_nan(value):
+    return None if np.isnan(value) else float(value)
+
+
+def _batches(targets):
+    """Split the variables to filter in batches without repeated variables.
+    A variable filtered twice is filtered again after its first filtering,
+    in a later batch."""
+    batches = []
+    last_batch = {}
+    for target in targets:
+        names = target[1]
+        level = max((last_batch[name] + 1 for name in names if name in last_batch), default=0)
+        if level == len(batches):
+            batches.append([])
+        batches[level].append(target)
+        for name in names:
+            last_batch[name] = level
+    return batches
+
+
+def find_persistent_values(
+    values: np.ndarray,
+    time: np.ndarray,
+    min_repeats,
+    max_diff,
+) -> np.ndarray:
+    """
+    Persistent values in the columns of a 2-D array, as find_persistent_regions.
+
+    The runs of values changing by less than max_diff are labelled with the
+    position of their first value, and the duration of each run is the time
+    elapsed since the value preceding that position. Missing values are
+    forward filled and never flagged.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        2-D array with a time series in each column
+    time : numpy.ndarray
+        Time of the rows of values
+    min_repeats : float or array-like
+        Duration, in hours, from which a run of values is persistent, for
+        each column
+    max_diff : float or array-like
+        Largest difference between persistent values, for each column
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean array, True for the persistent values
+    """
+    # each time series is processed as a contiguous row
+    series = np.ascontiguousarray(np.asarray(values, dtype=float).T)
+    persistent, _ = _find_persistent_runs(
+        series, time, np.asarray(min_repeats), np.asarray(max_diff)
+    )
+    return persistent.T
+
+
+def _find_persistent_runs(series, time, min_repeats, max_diff, previous=None):
+    """
+    Persistent values in the rows of a 2-D array, continuing from the last
+    processed time step previous = (last time, elapsed hours, last valid
+    values, run starts), as stored in a PersistenceState. Returns the
+    persistent values and the same tuple at the end of series.
+    """
+    if previous is None:
+        last_time, elapsed_hours = None, 0.0
+        last_value = run_start = np.full(len(series), np.nan)
+    else:
+        last_time, elapsed_hours, last_value, run_start = previous
+    times = time.astype("datetime64[ns]").astype(np.int64)
+
+    # the last processed time step is prepended to the new values
+    series = np.concatenate([last_value[:, None], series], axis=1)
+    positions = np.arange(series.shape[1])
+    is_nan = np.isnan(series)
+
+    # forward filled differences
+    last_valid = np.maximum.accumulate(np.where(is_nan, 0, positions), axis=1)
+    filled = np.take_along_axis(series, last_valid, axis=1)
+    unchanged = np.zeros(series.shape, dtype=bool)
+    unchanged[:, 0] = ~np.isnan(run_start)
+    with np.errstate(invalid="ignore"):
+        unchanged[:, 1:] = np.abs(np.diff(filled, axis=1)) < np.asarray(max_diff)[..., None]
+
+    # time elapsed since the first time, in hours, summed as pandas does
+    delta = np.zeros(len(positions))
+    delta[0] = elapsed_hours
+    if last_time is not None:
+        times = np.r_[pd.Timestamp(last_time).value, times]
+        delta[1:] = np.diff(times) / 1e9 / 3600
+    else:
+        delta[2:] = np.diff(times) / 1e9 / 3600
+    elapsed = np.cumsum(delta)
+
+    # position of the first value of the run of each value
+    first = unchanged.copy()
+    first[:, 1:] &= ~unchanged[:, :-1]
+    first_position = np.maximum.accumulate(np.where(first, positions, 0), axis=1)
+    start = (elapsed - delta)[first_position]
+    if previous is not None:
+        # runs continued from the previous time step
+        start = np.where(first_position == 0, run_start[:, None], start)
+    duration = elapsed - start
+
+    persistent = unchanged & (duration >= np.asarray(min_repeats)[..., None]) & ~is_nan
+    last = (
+        pd.Timestamp(times[-1]).isoformat(),
+        elapsed[-1],
+        filled[:, -1],
+        np.where(unchanged[:, -1], start[:, -1], np.nan),
+    )
+    return persistent[:, 1:], last
 
 
 def find_persistent_regions(
@@ -140,11 +357,10 @@ def find_persistent_regions(
     """
     Algorithm that ensures values can stay the same within the outliers_mask
     """
-    consecutive_true_df = count_consecutive_persistent_values(data, max_diff)
-    persistent_regions = consecutive_true_df >= min_repeats
-    # Ignore entries which already nan in the input data
-    persistent_regions[data.isna()] = False
-    return persistent_regions
+    persistent = find_persistent_values(
+        data.to_numpy(dtype=float)[:, None], data.index.values, min_repeats, max_diff
+    )
+    return pd.Series(persistent[:, 0], index=data.index, name=data.name)
 
 
 def count_consecutive_persistent_values(
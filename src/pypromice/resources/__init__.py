@@ -1,6 +1,8 @@
 import csv
+import functools
+import os
 from pathlib import Path
-from typing import Dict, Union
+from typing import Dict, Tuple, Union
 
 import pandas as pd
 
@@ -8,21 +10,72 @@ DEFAULT_METADATA_PATH = (Path(__file__).parent / "file_attributes.csv").absolute
 DEFAULT_VARIABLES_PATH = (Path(__file__).parent / "variables.csv").absolute()
 DEFAULT_VARIABLES_ALIASES_GCNET_PATH = (Path(__file__).parent / "variable_aliases_GC-Net.csv").absolute()
 
+
+class FrozenDict(dict):
+    """
+    Read-only dictionary. Use dict(frozen) for a modifiable copy.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} is read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict.__repr__(self)})"
+
+
+def _cache_key(path: Union[str, Path]) -> Tuple[str, int]:
+    # the file is read again when it is modified
+    path = os.path.realpath(path)
+    return path, os.stat(path).st_mtime_ns
+
+
+@functools.lru_cache(maxsize=16)
+def _read_metadata(path: str, mtime_ns: int) -> FrozenDict:
+    with open(path, "r") as f:
+        csv_reader = csv.reader(f)
+        return FrozenDict({row[0]: row[1] for row in csv_reader})
+
+
+@functools.lru_cache(maxsize=16)
+def _read_variables(path: str, mtime_ns: int) -> pd.DataFrame:
+    return pd.read_csv(path, index_col=0, comment="#")
+
+
 def load_metadata(path: Union[None, str, Path] = None) -> Dict[str, str]:
     """
     Load metadata table from csv file
+
+    The table is read once for each path and modification time, and
+    returned as a read-only FrozenDict shared by all callers.
     """
     if path is None:
         path = DEFAULT_METADATA_PATH
-    with open(path, "r") as f:
-        csv_reader = csv.reader(f)
-        return {row[0]: row[1] for row in csv_reader}
+    return _read_metadata(*_cache_key(path))
 
 
 def load_variables(path: Union[None, str, Path] = None) -> pd.DataFrame:
     """
     Load variables table from csv file
+
+    The table is read once for each path and modification time. pandas has
+    no read-only DataFrame, so each caller gets a copy of the table that it
+    is free to modify.
     """
     if path is None:
         path = DEFAULT_VARIABLES_PATH
-    return pd.read_csv(path, index_col=0, comment="#")
+    return _read_variables(*_cache_key(path)).copy()
+
+
+def __getattr__(name: str):
+    # Lazy module attributes with the default tables, read on first access
+    if name == "variables":
+        return load_variables()
+    if name == "metadata":
+        return load_metadata()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
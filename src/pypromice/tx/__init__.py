@@ -1 +1,8 @@
-from pypromice.tx.tx import *
+# The transmission module is imported on first access (PEP 562)
+import importlib
+
+
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module("pypromice.tx.tx"), name)
@@ -5,7 +5,7 @@ AWS Level 0 (L0) data transmission fetching module
 """
 
 from collections import deque
-import email, re, os, os.path, time, unittest, calendar, imaplib, pkg_resources
+import email, re, os, os.path, time, unittest, calendar, imaplib
 
 # Set maximum number of email lines to read
 imaplib._MAXLINE = 5000000
@@ -122,6 +122,7 @@ class PayloadFormat(object):
         lines : list
             List of file line contents
         '''
+        import pkg_resources
         with pkg_resources.resource_stream('pypromice', fname) as stream:
             lines = stream.read().decode("utf-8")
             lines = lines.split("\n")  
@@ -953,6 +954,7 @@ def isModified(filename, time_threshold=1):
 
 def _loadTestMsg():
     '''Load test .msg email file'''
+    import pkg_resources
     with pkg_resources.resource_stream('pypromice', 'test/test_email') as stream:
         byte = stream.read()
     return email.message_from_bytes(byte)
@@ -1,4 +1,5 @@
-from typing import Mapping, Set, MutableMapping, Optional
+import bisect
+from typing import List, Mapping, Set, MutableMapping, Optional
 
 import attr
 
@@ -99,3 +100,22 @@ class DependencyGraph:
 
     def parent_closure_mapping(self) -> Mapping[str, Set[str]]:
         return {node.name: node.get_parents_closure() for node in self.nodes.values()}
+
+    def topological_sort(self) -> List[str]:
+        """
+        Node names ordered so that every node comes after all its parents.
+        Nodes without order constraint between them are sorted by name.
+        """
+        in_degree = {name: len(node.parents) for name, node in self.nodes.items()}
+        ready = sorted(name for name, degree in in_degree.items() if degree == 0)
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for child in self.nodes[name].children:
+                in_degree[child.name] -= 1
+                if in_degree[child.name] == 0:
+                    bisect.insort(ready, child.name)
+        if len(order) != len(self.nodes):
+            raise ValueError("The dependency graph contains a cycle")
+        return order
@@ -1,62 +1,251 @@
-import subprocess
+"""
+Provenance of the processing inputs from the git repositories they belong to
+
+The repository of a path is resolved once per process, and its HEAD commit
+and the dirty status of each path are cached. They are read from the .git
+directory: a path is dirty if one of its tracked files differs from the git
+index, as `git diff -- <path>` reports. The files are compared by stat data
+and only hashed when their stat data changed. git is run as a subprocess
+only to confirm a changed file, or when the repository cannot be read
+directly.
+"""
+import functools
+import hashlib
 import os
+import struct
+import subprocess
 from pathlib import Path
+from typing import Optional, Tuple
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+__all__ = [
+    "get_commit_hash_and_check_dirty",
+    "clear_cache",
+]
+
+# ctime, mtime (seconds and nanoseconds), dev, ino, mode, uid, gid, size,
+# object id and flags of an index entry
+_INDEX_ENTRY = struct.Struct(">10I20sH")
+_ASSUME_VALID = 0x8000
+_EXTENDED = 0x4000
+_SKIP_WORKTREE = 0x4000
+_GITLINK = 0o160000
+_SYMLINK = 0o120000
+
+
+class UnsupportedRepository(Exception):
+    """Repository that is read with the git command instead"""
+
 
 def get_commit_hash_and_check_dirty(file_path: str | Path) -> str:
-    if isinstance(file_path, str):
-        file_path = Path(file_path)
-    if file_path.is_dir():
-        repo_path = file_path
-    else:
-        repo_path = file_path.parent
+    """
+    HEAD commit of the repository of a file or directory, followed by
+    "(dirty)" if the tracked files under the path have uncommitted changes.
+
+    Parameters
+    ----------
+    file_path : str or pathlib.Path
+        File or directory in a git repository
+
+    Returns
+    -------
+    str
+        Commit hash, or "unknown" if the path is not under version control
+    """
+    path = Path(file_path).absolute()
+    directory = path if path.is_dir() else path.parent
+    repository = _find_repository(directory.resolve())
+    if repository is None:
+        logger.warning(f"Warning: The file {file_path} is not under version control.")
+        return "unknown"
+    work_tree, git_dir, common_dir = repository
+    relative_path = os.path.relpath(path.resolve(), work_tree).replace(os.sep, "/")
+    if relative_path == ".":
+        relative_path = ""
 
     try:
-        # Ensure the file path is relative to the repository
-
-        # Get the latest commit hash for the file
-        commit_hash = (
-            subprocess.check_output(
-                [
-                    "git",
-                    "-C",
-                    repo_path,
-                    "log",
-                    "-n",
-                    "1",
-                    "--pretty=format:%H",
-                ],
-                stderr=subprocess.STDOUT,
-            )
-            .strip()
-            .decode("utf-8")
-        )
-
-        # Check if the file is dirty (has uncommitted changes)
-        diff_output = (
-            subprocess.check_output(
-                ["git", "-C", repo_path, "diff"],
-                stderr=subprocess.STDOUT,
-            )
-            .strip()
-            .decode("utf-8")
-        )
-
-        # If diff_output is not empty, the file has uncommitted changes
-        is_dirty = len(diff_output) > 0
-
-        if is_dirty:
-            logger.warning(f"Warning: The file {file_path} is dirty compared to the last commit. {commit_hash}")
-            return f'{commit_hash} (dirty)'
-        if commit_hash == "":
-            logger.warning(f"Warning: The file {file_path} is not under version control.")
-            return 'unknown'
-
-        return commit_hash
-    except subprocess.CalledProcessError as e:
-        logger.warning(f"Error: {e.output.decode('utf-8')}")
-        return 'unknown'
+        commit_hash = _head_commit(git_dir, common_dir)
+        is_dirty = commit_hash is not None and _is_dirty(work_tree, git_dir, relative_path)
+    except (UnsupportedRepository, OSError, ValueError, struct.error) as e:
+        logger.debug(f"Reading {work_tree} with git: {e}")
+        try:
+            commit_hash = _git_head_commit(work_tree)
+            is_dirty = _git_is_dirty(work_tree, relative_path)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning(f"Error: {e}")
+            return "unknown"
+
+    if commit_hash is None:
+        logger.warning(f"Warning: The file {file_path} is not under version control.")
+        return "unknown"
+    if is_dirty:
+        logger.warning(f"Warning: The file {file_path} is dirty compared to the last commit. {commit_hash}")
+        return f"{commit_hash} (dirty)"
+    return commit_hash
+
+
+def clear_cache():
+    """Forget the repositories, commits and dirty status read so far"""
+    for function in [_find_repository, _head_commit, _index_entries, _is_dirty,
+                     _git_head_commit, _git_is_dirty]:
+        function.cache_clear()
+
+
+@functools.lru_cache(maxsize=None)
+def _find_repository(directory: Path) -> Optional[Tuple[Path, Path, Path]]:
+    """Work tree, git directory and common git directory of the repository
+    containing a directory"""
+    for work_tree in [directory, *directory.parents]:
+        dot_git = work_tree / ".git"
+        if dot_git.is_dir():
+            git_dir = dot_git
+        elif dot_git.is_file():
+            # linked work trees and submodules
+            content = dot_git.read_text().strip()
+            if not content.startswith("gitdir:"):
+                continue
+            git_dir = (work_tree / content[len("gitdir:"):].strip()).resolve()
+        else:
+            continue
+        common_dir = git_dir
+        if (git_dir / "commondir").is_file():
+            common_dir = (git_dir / (git_dir / "commondir").read_text().strip()).resolve()
+        return work_tree, git_dir, common_dir
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _head_commit(git_dir: Path, common_dir: Path) -> Optional[str]:
+    """Commit of HEAD, or None if there is no commit yet"""
+    if "objectformat" in (common_dir / "config").read_text().lower():
+        raise UnsupportedRepository("object format other than sha1")
+    head = (git_dir / "HEAD").read_text().strip()
+    while head.startswith("ref:"):
+        head = _read_ref(git_dir, common_dir, head[len("ref:"):].strip())
+        if head is None:
+            return None
+    if len(head) != 40:
+        raise UnsupportedRepository(f"invalid HEAD {head}")
+    return head
+
+
+def _read_ref(git_dir: Path, common_dir: Path, ref: str) -> Optional[str]:
+    for directory in [git_dir, common_dir]:
+        if (directory / ref).is_file():
+            return (directory / ref).read_text().strip()
+    packed_refs = common_dir / "packed-refs"
+    if packed_refs.is_file():
+        for line in packed_refs.read_text().splitlines():
+            if line.startswith(("#", "^")):
+                continue
+            object_id, _, name = line.partition(" ")
+            if name == ref:
+                return object_id
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _index_entries(git_dir: Path) -> Tuple[Tuple, ...]:
+    """Name, stage, mode, size, modification time and object id of the
+    entries of the git index that are compared to the work tree"""
+    index = git_dir / "index"
+    if not index.exists():
+        return ()
+    data = index.read_bytes()
+    index_mtime = os.stat(index).st_mtime_ns
+    signature, version, count = struct.unpack_from(">4sII", data)
+    if signature != b"DIRC" or version not in (2, 3):
+        raise UnsupportedRepository(f"index version {version}")
+
+    entries = []
+    offset = 12
+    for _ in range(count):
+        start = offset
+        fields = _INDEX_ENTRY.unpack_from(data, offset)
+        mtime = fields[2] * 10**9 + fields[3]
+        mode, size, object_id, flags = fields[6], fields[9], fields[10], fields[11]
+        offset += _INDEX_ENTRY.size
+        extended_flags = 0
+        if flags & _EXTENDED:
+            (extended_flags,) = struct.unpack_from(">H", data, offset)
+            offset += 2
+        end = data.index(b"\0", offset)
+        name = data[offset:end].decode("utf-8", "surrogateescape")
+        # entries are padded with 1 to 8 NUL bytes to a multiple of 8 bytes
+        offset = start + ((end - start) // 8 + 1) * 8
+
+        if mode == _GITLINK or flags & _ASSUME_VALID or extended_flags & _SKIP_WORKTREE:
+            continue
+        stage = (flags >> 12) & 0x3
+        # files modified in the same timestamp as the index may be changed
+        # without changing their stat data
+        racy = mtime >= index_mtime
+        entries.append((name, stage, mode, size, mtime, object_id, racy))
+
+    while offset + 8 <= len(data) - 20:
+        extension, length = struct.unpack_from(">4sI", data, offset)
+        if extension == b"link":
+            raise UnsupportedRepository("split index")
+        offset += 8 + length
+    return tuple(entries)
+
+
+@functools.lru_cache(maxsize=None)
+def _is_dirty(work_tree: Path, git_dir: Path, relative_path: str) -> bool:
+    """True if a tracked file under a path differs from the git index"""
+    prefix = relative_path + "/"
+    changed = False
+    for name, stage, mode, size, mtime, object_id, racy in _index_entries(git_dir):
+        if relative_path and name != relative_path and not name.startswith(prefix):
+            continue
+        if stage != 0:
+            # unmerged
+            return True
+        path = work_tree / name
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return True
+        # only the executable bit of regular files is tracked
+        same_mode = mode & 0o170000 != 0o100000 or bool(mode & 0o100) == bool(st.st_mode & 0o100)
+        if st.st_mtime_ns == mtime and st.st_size & 0xFFFFFFFF == size and same_mode and not racy:
+            continue
+        if not same_mode or _blob_id(path, mode) != object_id:
+            changed = True
+            break
+    if not changed:
+        return False
+    # Confirm with git, as clean and smudge filters change file contents
+    return _git_is_dirty(work_tree, relative_path)
+
+
+def _blob_id(path: Path, mode: int) -> bytes:
+    """Object id of the contents of a file"""
+    if mode & 0o170000 == _SYMLINK:
+        content = os.fsencode(os.readlink(path))
+    else:
+        content = path.read_bytes()
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).digest()
+
+
+@functools.lru_cache(maxsize=None)
+def _git_head_commit(work_tree: Path) -> Optional[str]:
+    result = subprocess.run(
+        ["git", "-C", work_tree, "rev-parse", "--verify", "-q", "HEAD"],
+        capture_output=True,
+    )
+    return result.stdout.strip().decode("utf-8") or None
+
+
+@functools.lru_cache(maxsize=None)
+def _git_is_dirty(work_tree: Path, relative_path: str) -> bool:
+    result = subprocess.run(
+        ["git", "-C", work_tree, "diff", "--quiet", "--", relative_path or "."],
+        capture_output=True,
+    )
+    if result.returncode > 1:
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stderr)
+    return result.returncode == 1
@@ -0,0 +1,99 @@
+"""
+Rolling window statistics on numpy arrays
+"""
+import bottleneck as bn
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "rolling_median",
+    "rolling_median_time",
+]
+
+
+def rolling_median(values, window: int, min_periods: int | None = None) -> np.ndarray:
+    """
+    Trailing rolling median along the first axis of an array.
+
+    The median is computed with the double heap moving median from bottleneck,
+    i.e. in O(n log(window)), and several columns can be processed in one call.
+    The output is identical to ``pandas.DataFrame.rolling(window,
+    min_periods).median()``: NaN values are skipped and the median is NaN
+    where fewer than min_periods valid values are found in the window.
+
+    Parameters
+    ----------
+    values : array-like
+        1-D or 2-D array. Windows are taken along the first axis.
+    window : int
+        Number of samples in the window, including the current sample.
+    min_periods : int, optional
+        Minimum number of valid values in a window. Defaults to window.
+
+    Returns
+    -------
+    numpy.ndarray
+        Rolling median with the same shape as values
+    """
+    values = np.asarray(values, dtype=float)
+    if min_periods is None:
+        min_periods = window
+    n = values.shape[0]
+    if n < window:
+        # the windows are trailing, so padding the end of the array does not
+        # affect the values computed for the original samples
+        padding = np.full((window - n,) + values.shape[1:], np.nan)
+        values = np.concatenate((values, padding))
+    return bn.move_median(values, window, min_count=min_periods, axis=0)[:n]
+
+
+def rolling_median_time(
+    series: pd.Series, window, center: bool = False, min_periods: int = 1
+) -> pd.Series:
+    """
+    Time-based rolling median of a series, e.g. with window="14D".
+
+    Equivalent to ``series.rolling(window, center=center,
+    min_periods=min_periods).median()``. When the series is on a regular time
+    grid, the window is converted to a number of samples and computed with
+    rolling_median, otherwise pandas is used.
+
+    Parameters
+    ----------
+    series : pandas.Series
+        Series with a monotonic increasing DatetimeIndex
+    window : str or pandas.Timedelta
+        Duration of the window
+    center : bool
+        If True, the window is centred on each sample. Otherwise it ends on
+        each sample.
+    min_periods : int
+        Minimum number of valid values in a window. The default is 1.
+
+    Returns
+    -------
+    pandas.Series
+        Rolling median with the same index as series
+    """
+    window = pd.Timedelta(window)
+    step = np.diff(series.index.values)
+    if len(step) == 0 or not (step == step[0]).all() or step[0] <= np.timedelta64(0):
+        return series.rolling(window, center=center, min_periods=min_periods).median()
+
+    # pandas includes the samples at t_i - w < t <= t_i, or
+    # t_i - w/2 < t <= t_i + w/2 for centred windows
+    ratio = window / pd.Timedelta(step[0])
+    if center:
+        after = int(np.floor(ratio / 2))
+        before = -int(np.floor(-ratio / 2)) - 1
+    else:
+        after = 0
+        before = int(np.ceil(ratio)) - 1
+    size = before + after + 1
+
+    values = np.asarray(series.values, dtype=float)
+    if min_periods > size:
+        return pd.Series(np.nan, index=series.index, name=series.name)
+    padded = np.concatenate((values, np.full(after, np.nan)))
+    median = rolling_median(padded, size, min_periods=min_periods)
+    return pd.Series(median[after:], index=series.index, name=series.name)
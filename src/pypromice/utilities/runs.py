@@ -0,0 +1,29 @@
+"""
+Run-length encoding of boolean arrays
+"""
+import numpy as np
+
+__all__ = [
+    "find_runs",
+]
+
+
+def find_runs(mask) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Positions of the periods of consecutive True values in a boolean array.
+
+    Parameters
+    ----------
+    mask : array-like
+        1-D boolean array
+
+    Returns
+    -------
+    starts : numpy.ndarray
+        Position of the first element of each run
+    ends : numpy.ndarray
+        Position of the last element (inclusive) of each run
+    """
+    mask = np.asarray(mask, dtype=bool)
+    idx = np.flatnonzero(np.diff(np.r_[False, mask, False])).reshape(-1, 2)
+    return idx[:, 0], idx[:, 1] - 1
@@ -0,0 +1,46 @@
+"""
+Reductions over consecutive segments of arrays
+"""
+import numpy as np
+
+__all__ = [
+    "segment_sum",
+]
+
+
+def segment_sum(values, starts, axis: int = 0, dtype=None) -> np.ndarray:
+    """
+    Sums of values along an axis, over the segments starting at the
+    positions starts. Empty segments sum to 0.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Array to sum
+    starts : array-like
+        Increasing positions of the first element of each segment. Each
+        segment ends at the start of the next one.
+    axis : int
+        Axis along which the segments are defined. The default is 0.
+    dtype : numpy.dtype, optional
+        Type of the sums. The default is the type of values.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sum of each segment, with one element per segment along axis
+    """
+    values = np.asarray(values)
+    starts = np.asarray(starts, dtype=int)
+    axis = axis % values.ndim
+    n = values.shape[axis]
+    if n == 0:
+        shape = list(values.shape)
+        shape[axis] = len(starts)
+        return np.zeros(shape, dtype=dtype or values.dtype)
+    empty = np.r_[starts[1:], n] <= starts
+    sums = np.add.reduceat(values, np.minimum(starts, n - 1), axis=axis, dtype=dtype)
+    index = [slice(None)] * values.ndim
+    index[axis] = empty
+    sums[tuple(index)] = 0
+    return sums
@@ -0,0 +1,61 @@
+"""
+Benchmark of writeCSV against rounding the dataset with roundValues and
+writing it with pandas.DataFrame.to_csv, on a year of 10-minute L2-like data.
+
+Usage: python tests/benchmarks/benchmark_write_csv.py
+"""
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import pypromice.resources
+from pypromice.process.write import roundValues, writeCSV
+
+
+def make_dataset(vars_df, n=52560, seed=0):
+    rng = np.random.default_rng(seed)
+    names = [v for v in vars_df.index if v != "time"]
+    ds = xr.Dataset(
+        {v: ("time", rng.normal(0, 100, n)) for v in names},
+        coords={"time": pd.date_range("2023-01-01", periods=n, freq="10min")},
+    )
+    for v in names[::5]:
+        ds[v][rng.random(n) < 0.3] = np.nan
+    return ds, names
+
+
+def write_pandas(outfile, ds, names, vars_df):
+    ds = roundValues(ds.copy(), vars_df)
+    df = ds.to_dataframe().dropna(how="all")
+    df[names].to_csv(outfile)
+
+
+def main():
+    vars_df = pypromice.resources.load_variables()
+    ds, names = make_dataset(vars_df)
+    print(f"{ds.sizes['time']} rows, {len(names)} variables")
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        root = Path(tmpdirname)
+        runs = [
+            ("roundValues + to_csv", "pandas.csv",
+             lambda p: write_pandas(p, ds, names, vars_df)),
+            ("writeCSV", "fast.csv",
+             lambda p: writeCSV(p, ds, names, vars_df=vars_df)),
+            ("writeCSV gzip", "fast.csv.gz",
+             lambda p: writeCSV(p, ds, names, vars_df=vars_df)),
+        ]
+        for label, filename, write in runs:
+            path = root / filename
+            start = time.perf_counter()
+            write(path)
+            duration = time.perf_counter() - start
+            size = path.stat().st_size / 2**20
+            print(f"{label:<22}{duration:8.2f} s{size:10.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
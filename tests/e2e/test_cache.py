@@ -0,0 +1,122 @@
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+import xarray as xr
+
+import pypromice.resources
+from pypromice.process.cache import StageCache
+from pypromice.process.get_l2 import get_l2
+from pypromice.process.get_l2tol3 import get_l2tol3
+
+TEST_ROOT = Path(__file__).parent.parent
+TEST_DATA_ROOT_PATH = TEST_ROOT / "data"
+STATION_CONFIGURATIONS_ROOT = TEST_DATA_ROOT_PATH / "station_configurations"
+CONFIG_FILE = TEST_DATA_ROOT_PATH / "test_config1_raw.toml"
+
+
+class StageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        self.cache_dir = self.root / "cache"
+        # data issues repository that can be modified by the tests
+        self.data_issues_path = self.root / "data_issues"
+        (self.data_issues_path / "flags").mkdir(parents=True)
+        (self.data_issues_path / "adjustments").mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _get_l2(self, outpath, cache_dir=None, vars_df=None):
+        return get_l2(
+            config_file=CONFIG_FILE.as_posix(),
+            inpath=TEST_DATA_ROOT_PATH.as_posix(),
+            outpath=outpath,
+            data_issues_path=self.data_issues_path,
+            variables=None,
+            metadata=None,
+            cache_dir=cache_dir,
+            explain_cache=True,
+            vars_df=vars_df,
+        )
+
+    def test_cached_l2_identical(self):
+        self._get_l2(self.root / "no_cache")
+        self._get_l2(self.root / "first", self.cache_dir)
+        with self.assertLogs("pypromice.process.cache", level=logging.INFO) as logs:
+            aws = self._get_l2(self.root / "second", self.cache_dir)
+        self.assertIn("Using cached L2 of TEST1", "\n".join(logs.output))
+        # the L0 files are not loaded when the L2 dataset is cached
+        self.assertIsNone(aws.L0)
+
+        for name in ["TEST1_hour.csv", "TEST1_10min.csv"]:
+            expected = pd.read_csv(self.root / "no_cache" / "TEST1" / name)
+            for run in ["first", "second"]:
+                output = pd.read_csv(self.root / run / "TEST1" / name)
+                pd.testing.assert_frame_equal(expected, output)
+
+    def test_explain_flags_change(self):
+        self._get_l2(None, self.cache_dir)
+        (self.data_issues_path / "flags" / "TEST1.csv").write_text(
+            "t0,t1,variable,flag,comment,URL_graphic\n"
+            "2023-01-01T00:00:00,2023-01-02T00:00:00,t_u,CHECKME,test,\n"
+        )
+        with self.assertLogs("pypromice.process.cache", level=logging.INFO) as logs:
+            self._get_l2(None, self.cache_dir)
+        output = "\n".join(logs.output)
+        self.assertIn("Using cached L1 of TEST1", output)
+        self.assertIn("Cache miss for L2 of TEST1: flags changed", output)
+
+    def test_explain_variables_table_change(self):
+        self._get_l2(None, self.cache_dir)
+        vars_df = pypromice.resources.load_variables()
+        vars_df.loc["t_u", "hi"] = 30
+        with self.assertLogs("pypromice.process.cache", level=logging.INFO) as logs:
+            self._get_l2(None, self.cache_dir, vars_df=vars_df)
+        self.assertIn("Cache miss for L1 of TEST1: variables changed",
+                      "\n".join(logs.output))
+
+    def test_only_latest_output_kept(self):
+        cache = StageCache(self.cache_dir)
+        ds = xr.Dataset({"t_u": ("time", [1.0, 2.0])})
+        first = cache.put("L2", "TEST1", {"flags": "a"}, ds)
+        cache.put("L2", "TEST2", {"flags": "a"}, ds)
+        second = cache.put("L2", "TEST1", {"flags": "b"}, ds + 1)
+        self.assertEqual(
+            [f"{second}.pkl", "latest.json"],
+            sorted(p.name for p in (self.cache_dir / "L2" / "TEST1").iterdir()),
+        )
+        self.assertNotEqual(first, second)
+        self.assertIsNone(cache.get("L2", "TEST1", {"flags": "a"}))
+        xr.testing.assert_identical(ds + 1, cache.get("L2", "TEST1", {"flags": "b"}))
+        xr.testing.assert_identical(ds, cache.get("L2", "TEST2", {"flags": "a"}))
+
+    def test_explain_missing(self):
+        cache = StageCache(self.cache_dir)
+        self.assertEqual(["no cached output"], cache.explain("L2", "TEST1", {}))
+
+    def test_cached_l3(self):
+        self._get_l2(self.root / "l2")
+        l2_file = self.root / "l2" / "TEST1" / "TEST1_hour.nc"
+        kwargs = dict(
+            config_folder=STATION_CONFIGURATIONS_ROOT,
+            inpath=l2_file.as_posix(),
+            variables=None,
+            metadata=None,
+            data_issues_path=self.data_issues_path,
+        )
+        get_l2tol3(outpath=(self.root / "l3_no_cache").as_posix(), **kwargs)
+        for run in ["first", "second"]:
+            get_l2tol3(
+                outpath=(self.root / f"l3_{run}").as_posix(),
+                cache_dir=self.cache_dir,
+                **kwargs,
+            )
+        for name in ["TEST1_hour.csv", "TEST1_day.csv", "TEST1_month.csv"]:
+            expected = pd.read_csv(self.root / "l3_no_cache" / "TEST1" / name)
+            for run in ["first", "second"]:
+                output = pd.read_csv(self.root / f"l3_{run}" / "TEST1" / name)
+                pd.testing.assert_frame_equal(expected, output)
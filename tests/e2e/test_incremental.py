@@ -0,0 +1,245 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import toml
+import xarray as xr
+
+from pypromice.process.L2toL3 import toL3
+from pypromice.process.get_l2 import get_l2
+from pypromice.process.get_l2tol3 import get_l2tol3
+from pypromice.process.incremental import (
+    L3State,
+    load_l3_state,
+    save_l3_state,
+    toL3_incremental,
+)
+
+TEST_ROOT = Path(__file__).parent.parent
+TEST_DATA_ROOT_PATH = TEST_ROOT / "data"
+STATION_CONFIGURATIONS_ROOT = TEST_DATA_ROOT_PATH / "station_configurations"
+DATA_ISSUES_PATH = TEST_DATA_ROOT_PATH / "data_issues"
+
+
+class IncrementalL3TestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.root = Path(cls.tmpdir.name)
+        get_l2(
+            config_file=(TEST_DATA_ROOT_PATH / "test_config1_raw.toml").as_posix(),
+            inpath=TEST_DATA_ROOT_PATH.as_posix(),
+            outpath=cls.root / "l2",
+            data_issues_path=DATA_ISSUES_PATH,
+            variables=None,
+            metadata=None,
+        )
+        cls.l2_path = cls.root / "l2" / "TEST1" / "TEST1_hour.nc"
+        with xr.open_dataset(cls.l2_path) as l2:
+            l2.load()
+        for varname in l2.variables:
+            l2[varname].encoding = {}
+        l2.attrs["bedrock"] = l2.attrs["bedrock"] == "True"
+        l2.attrs["number_of_booms"] = int(l2.attrs["number_of_booms"])
+        cls.l2 = l2
+        cls.station_config = toml.load(STATION_CONFIGURATIONS_ROOT / "TEST1.toml")
+        cls.adj_dir = DATA_ISSUES_PATH / "adjustments"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def _next(self, end, step="1D"):
+        # L2 data up to one step after end, as received by the next run
+        return self.l2.sel(time=slice(None, pd.Timestamp(end) + pd.Timedelta(step)))
+
+    def _assert_matches_full(self, l3, l2):
+        full = toL3(l2.copy(deep=True), self.adj_dir, self.station_config)
+        np.testing.assert_array_equal(l3.time.values, full.time.values)
+        self.assertEqual(set(l3.data_vars), set(full.data_vars))
+        for var in full.data_vars:
+            if full[var].dtype.kind != "f":
+                continue
+            # same missing values, and the same values up to rounding
+            np.testing.assert_array_equal(
+                np.isnan(l3[var].values), np.isnan(full[var].values), err_msg=var
+            )
+            np.testing.assert_allclose(
+                l3[var].values, full[var].values, rtol=0, atol=1e-9, err_msg=var
+            )
+
+    def test_incremental_matches_full(self):
+        time = self.l2.time.values
+        cuts = [time[int(f * len(time))] for f in (0.25, 0.5, 0.8)]
+        # before the end of the gap in the surface height data
+        cuts.append(np.datetime64("2019-05-20"))
+        for cut in cuts:
+            with self.subTest(cut=cut):
+                l3, state = toL3_incremental(
+                    self.l2.sel(time=slice(None, cut)), self.adj_dir, self.station_config
+                )
+                end = cut
+                n_incremental = 0
+                for _ in range(3):
+                    l2 = self._next(end)
+                    end = l2.time.values[-1]
+                    with tempfile.TemporaryDirectory() as tmpdirname:
+                        save_l3_state(tmpdirname, l3, state)
+                        l3, state = load_l3_state(tmpdirname, "TEST1")
+                    with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+                        l3, state = toL3_incremental(
+                            l2, self.adj_dir, self.station_config, l3, state
+                        )
+                    n_incremental += "Incremental L3 processing" in logs.output[0]
+                    self.assertEqual(pd.Timestamp(state.last_time), pd.Timestamp(end))
+                    self._assert_matches_full(l3, l2)
+                self.assertGreater(n_incremental, 0)
+
+    def test_full_recompute_in_ablation_season(self):
+        cut = np.datetime64("2018-05-28")
+        l3, state = toL3_incremental(
+            self.l2.sel(time=slice(None, cut)), self.adj_dir, self.station_config
+        )
+        with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+            toL3_incremental(self._next(cut), self.adj_dir, self.station_config, l3, state)
+        self.assertIn("Incremental L3 processing", logs.output[0])
+        # the smoothed surface heights reach June
+        with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+            toL3_incremental(
+                self._next(cut, "5D"), self.adj_dir, self.station_config, l3, state
+            )
+        self.assertIn("Full L3 processing of TEST1: ablation season", logs.output[0])
+
+    def test_full_recompute_after_max_age(self):
+        cut = self.l2.time.values[len(self.l2.time) // 2]
+        l3, state = toL3_incremental(
+            self.l2.sel(time=slice(None, cut)), self.adj_dir, self.station_config
+        )
+        with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+            l3, state = toL3_incremental(
+                self._next(cut, "3D"), self.adj_dir, self.station_config, l3, state,
+                max_age="5D",
+            )
+        self.assertIn("Incremental L3 processing", logs.output[0])
+        with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+            l3, state = toL3_incremental(
+                self._next(cut, "6D"), self.adj_dir, self.station_config, l3, state,
+                max_age="5D",
+            )
+        self.assertIn("more than 5D since the last full processing", logs.output[0])
+        self.assertEqual(state.full_time, state.last_time)
+
+    def test_no_new_data(self):
+        l3, state = toL3_incremental(self.l2, self.adj_dir, self.station_config)
+        l3_again, state_again = toL3_incremental(
+            self.l2, self.adj_dir, self.station_config, l3, state
+        )
+        self.assertIs(l3_again, l3)
+        self.assertEqual(state_again, state)
+
+    def test_full_recompute_when_fingerprint_changes(self):
+        cut = self.l2.time.values[len(self.l2.time) // 2]
+        l3, state = toL3_incremental(
+            self.l2.sel(time=slice(None, cut)), self.adj_dir, self.station_config
+        )
+        state = L3State(**{**state.as_dict(), "fingerprint": "outdated"})
+        with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+            l3, state = toL3_incremental(
+                self.l2, self.adj_dir, self.station_config, l3, state
+            )
+        self.assertIn("Full L3 processing", logs.output[0])
+        full = toL3(self.l2.copy(deep=True), self.adj_dir, self.station_config)
+        np.testing.assert_array_equal(l3.z_surf_combined.values, full.z_surf_combined.values)
+        self.assertNotEqual(state.fingerprint, "outdated")
+
+    def test_full_recompute_when_flags_change(self):
+        cut = self.l2.time.values[len(self.l2.time) // 2]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            adj_dir = Path(tmpdirname) / "adjustments"
+            l3, state = toL3_incremental(
+                self.l2.sel(time=slice(None, cut)), adj_dir, self.station_config
+            )
+            flags_file = Path(tmpdirname) / "flags" / "TEST1.csv"
+            flags_file.parent.mkdir()
+            flags_file.write_text("t0,t1,variable,flag,comment,URL_graphic\n")
+            with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+                toL3_incremental(self.l2, adj_dir, self.station_config, l3, state)
+        self.assertIn("Full L3 processing", logs.output[0])
+
+    def test_full_recompute_when_past_l2_changes(self):
+        cut = self.l2.time.values[len(self.l2.time) // 2]
+        l3, state = toL3_incremental(
+            self.l2.sel(time=slice(None, cut)), self.adj_dir, self.station_config
+        )
+        with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+            unchanged, _ = toL3_incremental(
+                self._next(cut), self.adj_dir, self.station_config, l3, state
+            )
+        self.assertIn("Incremental L3 processing", logs.output[0])
+
+        # a past value flagged when redoing the L2 processing
+        l2 = self._next(cut).copy(deep=True)
+        l2["z_boom_u"][100:200] = np.nan
+        with self.assertLogs("pypromice.process.incremental", "INFO") as logs:
+            l3, state = toL3_incremental(l2, self.adj_dir, self.station_config, l3, state)
+        self.assertIn("L2 data changed", logs.output[0])
+        full = toL3(l2.copy(deep=True), self.adj_dir, self.station_config)
+        np.testing.assert_array_equal(l3.z_surf_combined.values, full.z_surf_combined.values)
+        self.assertFalse(np.array_equal(
+            l3.z_surf_combined.values, unchanged.z_surf_combined.values, equal_nan=True
+        ))
+
+    def test_save_l3_state_writes_changed_years(self):
+        cut = self.l2.time.values[len(self.l2.time) // 2]
+        l3, state = toL3_incremental(
+            self.l2.sel(time=slice(None, cut)), self.adj_dir, self.station_config
+        )
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            folder = Path(tmpdirname) / "TEST1"
+            save_l3_state(tmpdirname, l3, state)
+            mtimes = {p.name: p.stat().st_mtime_ns for p in folder.glob("*.nc")}
+            self.assertGreater(len(mtimes), 2)
+
+            l3, state = toL3_incremental(
+                self._next(cut), self.adj_dir, self.station_config, l3, state
+            )
+            save_l3_state(tmpdirname, l3, state)
+            changed = [p.name for p in folder.glob("*.nc")
+                       if mtimes.get(p.name) != p.stat().st_mtime_ns]
+            self.assertEqual(sorted(changed), ["TEST1_L3_2018.nc"])
+
+            loaded, loaded_state = load_l3_state(tmpdirname, "TEST1")
+        self.assertEqual(loaded_state, state)
+        xr.testing.assert_identical(loaded, l3)
+
+    def test_get_l2tol3_incremental(self):
+        outpath = self.root / "l3"
+        state_dir = self.root / "state"
+        for _ in range(2):
+            get_l2tol3(
+                config_folder=STATION_CONFIGURATIONS_ROOT,
+                inpath=self.l2_path.as_posix(),
+                outpath=outpath.as_posix(),
+                variables=None,
+                metadata=None,
+                data_issues_path=DATA_ISSUES_PATH,
+                incremental=True,
+                state_dir=state_dir,
+            )
+        self.assertTrue((state_dir / "TEST1" / "TEST1_L3_state.json").exists())
+        self.assertTrue((outpath / "TEST1" / "TEST1_hour.nc").exists())
+        # the state is not part of the products
+        self.assertEqual(list(outpath.rglob("*state*")), [])
+
+        with self.assertRaises(ValueError):
+            get_l2tol3(
+                config_folder=STATION_CONFIGURATIONS_ROOT,
+                inpath=self.l2_path.as_posix(),
+                outpath=outpath.as_posix(),
+                variables=None,
+                metadata=None,
+                data_issues_path=DATA_ISSUES_PATH,
+                incremental=True,
+            )
@@ -18,7 +18,7 @@ from pypromice.process.get_l2 import get_l2
 from pypromice.process.get_l2tol3 import get_l2tol3
 from pypromice.process.join_l2 import join_l2
 from pypromice.process.join_l3 import join_l3
-from pypromice.process.write import addVars, addMeta
+from pypromice.process.write import addVars, addMeta, prepare_and_write, write_products
 
 TEST_ROOT = Path(__file__).parent.parent
 TEST_DATA_ROOT_PATH = TEST_ROOT / "data"
@@ -62,6 +62,36 @@ class TestProcess(unittest.TestCase):
         self.assertTrue(d.attrs["station_id"] == "TEST")
         self.assertIsInstance(d.attrs["references"], str)
 
+    def test_write_products(self):
+        """Test writing several products at once against single writes"""
+        pAWS = AWS(
+            TEST_CONFIG_PATH.as_posix(),
+            TEST_DATA_ROOT_PATH.as_posix(),
+            data_issues_repository=TEST_DATA_ROOT_PATH / "data_issues",
+            var_file=None,
+            meta_file=None,
+        )
+        pAWS.process()
+        frequencies = ["60min", "1D", "M"]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = Path(tmpdirname)
+            write_products(pAWS.L2, root / "products", frequencies, max_workers=3)
+            for t in frequencies:
+                prepare_and_write(pAWS.L2, root / "single", time=t)
+            attrs = {}
+            for suffix in ["hour", "day", "month"]:
+                name = f"TEST1/TEST1_{suffix}"
+                pd.testing.assert_frame_equal(
+                    pd.read_csv(root / "single" / f"{name}.csv"),
+                    pd.read_csv(root / "products" / f"{name}.csv"),
+                )
+                with xr.open_dataset(root / "products" / f"{name}.nc") as ds:
+                    attrs[suffix] = ds.attrs
+            # coordinates and bounds are shared by all products
+            for key in ["geospatial_bounds", "latitude", "longitude"]:
+                self.assertEqual(attrs["hour"][key], attrs["day"][key])
+                self.assertEqual(attrs["hour"][key], attrs["month"][key])
+
     def test_l0_to_l3(self):
         """Test L0 to L3 processing"""
         pAWS = AWS(
@@ -207,11 +237,9 @@ class TestProcess(unittest.TestCase):
                     output_dataset = xr.load_dataset(output_path)
                     self.check_global_attributes(output_dataset, output_rel_path)
 
-                    # Check if the l3 datasets are compressed
-                    if output_path.parent.parent.name == 'site_l3':
-                        self.assertEqual(output_dataset['p_u'].encoding["zlib"], True, output_rel_path)
-                    else:
-                        self.assertEqual(output_dataset['p_u'].encoding["zlib"], False, output_rel_path)
+                    # Check if the datasets are packed and compressed
+                    self.assertEqual(output_dataset['p_u'].encoding["zlib"], True, output_rel_path)
+                    self.assertEqual(output_dataset['p_u'].encoding["dtype"], "int32", output_rel_path)
 
             # Test if the l3 output netcdf files are compressed with zlib
             for output_rel_path in [
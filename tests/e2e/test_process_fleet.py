@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from pypromice.process.join_l3 import load_station_configs
+from pypromice.process.process_fleet import (
+    build_fleet_graph,
+    build_fleet_tasks,
+    get_affected_tasks,
+    process_fleet,
+)
+
+TEST_ROOT = Path(__file__).parent.parent
+TEST_DATA_ROOT_PATH = TEST_ROOT / "data"
+STATION_CONFIGURATIONS_ROOT = TEST_DATA_ROOT_PATH / "station_configurations"
+
+
+class ProcessFleetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        self.config_folder = self.root / "config"
+        self.config_folder.mkdir()
+        shutil.copy(
+            TEST_DATA_ROOT_PATH / "test_config1_raw.toml",
+            self.config_folder / "TEST1.toml",
+        )
+        # station without L0 file
+        (self.config_folder / "TEST2.toml").write_text("station_id = 'TEST2'\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _process_fleet(self, **kwargs):
+        return process_fleet(
+            self.config_folder,
+            TEST_DATA_ROOT_PATH,
+            STATION_CONFIGURATIONS_ROOT,
+            data_issues_path=self.root / "data_issues",
+            outpath_l2=self.root / "l2",
+            outpath_l3=self.root / "l3",
+            folder_gcnet=self.root / "gc_net",
+            outpath_sites=self.root / "sites",
+            workers=2,
+            **kwargs,
+        )
+
+    def test_build_fleet_graph(self):
+        station_configs = load_station_configs(STATION_CONFIGURATIONS_ROOT)
+        tasks = build_fleet_tasks(
+            self.config_folder,
+            TEST_DATA_ROOT_PATH,
+            STATION_CONFIGURATIONS_ROOT,
+            station_configs=station_configs,
+        )
+        graph = build_fleet_graph(tasks, station_configs)
+        self.assertListEqual(
+            ["site:SITE_01", "site:TEST2", "station:TEST1", "station:TEST2"],
+            sorted(tasks),
+        )
+        self.assertGreater(tasks["station:TEST1"].memory, 0)
+        self.assertEqual(0, tasks["station:TEST2"].memory)
+        self.assertEqual(
+            {"station:TEST1": {"site:SITE_01"}, "station:TEST2": {"site:TEST2"}},
+            {k: v for k, v in graph.child_mapping().items() if v},
+        )
+        self.assertEqual(
+            {"station:TEST1", "site:SITE_01"},
+            get_affected_tasks(graph, {"station:TEST1"}),
+        )
+        order = graph.topological_sort()
+        self.assertLess(order.index("station:TEST1"), order.index("site:SITE_01"))
+
+    def test_process_fleet(self):
+        summary_file = self.root / "summary.csv"
+        summary = self._process_fleet(memory_budget=1, summary_file=summary_file)
+        status = summary.set_index(["kind", "name"]).status
+        self.assertEqual("success", status["station", "TEST1"])
+        self.assertEqual("success", status["site", "SITE_01"])
+        self.assertEqual("failed", status["station", "TEST2"])
+        self.assertEqual("skipped", status["site", "TEST2"])
+        columns = ["name", "kind", "status"]
+        pd.testing.assert_frame_equal(
+            summary[columns], pd.read_csv(summary_file)[columns]
+        )
+        for path in [
+            "l2/TEST1/TEST1_hour.nc",
+            "l3/TEST1/TEST1_day.nc",
+            "sites/SITE_01/SITE_01_month.csv",
+        ]:
+            self.assertTrue((self.root / path).exists(), path)
+
+    def test_only_changed(self):
+        self._process_fleet()
+        summary = self._process_fleet(only_changed=True)
+        status = summary.set_index(["kind", "name"]).status
+        self.assertEqual("unchanged", status["station", "TEST1"])
+        self.assertEqual("unchanged", status["site", "SITE_01"])
+        # failed tasks are run again
+        self.assertEqual("failed", status["station", "TEST2"])
+
+        (self.root / "data_issues" / "flags").mkdir(parents=True)
+        (self.root / "data_issues" / "flags" / "TEST1.csv").write_text(
+            "t0,t1,variable,flag,comment,URL_graphic\n"
+        )
+        summary = self._process_fleet(only_changed=True)
+        status = summary.set_index(["kind", "name"]).status
+        self.assertEqual("success", status["station", "TEST1"])
+        self.assertEqual("success", status["site", "SITE_01"])
+
+    def test_process_fleet_cli(self):
+        exit_status = os.system("process_fleet -h")
+        self.assertEqual(exit_status, 0)
@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pypromice.qc.hampel import hampel_filter
+
+
+def _reference_hampel(vals, k, t0):
+    # Original pandas implementation used in L2toL3 and github_data_issues
+    vals = vals.copy()
+    L = 1.4826
+    rolling_median = vals.rolling(k).median()
+    difference = np.abs(rolling_median - vals)
+    median_abs_deviation = difference.rolling(k).median()
+    threshold = t0 * L * median_abs_deviation
+    outlier_idx = difference > threshold
+    outlier_idx[0:round(k / 2)] = False
+    vals.loc[outlier_idx] = np.nan
+    return vals
+
+
+class HampelFilterTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        n = 24 * 60
+        data = np.cumsum(rng.normal(0, 0.01, (n, 2)), axis=0)
+        spikes = rng.integers(0, n, 40)
+        data[spikes, 0] += rng.normal(0, 2, 40)
+        data[spikes[::-1], 1] -= rng.normal(0, 2, 40)
+        data[100:130, 0] = np.nan
+        data[500:900, 1] = np.nan
+        self.df = pd.DataFrame(
+            data,
+            columns=["a", "b"],
+            index=pd.date_range("2023-01-01", periods=n, freq="h"),
+        )
+
+    def test_matches_pandas_implementation(self):
+        for k, t0 in [(7 * 24, 15), (24, 5), (7 * 24, 3)]:
+            for col in self.df.columns:
+                expected = _reference_hampel(self.df[col], k, t0)
+                output = hampel_filter(self.df[col].values, k=k, t0=t0)
+                np.testing.assert_array_equal(expected.values, output)
+
+    def test_multiple_columns(self):
+        output = hampel_filter(self.df.values, k=24, t0=5)
+        for i, col in enumerate(self.df.columns):
+            expected = hampel_filter(self.df[col].values, k=24, t0=5)
+            np.testing.assert_array_equal(expected, output[:, i])
+
+    def test_outliers_removed(self):
+        output = hampel_filter(self.df.values, k=24, t0=5)
+        self.assertGreater(np.isnan(output).sum(), np.isnan(self.df.values).sum())
+
+    def test_first_half_window_not_flagged(self):
+        values = np.zeros(96)
+        values[5] = 100.0
+        values[60] = 100.0
+        output = hampel_filter(values, k=24, t0=5)
+        self.assertEqual(output[5], 100.0)
+        self.assertTrue(np.isnan(output[60]))
+
+    def test_series_shorter_than_window(self):
+        values = np.arange(10, dtype=float)
+        output = hampel_filter(values, k=24, t0=5)
+        np.testing.assert_array_equal(values, output)
+
+    def test_input_not_modified(self):
+        values = self.df.values.copy()
+        hampel_filter(values, k=24, t0=5)
+        np.testing.assert_array_equal(values, self.df.values)
@@ -1,10 +1,17 @@
+import json
 import unittest
 
 import numpy as np
 import pandas as pd
+import xarray as xr
 
 from pypromice.qc import persistence
-from pypromice.qc.persistence import find_persistent_regions
+from pypromice.qc.persistence import (
+    PersistenceState,
+    find_persistent_regions,
+    persistence_qc,
+    persistence_qc_incremental,
+)
 
 
 class PersistenceQATestCase(unittest.TestCase):
@@ -192,5 +199,77 @@ class PersistenceQATestCase(unittest.TestCase):
         )
 
 
+class PersistenceQCTestCase(unittest.TestCase):
+    def setUp(self):
+        time = pd.date_range("2023-01-01", periods=200, freq="10min")
+        rng = np.random.default_rng(2)
+        data = {v: rng.normal(0, 1, len(time)) for v in ["t_u", "rh_u", "gps_lat", "gps_lon"]}
+        self.ds = xr.Dataset(
+            {v: ("time", x, {"units": "test"}) for v, x in data.items()},
+            coords={"time": time},
+            attrs={"station_id": "TEST"},
+        )
+        # 3 hours persistent
+        self.ds["t_u"][10:29] = 1.0
+        # 100% relative humidity is allowed
+        self.ds["rh_u"][10:29] = 100.0
+        self.ds["rh_u"][50:69] = 80.0
+        # only gps_lat is persistent
+        self.ds["gps_lat"][10:60] = 70.0
+        self.ds["gps_lon"][100:160] = -40.0
+        self.ds["gps_lat"][100:160] = 70.0
+
+    def test_persistence_qc(self):
+        ds = persistence_qc(self.ds)
+        expected = np.zeros(200, dtype=bool)
+        expected[23:29] = True
+        np.testing.assert_array_equal(expected, ds.t_u.isnull().values)
+        expected = np.zeros(200, dtype=bool)
+        expected[63:69] = True
+        np.testing.assert_array_equal(expected, ds.rh_u.isnull().values)
+        expected = np.zeros(200, dtype=bool)
+        expected[136:160] = True
+        np.testing.assert_array_equal(expected, ds.gps_lat.isnull().values)
+        np.testing.assert_array_equal(expected, ds.gps_lon.isnull().values)
+        # the input dataset is not modified
+        self.assertFalse(self.ds.t_u.isnull().any())
+        self.assertEqual(self.ds.attrs, ds.attrs)
+        self.assertEqual({"units": "test"}, ds.t_u.attrs)
+
+    def test_same_as_series(self):
+        thresholds = {"t": {"max_diff": 0.5, "period": 0.5}, "t_u": {"max_diff": 0.0001, "period": 1}}
+        ds = persistence_qc(self.ds, thresholds)
+        # t_u is filtered a second time after the first filtering
+        t_u = self.ds.t_u.to_series()
+        t_u[find_persistent_regions(t_u, 0.5, 0.5)] = np.nan
+        t_u[find_persistent_regions(t_u, 1, 0.0001)] = np.nan
+        np.testing.assert_array_equal(t_u.values, ds.t_u.values)
+
+    def test_incremental(self):
+        self.ds["t_u"][40:60] = np.nan
+        self.ds["gps_lon"][150:] = np.nan
+        thresholds = {"t": {"max_diff": 0.5, "period": 0.5}, "t_u": {"max_diff": 0.0001, "period": 1},
+                      "rh_u": {"max_diff": 0.0001, "period": 2}, "gps_lat_lon": {"max_diff": 0.000001, "period": 6}}
+        for variable_thresholds in [None, thresholds]:
+            expected = persistence_qc(self.ds, variable_thresholds)
+            # runs of persistent values across the updates, and a run crossing
+            # the threshold in an update
+            state = None
+            parts = []
+            for end in [15, 16, 27, 45, 120, 200, 200]:
+                ds, state = persistence_qc_incremental(
+                    self.ds.isel(time=slice(0, end)), state, variable_thresholds
+                )
+                state = PersistenceState(**json.loads(json.dumps(state.as_dict())))
+                parts.append(ds)
+            self.assertEqual(0, parts[-1].sizes["time"])
+            xr.testing.assert_identical(expected, xr.concat(parts, dim="time"))
+        self.assertEqual(pd.Timestamp(state.last_time), pd.Timestamp(self.ds.time.values[-1]))
+        self.assertIsNone(state.run_start["t_u:1"])
+        self.assertIsNone(state.run_start["gps_lat"])
+        # missing values are forward filled, the run of gps_lon goes on
+        self.assertIsNotNone(state.run_start["gps_lon"])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,82 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from pypromice.process.encoding import chunk_length, plan_encoding
+from pypromice.process.write import writeNC
+
+
+class PlanEncodingTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        n = 3000
+        self.ds = xr.Dataset(
+            {
+                "t_u": ("time", rng.normal(-10, 5, n)),
+                "z_boom_u": ("time", rng.uniform(0.5, 3, n)),
+                "gps_alt": ("time", rng.normal(1000, 10, n)),
+                # values larger than the valid range
+                "dsr": ("time", np.full(n, 1e6)),
+                "gps_q": ("time", rng.integers(0, 3, n).astype(float)),
+                "gps_time": ("time", rng.normal(0, 1, n)),
+                "empty": ("time", np.full(n, np.nan)),
+            },
+            coords={"time": pd.date_range("2023-01-01", periods=n, freq="h")},
+        )
+        self.ds["t_u"][::4] = np.nan
+        self.vars_df = pd.DataFrame(
+            {
+                "max_decimals": [4, 2, 4, 4, np.nan, np.nan, 4],
+                "lo": [-80, 0.3, np.nan, -10, np.nan, np.nan, np.nan],
+                "hi": [40, 10, np.nan, 1500, np.nan, np.nan, np.nan],
+            },
+            index=list(self.ds.data_vars),
+        )
+
+    def test_dtypes(self):
+        encoding = plan_encoding(self.ds, vars_df=self.vars_df)
+        dtypes = {var: enc["dtype"] for var, enc in encoding.items()}
+        self.assertEqual(
+            {
+                "t_u": "int32",
+                "z_boom_u": "int16",
+                "gps_alt": "int32",
+                # too large to be packed, but exactly represented as float32
+                "dsr": "float32",
+                "gps_q": "float32",
+                "gps_time": "float64",
+                "empty": "int16",
+            },
+            dtypes,
+        )
+        self.assertEqual(0.01, encoding["z_boom_u"]["scale_factor"])
+        self.assertEqual(-32768, encoding["z_boom_u"]["_FillValue"])
+        self.assertEqual((3000,), encoding["t_u"]["chunksizes"])
+        self.assertTrue(encoding["t_u"]["shuffle"])
+
+        encoding = plan_encoding(self.ds, ["t_u"], compression=None)
+        self.assertListEqual(["t_u"], list(encoding))
+        self.assertEqual("float64", encoding["t_u"]["dtype"])
+        self.assertNotIn("zlib", encoding["t_u"])
+
+    def test_chunk_length(self):
+        self.assertEqual(8760, chunk_length(pd.date_range("2020", "2024", freq="h")))
+        self.assertEqual(512, chunk_length(pd.date_range("2000", "2024", freq="D")))
+        self.assertEqual(10, chunk_length(pd.date_range("2000", periods=10, freq="MS")))
+
+    def test_write_packed(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = Path(tmpdirname) / "packed.nc"
+            writeNC(path, self.ds, compression=True, vars_df=self.vars_df)
+            with xr.open_dataset(path) as ds:
+                self.assertEqual("int16", ds.z_boom_u.encoding["dtype"])
+                for var in self.ds.data_vars:
+                    decimals = self.vars_df.loc[var, "max_decimals"]
+                    atol = 1e-12 if np.isnan(decimals) else 10.0**-decimals / 2
+                    np.testing.assert_allclose(
+                        ds[var].values, self.ds[var].values, rtol=0, atol=atol, err_msg=var
+                    )
@@ -0,0 +1,76 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from pypromice.utilities.git import clear_cache, get_commit_hash_and_check_dirty
+
+
+class GitProvenanceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name) / "repo"
+        for name in ["config/A.toml", "config/B.toml", "issues/flags/A.csv", "README.md"]:
+            (self.root / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.root / name).write_text(f"{name}\n")
+        self.git("init", "-q")
+        self.git("add", ".")
+        self.git("commit", "-q", "-m", "Initial commit")
+        self.commit = self.git("rev-parse", "HEAD")
+        clear_cache()
+
+    def tearDown(self):
+        clear_cache()
+        self.tmpdir.cleanup()
+
+    def git(self, *args):
+        return subprocess.check_output(
+            ["git", "-C", self.root, "-c", "user.name=test", "-c", "user.email=test@test",
+             *args],
+            text=True,
+        ).strip()
+
+    def provenance(self, *names):
+        clear_cache()
+        return [get_commit_hash_and_check_dirty(self.root / name) for name in names]
+
+    def test_clean(self):
+        # the index is older than the files
+        os.utime(self.root / ".git" / "index", ns=(0, 0))
+        self.assertListEqual([self.commit] * 3, self.provenance("", "config", "config/A.toml"))
+        # an unchanged file with new stat data is clean
+        os.utime(self.root / "config" / "A.toml")
+        (self.root / "untracked.txt").write_text("untracked")
+        self.assertListEqual([self.commit] * 2, self.provenance("", "config/A.toml"))
+
+    def test_dirty_path(self):
+        (self.root / "config" / "A.toml").write_text("changed\n")
+        dirty = f"{self.commit} (dirty)"
+        self.assertListEqual(
+            [dirty, dirty, dirty, self.commit, self.commit],
+            self.provenance("", "config", "config/A.toml", "config/B.toml", "issues"),
+        )
+        (self.root / "issues" / "flags" / "A.csv").unlink()
+        self.assertListEqual([dirty], self.provenance("issues"))
+
+    def test_packed_refs_and_detached_head(self):
+        self.git("pack-refs", "--all")
+        self.assertListEqual([self.commit], self.provenance("config"))
+        self.git("checkout", "-q", "--detach")
+        self.assertListEqual([self.commit], self.provenance("config"))
+
+    def test_git_fallback(self):
+        # index format that is not read directly
+        self.git("update-index", "--index-version", "4")
+        (self.root / "config" / "A.toml").write_text("changed\n")
+        self.assertListEqual(
+            [f"{self.commit} (dirty)", self.commit], self.provenance("config", "issues")
+        )
+
+    def test_not_under_version_control(self):
+        self.assertEqual("unknown", get_commit_hash_and_check_dirty(self.tmpdir.name))
+        empty = Path(self.tmpdir.name) / "empty"
+        empty.mkdir()
+        subprocess.check_call(["git", "init", "-q", empty])
+        self.assertEqual("unknown", get_commit_hash_and_check_dirty(empty))
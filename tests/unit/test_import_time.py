@@ -0,0 +1,53 @@
+import subprocess
+import sys
+import unittest
+
+# Optional or heavy dependencies that are imported by the functions using them
+LAZY_DEPENDENCIES = ["sklearn", "scipy", "eccodes", "pyDataverse", "pkg_resources"]
+
+COMMAND_LINE_MODULES = [
+    "pypromice.process.get_l2",
+    "pypromice.process.get_l2tol3",
+    "pypromice.process.join_l2",
+    "pypromice.process.join_l3",
+    "pypromice.process.process_fleet",
+    "pypromice.postprocess.get_bufr",
+    "pypromice.postprocess.bufr_to_csv",
+    "pypromice.tx.get_l0tx",
+    "pypromice.get.get_promice_data",
+]
+
+
+def import_times(module):
+    """Cumulative import time in microseconds of each module imported by
+    module, from the output of python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+class ImportTimeTestCase(unittest.TestCase):
+    def test_lazy_dependencies(self):
+        for module in COMMAND_LINE_MODULES:
+            times = import_times(module)
+            self.assertIn(module, times)
+            for dependency in LAZY_DEPENDENCIES:
+                self.assertNotIn(dependency, times, f"{dependency} imported by {module}")
+
+    def test_lazy_packages(self):
+        times = import_times("pypromice.process")
+        self.assertNotIn("pypromice.process.aws", times)
+        self.assertNotIn("pandas", times)
+        times = import_times("pypromice.tx")
+        self.assertNotIn("pypromice.tx.tx", times)
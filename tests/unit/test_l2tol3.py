@@ -0,0 +1,280 @@
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import interp1d
+
+from pypromice.process.L2toL3 import (
+    combine_surface_height,
+    fill_short_gaps,
+    get_thermistor_depth,
+    interpolate_temperature,
+    piecewise_smoothing_and_interpolation,
+)
+
+
+TEST_DATA_ROOT_PATH = Path(__file__).parent.parent / "data"
+SURFACE_HEIGHT_OUTPUTS = ["z_surf_combined", "z_ice_surf_adj", "z_surf_1_adj", "z_surf_2_adj"]
+
+
+class InterpolateTemperatureTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n, m = 500, 12
+        self.dates = pd.date_range("2021-01-01", periods=n, freq="h").values
+        depth = np.sort(rng.uniform(0, 14, (n, m)), axis=1)
+        self.depth = np.round(depth, 1)
+        self.temp = rng.normal(-10, 1, (n, m))
+        self.depth[rng.random((n, m)) < 0.3] = np.nan
+        self.temp[rng.random((n, m)) < 0.2] = np.nan
+        # repeated depth with different temperatures
+        self.depth[3, 1] = self.depth[3, 0]
+        # less than two valid values
+        self.temp[4, 1:] = np.nan
+
+    def _expected(self, depth, min_diff_to_depth):
+        out = np.full(len(self.dates), np.nan)
+        for i in range(len(self.dates)):
+            x, y = self.depth[i], self.temp[i]
+            ind = ~np.isnan(x + y)
+            x, indices = np.unique(x[ind], return_index=True)
+            y = y[ind][indices]
+            if len(x) < 2 or np.min(np.abs(x - depth)) > min_diff_to_depth:
+                continue
+            out[i] = interp1d(x, y, "linear", fill_value="extrapolate")(depth)
+        if pd.Series(out[:5]).std() > 0.1:
+            out[:5] = np.nan
+        return out
+
+    def test_linear_matches_interp1d(self):
+        df = interpolate_temperature(
+            self.dates, self.depth, self.temp,
+            kind="linear", min_diff_to_depth=1.5,
+        )
+        self.assertListEqual(list(df.columns), ["date", "temperatureObserved"])
+        np.testing.assert_allclose(
+            df["temperatureObserved"].values, self._expected(10, 1.5), rtol=1e-12
+        )
+        self.assertTrue(np.isnan(df["temperatureObserved"].values[4]))
+
+    def test_multiple_depths(self):
+        depths = [1, 5, 10]
+        df = interpolate_temperature(
+            self.dates, self.depth, self.temp, depth=depths,
+            kind="linear", min_diff_to_depth=1.5,
+        )
+        self.assertListEqual(list(df.columns), ["date", 1.0, 5.0, 10.0])
+        for d in depths:
+            np.testing.assert_allclose(
+                df[d].values, self._expected(d, 1.5), rtol=1e-12
+            )
+
+    def test_min_diff_to_depth(self):
+        depth = np.array([[1.0, 2.0, 3.0], [1.0, 2.0, 9.5]])
+        temp = np.array([[-1.0, -2.0, -3.0], [-1.0, -2.0, -9.5]])
+        df = interpolate_temperature(
+            self.dates[:2], depth, temp, kind="linear", min_diff_to_depth=1.5,
+        )
+        self.assertTrue(np.isnan(df["temperatureObserved"].values[0]))
+        self.assertAlmostEqual(df["temperatureObserved"].values[1], -10.0)
+
+
+class ThermistorDepthTestCase(unittest.TestCase):
+    @staticmethod
+    def _expected(df, station_config, ini_depth):
+        # depths reset at each maintenance as in the original row-wise loop;
+        # entries without installation depths only mark the days after which
+        # the thermistors adapt
+        num_therm = len(ini_depth)
+        depth_cols = [f"d_t_i_{i}" for i in range(1, num_therm + 1)]
+        temp_cols = [f"t_i_{i}" for i in range(num_therm)]
+        maintenance = pd.DataFrame(
+            station_config.get("string_maintenance", []),
+            columns=["date", "installation_depths"],
+        )
+        maintenance["date"] = pd.to_datetime(maintenance["date"])
+        maintenance = maintenance.sort_values(by="date")
+
+        z_surf = df["z_surf_combined"].copy()
+        z_surf[z_surf.rolling(window=14, center=True).var() > 0.1] = np.nan
+        z_surf = z_surf.interpolate()
+        out = pd.DataFrame(index=df.index)
+        for i, col in enumerate(depth_cols):
+            out[col] = ini_depth[i] + z_surf.values - z_surf[z_surf.first_valid_index()]
+        for date, new_depth in zip(maintenance.date, maintenance.installation_depths):
+            if date > z_surf.last_valid_index() or isinstance(new_depth, str):
+                continue
+            for i, col in enumerate(depth_cols[:len(new_depth)]):
+                out.loc[date:, col] = (
+                    new_depth[i] + z_surf[date:].values
+                    - z_surf[date:][z_surf[date:].first_valid_index()]
+                )
+        for i, col in enumerate(temp_cols):
+            temp = df[col].copy()
+            for date, new_depth in zip(maintenance.date, maintenance.installation_depths):
+                if isinstance(new_depth, str):
+                    temp[np.abs(temp.index - date) < pd.Timedelta("7D")] = np.nan
+            temp[out[depth_cols[i]] < 0.1] = np.nan
+            out[col] = temp.values
+            out.loc[out[depth_cols[i]] < 0, depth_cols[i]] = np.nan
+        return out[depth_cols + temp_cols]
+
+    def _data(self, num_therm, seed):
+        rng = np.random.default_rng(seed)
+        time = pd.date_range("2019-06-01", periods=24 * 400, freq="h")
+        z_surf = np.cumsum(rng.normal(0, 0.01, len(time))) + np.linspace(0, -3, len(time))
+        df = pd.DataFrame({"z_surf_combined": z_surf}, index=time)
+        for i in range(num_therm):
+            df[f"t_i_{i}"] = rng.normal(-10, 2, len(time))
+        df.iloc[:100, 0] = np.nan
+        df.iloc[rng.integers(0, len(time), 500), 0] = np.nan
+        return df
+
+    def test_same_as_row_wise(self):
+        for num_therm, ini_depth in [
+            (8, [1, 2, 3, 4, 5, 6, 7, 10]),
+            (11, [0, 0.5, 1.5, 2.5, 3.5, 4.5, 5.5, 6.5, 7.5, 8.5, 9.5]),
+        ]:
+            for seed in range(3):
+                df = self._data(num_therm, seed)
+                station_config = {"string_maintenance": [
+                    {"date": "2019-12-01", "installation_depths": [1.0, 2.5, 3.5]},
+                    # reset where the surface height is still missing
+                    {"date": "2019-06-02", "installation_depths": list(range(1, num_therm + 1))},
+                    {"date": "2020-03-15", "installation_depths": "not reinstalled"},
+                    {"date": "2020-05-01", "installation_depths": list(range(num_therm + 2))},
+                    # after the end of the record
+                    {"date": "2021-01-01", "installation_depths": [0.0] * num_therm},
+                ]}
+                expected = self._expected(df.copy(), station_config, ini_depth)
+                output = df.copy()
+                depth = get_thermistor_depth(output, "TEST", station_config)
+                columns = [c for c in expected.columns if c.startswith("d_t_i_")]
+                np.testing.assert_allclose(
+                    expected[columns].values, depth[columns].values, atol=1e-9, rtol=0,
+                    err_msg=f"{num_therm} {seed}",
+                )
+                columns = [c for c in expected.columns if c.startswith("t_i_")]
+                np.testing.assert_array_equal(expected[columns].values, output[columns].values)
+                # the thermistors adapting after the maintenance
+                self.assertTrue(output.loc["2020-03-10":"2020-03-20", columns].isnull().all().all())
+
+    def test_no_surface_height(self):
+        df = self._data(8, 0)
+        df["z_surf_combined"] = np.nan
+        depth = get_thermistor_depth(df, "TEST", {})
+        self.assertTrue(depth.isnull().all().all())
+
+
+class FillShortGapsTestCase(unittest.TestCase):
+    def test_fill_short_gaps(self):
+        time = pd.date_range("2020-01-01", periods=12, freq="D").values
+        values = np.array(
+            [np.nan, 5, 5, np.nan, np.nan, 4, 4, np.nan, np.nan, 3.995, np.nan, np.nan]
+        )
+        output = fill_short_gaps(
+            time, values, max_duration=np.timedelta64(365, "D"), max_diff=0.01
+        )
+        expected = np.array(
+            [5, 5, 5, np.nan, np.nan, 4, 4, 4, 4, 3.995, 3.995, 3.995]
+        )
+        np.testing.assert_array_equal(expected, output)
+        self.assertTrue(np.isnan(values[0]))
+
+    def test_long_gaps_not_filled(self):
+        time = pd.date_range("2020-01-01", periods=6, freq="100D").values
+        values = np.array([np.nan, 1, np.nan, np.nan, np.nan, 1])
+        output = fill_short_gaps(
+            time, values, max_duration=np.timedelta64(365, "D"), max_diff=0.01
+        )
+        np.testing.assert_array_equal([1, 1, np.nan, np.nan, np.nan, 1], output)
+
+
+class PiecewiseSmoothingTestCase(unittest.TestCase):
+    def test_piecewise_regression(self):
+        index = pd.date_range("2020-01-01", periods=10, freq="D")
+        x = np.arange(10.0)
+        df = pd.DataFrame({"lat": 2 * x + 1, "alt": -x}, index=index)
+        df.iloc[[0, 4, 9], 0] = np.nan
+        df.iloc[5, 1] = np.nan
+        # relocation: the line changes after the break
+        df.iloc[6:, 1] += 100
+
+        output = piecewise_smoothing_and_interpolation(
+            df, [index[6] - pd.Timedelta("12h")])
+
+        # the regression line is extrapolated over the whole period
+        np.testing.assert_allclose(output[:, 0], 2 * x + 1)
+        np.testing.assert_allclose(output[:, 1], -x + np.r_[np.zeros(6), np.full(4, 100)])
+
+    def test_few_observations_interpolated(self):
+        index = pd.date_range("2020-01-01", periods=5, freq="h")
+        series = pd.Series([1.0, np.nan, 3.0, np.nan, np.nan], index=index)
+        output = piecewise_smoothing_and_interpolation(series, [])
+        self.assertEqual(output.shape, (5,))
+        np.testing.assert_allclose(output, [1, 2, 3, np.nan, np.nan])
+
+
+class CombineSurfaceHeightTestCase(unittest.TestCase):
+    @staticmethod
+    def _series(freq, gaps=False):
+        # three ablation seasons at 2 cm/day, with snow accumulating in winter
+        time = pd.date_range("2018-09-01", "2021-10-01", freq=freq)
+        days = ((time - time[0]) / pd.Timedelta("1D")).values
+        doy = time.dayofyear.values
+        melt = np.where((doy > 166) & (doy < 244), -0.02, 0.0)
+        ice = np.cumsum(melt) * (days[1] - days[0])
+        snow = np.where(doy > 250, doy - 250, doy + 115) / 300 * 0.6
+        snow = np.where((doy > 140) & (doy <= 166), snow * (166 - doy) / 26, snow)
+        snow = np.where((doy > 166) & (doy <= 250), 0, snow)
+        noise = 0.005 * np.sin(days * 2 * np.pi / 0.9)
+        df = pd.DataFrame(
+            {
+                "z_surf_1": ice + snow + 1.2 + noise,
+                "z_surf_2": ice + snow - 0.4 - noise,
+                "z_ice_surf": ice + 0.3 + noise,
+            },
+            index=pd.DatetimeIndex(time, name="time"),
+        )
+        # raised boom and missing stake readings
+        df.loc["2020-04-20":, "z_surf_1"] += 0.8
+        df.loc["2019-10-01":"2020-01-15", "z_surf_2"] = np.nan
+        if gaps:
+            # spikes
+            df.iloc[np.arange(100, len(df), 997), 0] += 2
+            df.iloc[np.arange(300, len(df), 1499), 2] -= 1.5
+            # the pressure transducer fails in the first season and is
+            # replaced at a new level the next summer
+            df.loc["2019-07-10":"2020-06-25", "z_ice_surf"] = np.nan
+            df.loc["2020-06-25":, "z_ice_surf"] += 1.1
+            # station off in winter, short gaps
+            df.loc["2020-12-20":"2021-03-05"] = np.nan
+            df.loc["2019-03-01":"2019-03-02", "z_surf_1"] = np.nan
+            df.loc["2021-07-01 05:00":"2021-07-01 20:00", "z_ice_surf"] = np.nan
+        return df
+
+    def test_hourly_reference(self):
+        # 6-hourly samples of the outputs of combine_surface_height from
+        # before it used time windows, for the hourly series with gaps
+        reference = pd.read_csv(
+            TEST_DATA_ROOT_PATH / "combine_surface_height_hourly.csv.gz",
+            index_col="time", parse_dates=["time"],
+        )
+        output = combine_surface_height(self._series("h", gaps=True), "ablation")
+        for name, values in zip(SURFACE_HEIGHT_OUTPUTS, output):
+            np.testing.assert_allclose(
+                values[reference.index].values, reference[name].values,
+                atol=1e-5, err_msg=name,
+            )
+
+    def test_not_hourly(self):
+        hourly = combine_surface_height(self._series("h"), "ablation")
+        for freq in ["10min", "3h"]:
+            output = combine_surface_height(self._series(freq), "ablation")
+            # z_surf_2_adj is interpolated over a number of time steps
+            for name, values, expected in zip(SURFACE_HEIGHT_OUTPUTS[:3], output, hourly):
+                time = values.index.intersection(expected.index)
+                diff = np.abs(values[time] - expected[time]).dropna()
+                self.assertGreater(len(diff), 0.9 * len(time))
+                self.assertLess(diff.quantile(0.95), 0.02, f"{freq} {name}")
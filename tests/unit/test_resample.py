@@ -0,0 +1,127 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from pypromice.process.resample import (
+    ResampleAccumulator,
+    calculateSaturationVaporPressure,
+    group_sums,
+    resample_dataset,
+    resample_products,
+)
+
+
+class ResampleDatasetTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        time = pd.date_range("2021-01-01", "2021-03-10", freq="h")
+        # data gap longer than a day
+        time = time[(time < "2021-02-01") | (time > "2021-02-03")]
+        n = len(time)
+        self.ds = xr.Dataset(
+            {
+                "t_u": ("time", rng.normal(-10, 5, n), {"units": "degrees_C"}),
+                "rh_u": ("time", rng.uniform(50, 100, n)),
+                "wspd_u": ("time", rng.uniform(0, 10, n)),
+                "wdir_u": ("time", rng.uniform(0, 360, n)),
+                "p_u": ("time", np.where(rng.random(n) < 0.2, np.nan, 900.0)),
+                "flag": ("time", np.full(n, "OK")),
+            },
+            coords={"time": time},
+            attrs={"station_id": "TEST"},
+        )
+
+    def test_mean(self):
+        for t in ["1D", "M"]:
+            ds_d = resample_dataset(self.ds, t)
+            expected = self.ds[["t_u", "p_u"]].to_dataframe().resample(t).mean()
+            np.testing.assert_array_equal(ds_d.time.values, expected.index.values)
+            for var in ["t_u", "p_u"]:
+                np.testing.assert_allclose(ds_d[var].values, expected[var].values, rtol=1e-12)
+        self.assertNotIn("flag", ds_d)
+        self.assertEqual(ds_d.t_u.attrs, {"units": "degrees_C"})
+        self.assertEqual(ds_d.attrs, self.ds.attrs)
+
+    def test_wind_direction_and_humidity(self):
+        ds_d = resample_dataset(self.ds, "1D")
+        df = self.ds.to_dataframe()
+        # the directional wind speeds are added to the output
+        wspd_x = (df.wspd_u * np.sin(np.deg2rad(df.wdir_u))).resample("1D").mean()
+        wspd_y = (df.wspd_u * np.cos(np.deg2rad(df.wdir_u))).resample("1D").mean()
+        np.testing.assert_allclose(ds_d.wspd_x_u.values, wspd_x.values, rtol=1e-9)
+        wdir = (np.rad2deg(np.arctan2(wspd_x, wspd_y)) + 360) % 360
+        np.testing.assert_allclose(ds_d.wdir_u.values, wdir.values, rtol=1e-9)
+
+        es_wtr, _ = calculateSaturationVaporPressure(self.ds.t_u)
+        p_vap = (self.ds.rh_u / 100 * es_wtr).to_series().resample("1D").mean()
+        rh = p_vap / es_wtr.to_series().resample("1D").mean() * 100
+        np.testing.assert_allclose(ds_d.rh_u.values, rh.values, rtol=1e-12)
+
+    def test_group_sums(self):
+        values = np.array([[1.0, np.nan, 3.0, 4.0, np.nan], [np.nan] * 5])
+        sums, counts = group_sums(values, np.array([2, 0, 3]))
+        np.testing.assert_array_equal(sums, [[1, 0, 7], [0, 0, 0]])
+        np.testing.assert_array_equal(counts, [[1, 0, 2], [0, 0, 0]])
+
+
+class ResampleProductsTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        time = pd.date_range("2020-12-25", "2021-03-05", freq="10min")
+        n = len(time)
+        t_u = rng.normal(-5, 3, n)
+        t_u[rng.random(n) < 0.3] = np.nan
+        self.ds = xr.Dataset(
+            {
+                "t_u": ("time", t_u),
+                "p_u": ("time", rng.normal(900, 5, n)),
+                "rh_u": ("time", rng.uniform(50, 100, n)),
+                "rh_u_wrt_ice_or_water": ("time", rng.uniform(50, 100, n)),
+                "wspd_u": ("time", rng.uniform(0, 10, n)),
+                "wdir_u": ("time", rng.uniform(0, 360, n)),
+            },
+            coords={"time": time},
+            attrs={"station_id": "TEST"},
+        )
+        wdir = np.deg2rad(self.ds.wdir_u)
+        self.ds["wspd_x_u"] = self.ds.wspd_u * np.sin(wdir)
+        self.ds["wspd_y_u"] = self.ds.wspd_u * np.cos(wdir)
+
+    def test_products_match_direct_resampling(self):
+        products = resample_products(self.ds, ["60min", "1D", "M"])
+        for t, resampled in products.items():
+            expected = resample_dataset(self.ds, t)
+            self.assertListEqual(list(expected.data_vars), list(resampled.data_vars))
+            np.testing.assert_array_equal(expected.time.values, resampled.time.values)
+            for var in expected.data_vars:
+                np.testing.assert_allclose(
+                    resampled[var].values, expected[var].values, rtol=1e-12, err_msg=var
+                )
+
+    def test_rollup_and_update(self):
+        hourly = ResampleAccumulator.from_dataset(self.ds, "60min")
+        daily = ResampleAccumulator.from_dataset(self.ds, "1D")
+        rolled = hourly.rollup("1D")
+        np.testing.assert_array_equal(rolled.index, daily.index)
+        np.testing.assert_array_equal(rolled.counts, daily.counts)
+        np.testing.assert_allclose(rolled.sums, daily.sums, rtol=1e-12)
+
+        # adding the data received after a cut to the persisted accumulator
+        cut = pd.Timestamp("2021-02-10 13:00")
+        first = ResampleAccumulator.from_dataset(self.ds.sel(time=slice(None, cut)), "60min")
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = Path(tmpdirname) / "accumulator.nc"
+            first.to_netcdf(path)
+            first = ResampleAccumulator.open(path)
+        self.assertListEqual(first.aux_columns, hourly.aux_columns)
+        new = ResampleAccumulator.from_dataset(
+            self.ds.sel(time=slice(cut.floor("1D"), None)), "60min"
+        )
+        updated = first.update(new)
+        np.testing.assert_array_equal(updated.index, hourly.index)
+        np.testing.assert_array_equal(updated.counts, hourly.counts)
+        np.testing.assert_allclose(updated.sums, hourly.sums, rtol=1e-12)
@@ -0,0 +1,41 @@
+import os
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+import pypromice.resources
+from pypromice.resources import FrozenDict, load_metadata, load_variables
+
+
+class ResourcesTestCase(unittest.TestCase):
+    def test_metadata_is_read_only(self):
+        meta = load_metadata()
+        self.assertIsInstance(meta, FrozenDict)
+        self.assertIs(meta, load_metadata(pypromice.resources.DEFAULT_METADATA_PATH))
+        self.assertIs(meta, pypromice.resources.metadata)
+        with self.assertRaises(TypeError):
+            meta["acknowledgements"] = "changed"
+        with self.assertRaises(TypeError):
+            meta.update(acknowledgements="changed")
+        self.assertEqual(meta, pickle.loads(pickle.dumps(meta)))
+        copy = dict(meta)
+        copy["acknowledgements"] = "changed"
+        self.assertNotEqual("changed", load_metadata()["acknowledgements"])
+
+    def test_variables_are_not_shared(self):
+        vars_df = load_variables()
+        vars_df.loc["t_u", "units"] = "K"
+        vars_df["new"] = 1
+        self.assertEqual("degrees_C", load_variables().loc["t_u", "units"])
+        self.assertNotIn("new", pypromice.resources.variables.columns)
+
+    def test_reload_modified_file(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = Path(tmpdirname) / "attributes.csv"
+            path.write_text("title,first\n")
+            self.assertEqual("first", load_metadata(path)["title"])
+            path.write_text("title,second\n")
+            stat = path.stat()
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertEqual("second", load_metadata(str(path))["title"])
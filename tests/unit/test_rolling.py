@@ -0,0 +1,46 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pypromice.utilities.rolling import rolling_median, rolling_median_time
+
+
+class RollingMedianTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        n = 2000
+        self.series = pd.Series(
+            rng.normal(size=n), index=pd.date_range("2020-01-01", periods=n, freq="h")
+        )
+        self.series[rng.random(n) < 0.3] = np.nan
+
+    def test_rolling_median_matches_pandas(self):
+        for window, min_periods in [(24, None), (168, 10), (5000, 1)]:
+            expected = self.series.rolling(window, min_periods=min_periods).median()
+            output = rolling_median(self.series.values, window, min_periods)
+            np.testing.assert_array_equal(expected.values, output)
+
+    def test_rolling_median_2d(self):
+        values = np.column_stack([self.series.values, self.series.values[::-1]])
+        output = rolling_median(values, 24, 1)
+        for i in range(2):
+            np.testing.assert_array_equal(output[:, i], rolling_median(values[:, i], 24, 1))
+
+    def test_rolling_median_time_matches_pandas(self):
+        for window in ["14D", "1D", "5h", "7h", "30min"]:
+            for center in [True, False]:
+                for min_periods in [1, 3]:
+                    expected = self.series.rolling(
+                        window, center=center, min_periods=min_periods
+                    ).median()
+                    output = rolling_median_time(
+                        self.series, window, center=center, min_periods=min_periods
+                    )
+                    pd.testing.assert_series_equal(expected, output)
+
+    def test_rolling_median_time_irregular_index(self):
+        series = self.series.drop(self.series.index[[3, 50, 51, 700]])
+        expected = series.rolling("1D", center=True, min_periods=1).median()
+        output = rolling_median_time(series, "1D", center=True)
+        pd.testing.assert_series_equal(expected, output)
@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import pypromice.resources
+from pypromice.process.variable_catalog import VariableCatalog, round_variables
+
+
+class VariableCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.vars_df = pypromice.resources.load_variables()
+        self.catalog = VariableCatalog.from_dataframe(self.vars_df)
+
+    def test_column_names(self):
+        for level in ["L0", "L2", "L3"]:
+            at_level = self.vars_df.loc[self.vars_df[level] == 1]
+            self.assertListEqual(list(at_level.index), self.catalog.column_names(level))
+        l2 = self.vars_df.loc[self.vars_df["L2"] == 1]
+        for booms, station_type in [(1, "one-boom"), (2, "two-boom")]:
+            expected = l2.loc[l2["station_type"].isin([station_type, "all"])]
+            self.assertListEqual(list(expected.index), self.catalog.column_names("L2", booms))
+        # the number of booms is not used above L2
+        self.assertListEqual(self.catalog.column_names("L3"), self.catalog.column_names("L3", 1))
+        self.assertIs(self.catalog, VariableCatalog.of(self.catalog))
+
+    def test_round_and_attributes(self):
+        rng = np.random.default_rng(8)
+        n = 100
+        ds = xr.Dataset(
+            {
+                "t_u": ("time", rng.normal(-10, 5, n)),
+                "gps_lat": ("time", rng.normal(70, 1, n)),
+                "gps_time": ("time", rng.normal(0, 1, n)),
+                "rec": ("time", np.arange(n)),
+            },
+            coords={"time": pd.date_range("2023-01-01", periods=n, freq="h")},
+        )
+        rounded = self.catalog.add_attributes(self.catalog.round(ds))
+        for var in ["t_u", "gps_lat"]:
+            decimals = int(self.vars_df.loc[var, "max_decimals"])
+            np.testing.assert_array_equal(np.round(ds[var].values, decimals), rounded[var].values)
+            self.assertEqual(self.vars_df.loc[var, "units"], rounded[var].attrs["units"])
+        # no decimals in the look-up table
+        np.testing.assert_array_equal(ds.gps_time.values, rounded.gps_time.values)
+        np.testing.assert_array_equal(ds.rec.values, rounded.rec.values)
+        # the input dataset is not modified, the time coordinate is not annotated
+        self.assertFalse(np.array_equal(ds.t_u.values, rounded.t_u.values))
+        self.assertEqual({}, rounded.time.attrs)
+
+    def test_round_variables_not_along_time(self):
+        ds = xr.Dataset({"a": (("x", "y"), [[1.234, 5.678]]), "b": ("time", [0.55])})
+        rounded = round_variables(ds, {"a": 1, "b": 0})
+        np.testing.assert_array_equal([[1.2, 5.7]], rounded.a.values)
+        np.testing.assert_array_equal([1.0], rounded.b.values)
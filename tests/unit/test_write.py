@@ -0,0 +1,327 @@
+import gzip
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from pypromice.process.write import (
+    getColNames,
+    prepare_and_write,
+    roundValues,
+    updateCSV,
+    updateNC,
+    writeCSV,
+    writeNC,
+    writeParquet,
+    writeZarr,
+    writeZarrCollection,
+    write_products,
+)
+
+
+class WriteCSVTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        n = 250
+        self.ds = xr.Dataset(
+            {
+                "t_u": ("time", rng.normal(-10, 5, n)),
+                "p_u": ("time", rng.normal(900, 10, n)),
+                "gps_numsat": ("time", rng.integers(0, 12, n).astype(float)),
+            },
+            coords={"time": pd.date_range("2023-01-01", periods=n, freq="h")},
+        )
+        self.ds["t_u"][::3] = np.nan
+        # rows without any value are not written
+        for v in self.ds.data_vars:
+            self.ds[v][10:20] = np.nan
+        self.vars_df = pd.DataFrame(
+            {"max_decimals": [2, 4, np.nan]},
+            index=pd.Index(["t_u", "p_u", "gps_numsat"], name="field"),
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_same_as_pandas(self):
+        names = ["p_u", "t_u", "gps_numsat"]
+        expected_path = self.root / "expected.csv"
+        rounded = roundValues(self.ds.copy(), self.vars_df)
+        rounded.to_dataframe().dropna(how="all")[names].to_csv(expected_path)
+
+        output_path = self.root / "output.csv"
+        writeCSV(output_path, self.ds, names, vars_df=self.vars_df, chunk_size=7)
+        self.assertEqual(expected_path.read_text(), output_path.read_text())
+
+    def test_daily_time_format(self):
+        ds = self.ds.assign_coords(
+            time=pd.date_range("2023-01-01", periods=self.ds.sizes["time"], freq="D")
+        )
+        writeCSV(self.root / "day.csv", ds, None)
+        df = pd.read_csv(self.root / "day.csv")
+        self.assertEqual("2023-01-01", df.time[0])
+        self.assertListEqual(["time", "t_u", "p_u", "gps_numsat"], list(df.columns))
+
+    def test_gzip(self):
+        writeCSV(self.root / "output.csv", self.ds, None, vars_df=self.vars_df)
+        writeCSV(self.root / "output.csv.gz", self.ds, None, vars_df=self.vars_df)
+        pd.testing.assert_frame_equal(
+            pd.read_csv(self.root / "output.csv"),
+            pd.read_csv(self.root / "output.csv.gz"),
+        )
+        with self.assertRaises(ValueError):
+            writeCSV(self.root / "output.csv", self.ds, None, compression="lzma")
+
+
+class ColumnNamesTestCase(unittest.TestCase):
+    def setUp(self):
+        n = 72
+        names = ["p_u", "p_i", "t_i", "rh_i", "wspd_i", "t_u", "rh_u", "z_boom_u"]
+        self.vars_df = pd.DataFrame(
+            {"L3": 1, "max_decimals": 2.0, "station_type": "all"},
+            index=pd.Index(names, name="field"),
+        )
+        self.ds = xr.Dataset(
+            {v: ("time", np.linspace(0, 1, n)) for v in names},
+            coords={"time": pd.date_range("2023-01-01", periods=n, freq="h")},
+            attrs={"level": "L3", "site_id": "SITE"},
+        )
+
+    def test_remove_nan_fields(self):
+        # consecutive variables to remove, missing or without any value
+        ds = self.ds.drop_vars(["p_i", "t_i"])
+        ds["rh_i"][:] = np.nan
+        ds["wspd_i"][:] = np.nan
+        ds["t_u"][:] = np.nan
+        ds["rh_u"][1:] = np.nan
+        self.assertListEqual(list(self.vars_df.index), getColNames(self.vars_df, ds))
+        self.assertListEqual(
+            ["p_u", "rh_u", "z_boom_u"],
+            getColNames(self.vars_df, ds, remove_nan_fields=True),
+        )
+
+    def test_no_instantaneous_in_daily_products(self):
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = Path(tmpdirname)
+            write_products(self.ds, root, ["60min", "1D"], vars_df=self.vars_df,
+                           meta_dict={})
+            hour = pd.read_csv(root / "SITE" / "SITE_hour.csv")
+            day = pd.read_csv(root / "SITE" / "SITE_day.csv")
+        self.assertListEqual(["time"] + list(self.vars_df.index), list(hour.columns))
+        self.assertListEqual(["time", "p_u", "t_u", "rh_u", "z_boom_u"], list(day.columns))
+
+    def test_single_time_step(self):
+        ds = self.ds.isel(time=[0])
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            root = Path(tmpdirname)
+            # resampled products of length 1 are not written
+            write_products(ds, root, ["60min", "1D"], vars_df=self.vars_df, meta_dict={})
+            self.assertFalse((root / "SITE").exists())
+            # datasets written without resampling are
+            prepare_and_write(ds, root, self.vars_df, {}, resample=False)
+            hour = pd.read_csv(root / "SITE" / "SITE_hour.csv")
+            write_products(ds, root, ["1D", "M"], vars_df=self.vars_df, meta_dict={},
+                           resample=False)
+            self.assertTrue((root / "SITE" / "SITE_day.nc").exists())
+            self.assertTrue((root / "SITE" / "SITE_month.nc").exists())
+        self.assertEqual(1, len(hour))
+        self.assertEqual(self.ds.p_u.values[0], hour.p_u[0])
+
+
+class UpdateTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        n = 500
+        self.ds = xr.Dataset(
+            {
+                "t_u": ("time", rng.normal(-10, 5, n)),
+                "z_boom_u": ("time", rng.uniform(0.5, 3, n)),
+            },
+            coords={"time": pd.date_range("2023-01-01", periods=n, freq="h")},
+            attrs={"date_created": "2024-01-01", "time_coverage_end": "2023-01-21"},
+        )
+        self.ds["t_u"][100:110] = np.nan
+        self.vars_df = pd.DataFrame(
+            {"max_decimals": [2, 2], "lo": [-80, 0.3], "hi": [40, 10]},
+            index=["t_u", "z_boom_u"],
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, name, ds):
+        writeNC(self.root / f"{name}.nc", ds, compression=True, vars_df=self.vars_df)
+        writeCSV(self.root / f"{name}.csv", ds, None, vars_df=self.vars_df)
+
+    def _update(self, name, ds):
+        since = updateNC(self.root / f"{name}.nc", ds, compression=True, vars_df=self.vars_df)
+        if since is not None:
+            updateCSV(self.root / f"{name}.csv", ds, None, since, vars_df=self.vars_df)
+        return since
+
+    def _assert_same_files(self, name, expected_name):
+        self.assertEqual(
+            (self.root / f"{expected_name}.csv").read_text(),
+            (self.root / f"{name}.csv").read_text(),
+        )
+        with xr.open_dataset(self.root / f"{name}.nc") as ds, \
+                xr.open_dataset(self.root / f"{expected_name}.nc") as expected:
+            xr.testing.assert_identical(expected, ds)
+
+    def test_update(self):
+        self._write("updated", self.ds.isel(time=slice(0, 450)))
+        ds = self.ds.copy(deep=True)
+        ds["z_boom_u"][440] = 1.5
+        ds.attrs.update(date_created="2024-02-01", time_coverage_end="2023-01-21T19")
+        self.assertEqual(ds.time[440], self._update("updated", ds))
+
+        ds.attrs["date_created"] = "2024-01-01"
+        self._write("expected", ds)
+        self._assert_same_files("updated", "expected")
+        self.assertIsNone(self._update("updated", ds))
+
+    def test_update_damaged_csv(self):
+        ds = self.ds.isel(time=slice(0, 450))
+        self._write("expected", ds)
+        csv = self.root / "updated.csv"
+        expected = (self.root / "expected.csv").read_text()
+        lines = expected.splitlines(keepends=True)
+        for damaged in [None, "".join(lines[:-1]), expected[:-20], lines[0]]:
+            for since in [None, ds.time.values[300]]:
+                if damaged is None:
+                    csv.unlink(missing_ok=True)
+                else:
+                    csv.write_text(damaged)
+                updateCSV(csv, ds, None, since, vars_df=self.vars_df)
+                self.assertEqual(expected, csv.read_text())
+
+        # the file is not written again when it matches the data
+        mtime = csv.stat().st_mtime_ns
+        updateCSV(csv, ds, None, None, vars_df=self.vars_df)
+        self.assertEqual(mtime, csv.stat().st_mtime_ns)
+
+    def test_update_csv_compression(self):
+        ds = self.ds.assign_attrs(station_id="TEST", level="L2")
+        vars_df = self.vars_df.assign(L2=1, station_type="all")
+        for csv_compression in [None, "gzip"]:
+            write_products(ds, self.root, ["60min"], vars_df=vars_df, meta_dict={},
+                           resample=False, csv_compression=csv_compression, update=True)
+        csv = self.root / "TEST" / "TEST_hour.csv"
+        gz = csv.with_name(csv.name + ".gz")
+        pd.testing.assert_frame_equal(pd.read_csv(csv), pd.read_csv(gz))
+        # a compressed file that does not match the data is written again
+        with gzip.open(gz, "wt") as f:
+            f.write(csv.read_text()[:-100])
+        write_products(ds, self.root, ["60min"], vars_df=vars_df, meta_dict={},
+                       resample=False, csv_compression="gzip", update=True)
+        pd.testing.assert_frame_equal(pd.read_csv(csv), pd.read_csv(gz))
+
+    def test_full_rewrite(self):
+        self._write("updated", self.ds.isel(time=slice(0, 450)))
+        ds = self.ds.copy(deep=True)
+        # value that does not fit in the packed data type of the file
+        ds["z_boom_u"][460] = 400
+        self.assertEqual(ds.time[0], self._update("updated", ds))
+        self._write("expected", ds)
+        self._assert_same_files("updated", "expected")
+        with xr.open_dataset(self.root / "updated.nc") as updated:
+            self.assertEqual("int32", updated.z_boom_u.encoding["dtype"])
+
+
+@unittest.skipUnless(importlib.util.find_spec("zarr"), "zarr is not installed")
+class ZarrTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(6)
+        self.vars_df = pd.DataFrame(
+            {"max_decimals": [2, 2], "lo": [-80, 0.3], "hi": [40, 10]},
+            index=["t_u", "z_boom_u"],
+        )
+        self.datasets = {}
+        for name, start, n in [("A", "2023-01-01", 800), ("B", "2023-01-10", 600)]:
+            self.datasets[name] = xr.Dataset(
+                {
+                    "t_u": ("time", rng.normal(-10, 5, n), {"units": "degrees_C"}),
+                    "z_boom_u": ("time", rng.uniform(0.5, 3, n)),
+                },
+                coords={"time": pd.date_range(start, periods=n, freq="h")},
+                attrs={"latitude": 70.0 + n / 100, "station_id": name},
+            )
+        self.datasets["B"] = self.datasets["B"].drop_vars("z_boom_u")
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_write_zarr(self):
+        ds = self.datasets["A"]
+        writeNC(self.root / "A.nc", ds, vars_df=self.vars_df)
+        # an existing store is replaced
+        for _ in range(2):
+            writeZarr(self.root / "A.zarr", ds, vars_df=self.vars_df)
+        with xr.open_dataset(self.root / "A.nc") as expected:
+            zarr_ds = xr.open_zarr(self.root / "A.zarr")
+            xr.testing.assert_identical(expected.load(), zarr_ds.load())
+            self.assertEqual((800,), zarr_ds.t_u.encoding["chunks"])
+
+    def test_write_zarr_collection(self):
+        writeZarrCollection(self.root / "all.zarr", self.datasets, vars_df=self.vars_df)
+        collection = xr.open_zarr(self.root / "all.zarr")
+        self.assertListEqual(["A", "B"], list(collection.station.values))
+        self.assertEqual((1, 816), collection.t_u.encoding["chunks"])
+        np.testing.assert_array_equal([78.0, 76.0], collection.latitude.values)
+        for name, ds in self.datasets.items():
+            t_u = collection.t_u.sel(station=name, time=ds.time)
+            np.testing.assert_allclose(ds.t_u.round(2).values, t_u.values)
+        self.assertTrue(collection.z_boom_u.sel(station="B").isnull().all())
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+class ParquetTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.datasets = {}
+        for name, start, n in [("A", "2022-11-01", 2000), ("B", "2023-01-10", 600)]:
+            self.datasets[name] = xr.Dataset(
+                {"t_u": ("time", rng.normal(-10, 5, n))},
+                coords={"time": pd.date_range(start, periods=n, freq="h")},
+                attrs={"station_id": name},
+            )
+        self.datasets["A"]["z_boom_u"] = ("time", rng.uniform(0.5, 3, 2000))
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_write_and_read(self):
+        from pypromice.get import aws_parquet
+
+        for ds in self.datasets.values():
+            writeParquet(self.root, ds)
+        # the partitions of a station are replaced
+        writeParquet(self.root, self.datasets["A"].sel(time=slice("2023", None)))
+        files = sorted(p.relative_to(self.root).as_posix() for p in self.root.rglob("*.parquet"))
+        self.assertListEqual(
+            ["station=A/year=2023/data.parquet", "station=B/year=2023/data.parquet"], files
+        )
+
+        df = aws_parquet(self.root, start="2023-01-20", end="2023-01-21 23:00")
+        self.assertListEqual(["A", "B"], list(df.index.levels[0]))
+        self.assertEqual(96, len(df))
+        for name, ds in self.datasets.items():
+            expected = ds.t_u.sel(time=slice("2023-01-20", "2023-01-21 23:00")).values
+            np.testing.assert_array_equal(expected, df.loc[name].t_u.values)
+        self.assertTrue(df.loc["B"].z_boom_u.isnull().all())
+
+        df = aws_parquet(self.root, stations=["B"], variables=["t_u"])
+        self.assertListEqual(["t_u"], list(df.columns))
+        self.assertEqual(600, len(df))